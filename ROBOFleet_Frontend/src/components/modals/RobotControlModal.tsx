@@ -62,6 +62,17 @@ const RobotControlModal: React.FC<RobotControlModalProps> = ({
     };
   }, [manualActive]);
 
+  // The teleop session ends itself when the robot link is lost
+  useEffect(() => {
+    return manualControl.onError((message) => {
+      setManualActive(false);
+      keysPressed.current.clear();
+      setCurrentLinear(0);
+      setCurrentAngular(0);
+      toast.error(`Manual control stopped: ${message}`);
+    });
+  }, []);
+
   /**
    * ✅ NEW: Load locations dynamically from robot
    * - For Temi: Fetch saved locations from Temi robot itself
@@ -191,7 +202,7 @@ const RobotControlModal: React.FC<RobotControlModalProps> = ({
         setManualActive(true);
         toast.success("🎮 Manual control active (Temi)");
       } else {
-        const started = await manualControl.start();
+        const started = await manualControl.start(robot.sn);
         
         if (started) {
           setManualActive(true);
@@ -23,11 +23,12 @@ import {
 } from "lucide-react";
 import  api  from "../services/api";
 import { robotStatusService } from "../services/robotStatusService";
+import { fleetFeed, fleetStatus, FleetDocument } from "../services/fleetFeed";
 
 interface RobotData {
   id: string;
   name: string;
-  status: "Online" | "Offline" | "Idle" | "Charging";
+  status: "Online" | "Offline" | "Idle" | "Charging" | "Error";
   battery: number;
   location: string;
   statusColor: string;
@@ -59,6 +60,35 @@ interface RegisteredRobot {
   name?: string;
 }
 
+// Live status, battery and location from the fleet feed
+const withFleet = (robot: RobotData, fleet: FleetDocument | null): RobotData => {
+  const live = fleet?.robots[robot.id];
+  if (!live) return robot;
+
+  const status = ({
+    online: "Online",
+    idle: "Idle",
+    charging: "Charging",
+    error: "Error",
+    offline: "Offline",
+  } as const)[fleetStatus(live)];
+
+  return {
+    ...robot,
+    status,
+    battery: live.battery,
+    location: live.last_poi || robot.location,
+    statusColor:
+      status === "Charging"
+        ? "text-blue-600"
+        : status === "Online"
+        ? "text-green-600"
+        : status === "Error"
+        ? "text-orange-600"
+        : "text-red-600",
+  };
+};
+
 const Dashboard = () => {
   const [robots, setRobots] = useState<RobotData[]>([]);
   const [stats, setStats] = useState<DashboardStats>({
@@ -164,7 +194,8 @@ const Dashboard = () => {
         })
       );
 
-      setRobots(enriched);
+      const fleet = fleetFeed.getFleet();
+      setRobots(enriched.map((r) => withFleet(r, fleet)));
 
       const total = enriched.length;
       const active = enriched.filter((r) => r.status === "Online").length;
@@ -198,8 +229,38 @@ const Dashboard = () => {
 
   useEffect(() => {
     fetchDashboardData();
-    const id = setInterval(fetchDashboardData, 30_000); // Increased to 30s
-    return () => clearInterval(id);
+
+    // Pushed changes replace the 30 s poll
+    return fleetFeed.subscribe((fleet) => {
+      setRobots((prevRobots) => {
+        if (prevRobots.length === 0) return prevRobots;
+
+        const updatedRobots = prevRobots.map((robot) => withFleet(robot, fleet));
+
+        const total = updatedRobots.length;
+        const active = updatedRobots.filter((r) => r.status === "Online").length;
+        const charging = updatedRobots.filter((r) => r.status === "Charging").length;
+        const idle = updatedRobots.filter((r) => r.status === "Idle").length;
+        const offline = total - active - charging - idle;
+        const avgBattery = Math.round(
+          updatedRobots.reduce((acc, r) => acc + r.battery, 0) / (total || 1)
+        );
+
+        setStats((prevStats) => ({
+          ...prevStats,
+          totalRobots: total,
+          activeRobots: active,
+          idleRobots: idle,
+          offlineRobots: offline,
+          tasksInProgress: Object.values(fleet.robots).filter((r) => r.task_id).length,
+          avgBattery,
+          performance:
+            total > 0 ? `${Math.round((active / total) * 100)}%` : "0%",
+        }));
+
+        return updatedRobots;
+      });
+    });
   }, []);
 
   // Subscribe to robot status updates via singleton service
@@ -288,6 +349,7 @@ const Dashboard = () => {
       Offline: "bg-red-100 text-red-700 border-red-200",
       Idle: "bg-yellow-100 text-yellow-700 border-yellow-200",
       Charging: "bg-blue-100 text-blue-700 border-blue-200",
+      Error: "bg-orange-100 text-orange-700 border-orange-200",
     };
     return styles[status as keyof typeof styles] || styles.Offline;
   };
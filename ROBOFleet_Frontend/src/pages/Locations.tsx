@@ -2,6 +2,7 @@
 import React, { useState, useEffect } from "react";
 import { MapPin, Navigation, RefreshCw, Target } from "lucide-react";
 import api from "../services/api";
+import { fleetFeed, fleetStatus, FleetDocument } from "../services/fleetFeed";
 import MoveToCoordinateModal from "../components/modals/MoveToCoordinateModal";
 
 interface Location {
@@ -16,6 +17,23 @@ interface Location {
   distance: number;
 }
 
+// Live position and last POI from the fleet feed
+const withFleet = (location: Location, fleet: FleetDocument | null): Location => {
+  const live = fleet?.robots[location.sn];
+  if (!live) return location;
+
+  const { x, y, ori } = live.location ?? location;
+  return {
+    ...location,
+    online: fleetStatus(live) !== "offline",
+    x,
+    y,
+    ori,
+    named_location: live.last_poi || location.named_location,
+    distance: Math.sqrt(x * x + y * y),
+  };
+};
+
 const Locations: React.FC = () => {
   const [locations, setLocations] = useState<Location[]>([]);
   const [loading, setLoading] = useState(true);
@@ -61,7 +79,8 @@ const Locations: React.FC = () => {
       });
 
       const locs = await Promise.all(locationPromises);
-      setLocations(locs);
+      const fleet = fleetFeed.getFleet();
+      setLocations(locs.map((l) => withFleet(l, fleet)));
     } catch (error) {
       console.error("Failed to fetch locations:", error);
     } finally {
@@ -71,8 +90,11 @@ const Locations: React.FC = () => {
 
   useEffect(() => {
     fetchLocations();
-    const interval = setInterval(fetchLocations, 10000);
-    return () => clearInterval(interval);
+
+    // Pushed changes replace the 10 s poll
+    return fleetFeed.subscribe((fleet) => {
+      setLocations((prev) => prev.map((l) => withFleet(l, fleet)));
+    });
   }, []);
 
   const handleMoveToCoordinate = (location: Location) => {
@@ -19,12 +19,13 @@ import {
 } from "lucide-react";
 import api from "../services/api";
 import { robotStatusService } from "../services/robotStatusService";
+import { fleetFeed, fleetStatus, FleetDocument } from "../services/fleetFeed";
 
 /* ---------- Types ------------------------------------------------------ */
 interface Robot {
   id: string;
   name: string;
-  status: "online" | "offline" | "idle" | "charging";
+  status: "online" | "offline" | "idle" | "charging" | "error";
   battery: number;
   lastSeen: string;
   signal?: number;
@@ -83,6 +84,8 @@ const getStatusColor = (status: string): string => {
       return "bg-red-500";
     case "charging":
       return "bg-blue-500";
+    case "error":
+      return "bg-orange-500";
     default:
       return "bg-gray-500";
   }
@@ -98,11 +101,42 @@ const getStatusTextColor = (status: string): string => {
       return "text-red-600";
     case "charging":
       return "text-blue-600";
+    case "error":
+      return "text-orange-600";
     default:
       return "text-gray-600";
   }
 };
 
+// Live status, battery, task and position from the fleet feed
+const withFleet = (robot: Robot, fleet: FleetDocument | null): Robot => {
+  const live = fleet?.robots[robot.sn ?? robot.id];
+  if (!live) return robot;
+
+  const status = fleetStatus(live);
+  return {
+    ...robot,
+    status,
+    battery: live.battery,
+    task:
+      status === "offline"
+        ? "Offline"
+        : status === "charging"
+        ? "Charging"
+        : status === "error"
+        ? "Task failed"
+        : live.task_id
+        ? `Moving to ${live.last_poi}`
+        : "Idle",
+    lastSeen: live.updated_at
+      ? new Date(live.updated_at * 1000).toISOString()
+      : robot.lastSeen,
+    actualPosition: live.location
+      ? { x: live.location.x, y: live.location.y, yaw: live.location.ori }
+      : robot.actualPosition,
+  };
+};
+
 /* ---------- Component -------------------------------------------------- */
 const Monitor: React.FC = () => {
   const [robots, setRobots] = useState<Robot[]>([]);
@@ -180,7 +214,8 @@ const Monitor: React.FC = () => {
         })
       );
 
-      setRobots(robotsWithStatus);
+      const fleet = fleetFeed.getFleet();
+      setRobots(robotsWithStatus.map((r) => withFleet(r, fleet)));
       setLastUpdate(new Date());
 
       // Auto-select first robot if none selected
@@ -198,8 +233,13 @@ const Monitor: React.FC = () => {
   /* ---------------- Lifecycle ----------------------------------------- */
   useEffect(() => {
     fetchRobots();
-    const interval = setInterval(fetchRobots, 30000);
-    return () => clearInterval(interval);
+
+    // Pushed changes replace the 30 s poll
+    return fleetFeed.subscribe((fleet) => {
+      setRobots((prev) => prev.map((robot) => withFleet(robot, fleet)));
+      setSelectedRobot((prev) => (prev ? withFleet(prev, fleet) : prev));
+      setLastUpdate(new Date());
+    });
   }, []);
 
   /* ---------------- WebSocket for real-time updates ------------------ */
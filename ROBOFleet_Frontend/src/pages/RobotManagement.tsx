@@ -18,6 +18,7 @@ import fielderImage from "../assets/fielderImage.png";
 import temiImage from "../assets/temiImage.png"; 
 import api from "../services/api";
 import { robotStatusService } from "../services/robotStatusService";
+import { fleetFeed, fleetStatus, FleetDocument } from "../services/fleetFeed";
 import RobotControlModal from "../components/modals/RobotControlModal";
 
 /* ------------------------------------------------------------------ */
@@ -78,6 +79,38 @@ const getRobotImage = (model: string) => {
   }
 };
 
+// Live status, battery, location and task from the fleet feed
+const withFleet = (robot: Robot, fleet: FleetDocument | null): Robot => {
+  const live = fleet?.robots[robot.sn ?? robot.id];
+  if (!live) return robot;
+
+  const status = ({
+    online: "Online",
+    idle: "Idle",
+    charging: "Charging",
+    error: "Error",
+    offline: "Offline",
+  } as const)[fleetStatus(live)];
+
+  return {
+    ...robot,
+    status,
+    battery: live.battery,
+    location: live.last_poi || robot.location,
+    currentTask:
+      status === "Offline"
+        ? "Offline"
+        : status === "Charging"
+        ? "Charging"
+        : status === "Error"
+        ? "Task failed"
+        : live.task_id
+        ? `Moving to ${live.last_poi}`
+        : "Idle",
+    connectivity: status === "Offline" ? "Poor" : "Good",
+  };
+};
+
 /* ------------------------------------------------------------------ */
 /* Component                                                          */
 /* ------------------------------------------------------------------ */
@@ -187,7 +220,8 @@ const RobotManagement: React.FC = () => {
         })
       );
 
-      setRobots(transformed);
+      const fleet = fleetFeed.getFleet();
+      setRobots(transformed.map((r) => withFleet(r, fleet)));
     } catch (err: any) {
       console.error(err);
       setError(err.message || "Failed to fetch robots");
@@ -205,8 +239,11 @@ const RobotManagement: React.FC = () => {
   useEffect(() => {
     fetchRobots();
     fetchPOIs();
-    const id = setInterval(fetchRobots, 30_000);
-    return () => clearInterval(id);
+
+    // Pushed changes replace the 30 s poll
+    return fleetFeed.subscribe((fleet) => {
+      setRobots((prev) => prev.map((robot) => withFleet(robot, fleet)));
+    });
   }, []);
 
   // ✅ FIX: WebSocket updates
@@ -354,6 +391,7 @@ const RobotManagement: React.FC = () => {
     if (s === "Online" || s === "Charging")
       return "bg-green-100 text-green-700 border-green-200";
     if (s === "Idle") return "bg-yellow-100 text-yellow-700 border-yellow-200";
+    if (s === "Error") return "bg-orange-100 text-orange-700 border-orange-200";
     return "bg-red-100 text-red-700 border-red-200";
   };
 
@@ -18,6 +18,7 @@ import {
 } from "@mui/material";
 import { Refresh as RefreshIcon } from "@mui/icons-material";
 import api from "../services/api";
+import { fleetFeed } from "../services/fleetFeed";
 
 interface Task {
   task_id: string;
@@ -104,12 +105,12 @@ const Tasks: React.FC = () => {
   useEffect(() => {
     fetchTasks();
 
-    // Set up auto-refresh every 30 seconds
-    const interval = setInterval(() => {
-      fetchTasks(false);
-    }, 30000);
-
-    return () => clearInterval(interval);
+    // Reload the history when a robot starts or finishes a task, instead of every 30 s
+    return fleetFeed.subscribe((_fleet, ops) => {
+      if (ops?.some((op) => op.path.endsWith("/task_id") || op.path.endsWith("/move_state"))) {
+        fetchTasks(false);
+      }
+    });
   }, []);
 
   // Manual refresh handler
@@ -0,0 +1,175 @@
+// src/services/fleetFeed.ts
+//
+// Client for /api/v1/robot/ws/fleet: a fleet snapshot on connect, then
+// JSON Patch (RFC 6902) deltas. One connection is shared by every page, is
+// opened with the first subscriber and closed with the last one.
+
+export interface FleetRobot {
+  robot_id: number | null;
+  sn: string | null;
+  name: string | null;
+  nickname: string | null;
+  model: string | null;
+  ip: string | null;
+  status: string;
+  state: string;
+  battery: number;
+  task_id: number | null;
+  last_poi: string | null;
+  move_state: string | null;
+  location: { x: number; y: number; ori: number } | null;
+  updated_at: number | null;
+}
+
+export interface FleetPoi {
+  x: number;
+  y: number;
+  ori: number;
+}
+
+export interface FleetDocument {
+  robots: Record<string, FleetRobot>;
+  pois: Record<string, FleetPoi>;
+}
+
+export interface PatchOp {
+  op: "add" | "remove" | "replace";
+  path: string;
+  value?: any;
+}
+
+type FleetCallback = (fleet: FleetDocument, ops: PatchOp[] | null) => void;
+
+const WS_URL = "ws://192.168.0.183:8000"; // Match your backend
+const RECONNECT_DELAY = 3000;
+
+const unescape = (token: string) => token.replace(/~1/g, "/").replace(/~0/g, "~");
+
+/**
+ * Apply JSON Patch operations in place
+ */
+export function applyPatch(doc: any, ops: PatchOp[]) {
+  for (const { op, path, value } of ops) {
+    const tokens = path.split("/").slice(1).map(unescape);
+    const last = tokens.pop()!;
+    const parent = tokens.reduce((node, token) => node[token], doc);
+    if (op === "remove") {
+      delete parent[last];
+    } else {
+      parent[last] = value;
+    }
+  }
+}
+
+/**
+ * Status normalised for the pages: online, idle, charging, error or offline.
+ * "error" is a reachable robot whose last task failed.
+ */
+export function fleetStatus(robot?: FleetRobot): "online" | "idle" | "charging" | "error" | "offline" {
+  switch (robot?.status) {
+    case "charging":
+      return "charging";
+    case "idle":
+      return "idle";
+    case "error":
+      return "error";
+    case "active":
+    case "online":
+      return "online";
+    default:
+      return "offline";
+  }
+}
+
+class FleetFeed {
+  private ws: WebSocket | null = null;
+  private callbacks = new Set<FleetCallback>();
+  private fleet: FleetDocument | null = null;
+  private version = 0;
+  private reconnectTimer: ReturnType<typeof setTimeout> | null = null;
+
+  /**
+   * Receive the fleet document now (if known) and after every change
+   * @returns Unsubscribe function
+   */
+  subscribe(callback: FleetCallback): () => void {
+    this.callbacks.add(callback);
+    if (this.fleet) callback(this.fleet, null);
+    this.connect();
+
+    return () => {
+      this.callbacks.delete(callback);
+      if (this.callbacks.size === 0) this.disconnect();
+    };
+  }
+
+  getFleet(): FleetDocument | null {
+    return this.fleet;
+  }
+
+  private connect() {
+    if (this.ws || this.reconnectTimer) return;
+
+    const ws = new WebSocket(`${WS_URL}/api/v1/robot/ws/fleet`);
+    this.ws = ws;
+
+    ws.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+
+      if (message.type === "snapshot") {
+        this.fleet = message.data;
+        this.version = message.version;
+        this.notify(null);
+      } else if (message.type === "patch" && this.fleet) {
+        if (message.version !== this.version + 1) {
+          // Missed a patch: start over from a fresh snapshot
+          console.warn("Fleet feed version gap, resyncing");
+          ws.close();
+          return;
+        }
+        applyPatch(this.fleet, message.ops);
+        this.version = message.version;
+        this.notify(message.ops);
+      }
+    };
+
+    ws.onclose = () => {
+      if (this.ws !== ws) return;
+      this.ws = null;
+      if (this.callbacks.size > 0) {
+        this.reconnectTimer = setTimeout(() => {
+          this.reconnectTimer = null;
+          this.connect();
+        }, RECONNECT_DELAY);
+      }
+    };
+
+    ws.onerror = (error) => {
+      console.error("Fleet feed error:", error);
+    };
+  }
+
+  private disconnect() {
+    if (this.reconnectTimer) {
+      clearTimeout(this.reconnectTimer);
+      this.reconnectTimer = null;
+    }
+    const ws = this.ws;
+    this.ws = null;
+    ws?.close(1000, "No subscribers");
+  }
+
+  private notify(ops: PatchOp[] | null) {
+    this.callbacks.forEach((callback) => {
+      try {
+        callback(this.fleet!, ops);
+      } catch (error) {
+        console.error("Error in fleet callback:", error);
+      }
+    });
+  }
+}
+
+export const fleetFeed = new FleetFeed();
+
+export default fleetFeed;
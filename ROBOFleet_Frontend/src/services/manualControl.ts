@@ -1,56 +1,67 @@
 // src/services/manualControl.ts
 /**
- * ✅ CORRECT: Manual Control Service for Fielder/AMR Robots
- * Uses flat linear_velocity and angular_velocity fields (NOT nested objects!)
+ * Manual control service for Fielder/AMR robots, driven through the
+ * backend's /api/v1/robot/ws/teleop session
  */
 
-const ROBOT_WS_URL = "ws://192.168.0.250:8090/ws/v2/topics";
+import { fleetFeed } from "./fleetFeed";
+
+const WS_URL = "ws://192.168.0.183:8000"; // Match your backend
 const BACKEND_API_URL = "http://192.168.0.183:8000";
 
+// Server side forwarding rate; the joystick itself can update as often as it likes
+const CONTROL_RATE_HZ = 10;
+// Held velocities are repeated well inside the server's 500 ms deadman
+const KEEPALIVE_MS = 200;
+const PING_EVERY = 5; // keepalives
+
+export interface TeleopStats {
+  seq: number;
+  received: number;
+  sent: number;
+  coalesced: number;
+  deadman_stops: number;
+  rtt_ms: number | null;
+}
+
+type ErrorCallback = (message: string) => void;
+
+/**
+ * Joystick over the backend's /ws/teleop session. The server keeps one robot
+ * connection, forwards only the newest velocity at CONTROL_RATE_HZ and stops
+ * the robot when updates stop arriving.
+ */
 class ManualControlService {
   private ws: WebSocket | null = null;
   private isActive = false;
-  private commandInterval: ReturnType<typeof setInterval> | null = null;
+  private keepaliveTimer: ReturnType<typeof setInterval> | null = null;
+  private keepalives = 0;
   private currentLinear = 0;
   private currentAngular = 0;
-  private readyForControl = false;
-  
-  // ✅ CRITICAL: Send commands continuously at 5Hz (200ms)
-  private readonly COMMAND_INTERVAL_MS = 200;
-
-  async start(): Promise<boolean> {
+  private seq = 0;
+  private stats: TeleopStats | null = null;
+  private errorCallbacks = new Set<ErrorCallback>();
+
+  /**
+   * @param sn Serial number of the robot to drive; the server's default robot when unknown
+   */
+  async start(sn?: string): Promise<boolean> {
     if (this.isActive) {
       console.log("✅ Manual control already active");
       return true;
     }
 
     try {
-      // ✅ STEP 1: Enable remote control mode on robot
-      console.log("🔧 Step 1/4: Enabling remote control mode...");
+      console.log("🔧 Enabling remote control mode...");
       await this.enableRemoteMode();
-      
-      // ✅ STEP 2: Connect to robot WebSocket
-      console.log("🔌 Step 2/4: Connecting to robot WebSocket...");
-      const connected = await this.connectWebSocket();
-      
-      if (!connected) {
-        throw new Error("Failed to connect to robot");
-      }
-      
-      // ✅ STEP 3: Enable twist feedback topic (like HTML does)
-      console.log("📡 Step 3/4: Enabling /twist_feedback topic...");
-      this.enableTwistFeedback();
-      
-      // ✅ STEP 4: Start continuous command sending
-      console.log("🎮 Step 4/4: Starting command loop...");
-      this.startCommandLoop();
-      
+
+      console.log("🔌 Opening teleop session...");
+      await this.connectWebSocket(sn);
+
       this.isActive = true;
-      this.readyForControl = true;
-      
+      this.keepaliveTimer = setInterval(() => this.keepalive(), KEEPALIVE_MS);
+
       console.log("✅ Manual control ready!");
-      console.log("🎯 Use keyboard (WASD/Arrows) or virtual joystick to move");
-      
       return true;
     } catch (error) {
       console.error("❌ Failed to start manual control:", error);
@@ -59,191 +70,157 @@ class ManualControlService {
     }
   }
 
+  /**
+   * Called when the server ends the session, e.g. when the robot link is lost
+   * @returns Unsubscribe function
+   */
+  onError(callback: ErrorCallback): () => void {
+    this.errorCallbacks.add(callback);
+    return () => {
+      this.errorCallbacks.delete(callback);
+    };
+  }
+
   private async enableRemoteMode(): Promise<void> {
-    try {
-      const response = await fetch(`${BACKEND_API_URL}/api/v1/robot/control/enable_remote`, {
-        method: "POST",
-        headers: { "Content-Type": "application/json" }
-      });
-
-      if (!response.ok) {
-        throw new Error(`HTTP ${response.status}: Failed to enable remote mode`);
-      }
-
-      const data = await response.json();
-      
-      if (!data.ready && data.status !== 200) {
-        throw new Error(data.msg || "Robot not ready for remote control");
-      }
-
-      console.log("✅ Remote control mode enabled");
-      
-      // ✅ CRITICAL: Wait for robot to switch modes
-      await this.delay(1000);
-    } catch (error) {
-      console.error("❌ Enable remote mode error:", error);
-      throw error;
+    const response = await fetch(`${BACKEND_API_URL}/api/v1/robot/control/enable_remote`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" }
+    });
+
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}: Failed to enable remote mode`);
+    }
+
+    const data = await response.json();
+
+    if (!data.ready && data.status !== 200) {
+      throw new Error(data.msg || "Robot not ready for remote control");
     }
+
+    console.log("✅ Remote control mode enabled");
   }
 
-  private connectWebSocket(): Promise<boolean> {
+  private connectWebSocket(sn?: string): Promise<void> {
     return new Promise((resolve, reject) => {
-      try {
-        this.ws = new WebSocket(ROBOT_WS_URL);
-        
-        const timeout = setTimeout(() => {
-          this.cleanup();
-          reject(new Error("WebSocket connection timeout"));
-        }, 5000);
+      const robotId = sn ? fleetFeed.getFleet()?.robots[sn]?.robot_id : null;
+      const params = new URLSearchParams({ rate: String(CONTROL_RATE_HZ) });
+      if (robotId != null) params.set("robot_id", String(robotId));
+
+      const ws = new WebSocket(`${WS_URL}/api/v1/robot/ws/teleop?${params}`);
+      this.ws = ws;
+      let opened = false;
+
+      const timeout = setTimeout(() => {
+        ws.close();
+        reject(new Error("Teleop connection timeout"));
+      }, 5000);
+
+      ws.onopen = () => {
+        clearTimeout(timeout);
+        opened = true;
+        resolve();
+      };
 
-        this.ws.onopen = () => {
-          clearTimeout(timeout);
-          console.log("✅ WebSocket connected");
-          
-          // Ready after a short delay
-          setTimeout(() => {
-            console.log("✅ Ready for control");
-            resolve(true);
-          }, 500);
-        };
-
-        this.ws.onmessage = (event) => {
-          try {
-            const data = JSON.parse(event.data);
-            // Robot sends feedback on various topics
-            if (data.topic === "/twist_feedback") {
-              // Robot acknowledges command received
-              console.log("🤖 Twist command acknowledged");
-            } else if (data.topic) {
-              console.log("📨 Robot feedback:", data.topic);
-            }
-          } catch (e) {
-            // Ignore parse errors
+      ws.onmessage = (event) => {
+        let message: any;
+        try {
+          message = JSON.parse(event.data);
+        } catch (e) {
+          return;
+        }
+
+        if (message.type === "pong") {
+          const { type, t, ...stats } = message;
+          this.stats = stats;
+        } else if (message.type === "error") {
+          console.error("❌ Teleop error:", message.msg);
+          if (opened) {
+            this.errorCallbacks.forEach((callback) => callback(message.msg));
+          } else {
+            clearTimeout(timeout);
+            reject(new Error(message.msg));
           }
-        };
+        }
+      };
 
-        this.ws.onerror = (error) => {
+      ws.onerror = (error) => {
+        console.error("❌ Teleop WebSocket error:", error);
+        if (!opened) {
           clearTimeout(timeout);
-          console.error("❌ WebSocket error:", error);
-          reject(error);
-        };
+          reject(new Error("Teleop connection failed"));
+        }
+      };
 
-        this.ws.onclose = (event) => {
-          console.log(`🔌 WebSocket closed: ${event.code} - ${event.reason}`);
+      ws.onclose = (event) => {
+        console.log(`🔌 Teleop session closed: ${event.code} ${event.reason}`);
+        if (this.ws === ws) {
+          this.ws = null;
           this.cleanup();
-        };
-      } catch (error) {
-        reject(error);
-      }
+        }
+      };
     });
   }
 
-  private enableTwistFeedback(): void {
+  private send(message: object): boolean {
     if (!this.ws || this.ws.readyState !== WebSocket.OPEN) {
-      console.warn("⚠️ Cannot enable feedback - WebSocket not ready");
-      return;
+      return false;
     }
-
-    // ✅ CRITICAL: Enable /twist_feedback topic (matching HTML)
-    const enableMsg = {
-      enable_topic: ["/twist_feedback"]
-    };
-
-    console.log("📢 Enabling twist feedback topic");
-    this.ws.send(JSON.stringify(enableMsg));
+    this.ws.send(JSON.stringify(message));
+    return true;
   }
 
-  private startCommandLoop(): void {
-    // ✅ CRITICAL: Send commands continuously at 5Hz (200ms interval)
-    // This is REQUIRED for Fielder robots - they expect continuous commands
-    this.commandInterval = setInterval(() => {
-      if (this.readyForControl) {
-        this.sendCommand(this.currentLinear, this.currentAngular);
-      }
-    }, this.COMMAND_INTERVAL_MS);
-
-    console.log(`🔄 Command loop started (${this.COMMAND_INTERVAL_MS}ms interval)`);
+  private sendVelocities(): boolean {
+    this.seq += 1;
+    return this.send({ linear: this.currentLinear, angular: this.currentAngular, seq: this.seq });
   }
 
-  private sendCommand(linear: number, angular: number): boolean {
-    if (!this.ws || this.ws.readyState !== WebSocket.OPEN) {
-      console.warn("⚠️ WebSocket not open, cannot send command");
-      return false;
+  private keepalive(): void {
+    // A held joystick must keep updating or the server's deadman stops the robot
+    if (this.currentLinear !== 0 || this.currentAngular !== 0) {
+      this.sendVelocities();
     }
-
-    if (!this.readyForControl) {
-      return false;
-    }
-
-    try {
-      // ✅ CRITICAL FIX: Robot expects FLAT fields, not nested objects!
-      // HTML working format: {"topic":"/twist","linear_velocity":0.25,"angular_velocity":0}
-      const message = {
-        topic: "/twist",
-        linear_velocity: linear,
-        angular_velocity: angular
-      };
-
-      this.ws.send(JSON.stringify(message));
-      
-      // Only log when velocities change (avoid spam)
-      if (linear !== 0 || angular !== 0) {
-        console.log(`📤 CMD: linear=${linear.toFixed(2)}, angular=${angular.toFixed(2)}`);
-      }
-      
-      return true;
-    } catch (error) {
-      console.error("❌ Send command error:", error);
-      return false;
+    this.keepalives += 1;
+    if (this.keepalives % PING_EVERY === 0) {
+      this.send({ type: "ping", t: Date.now() });
     }
   }
 
   setVelocities(linear: number, angular: number): void {
-    // ✅ Store velocities - they will be sent by the command loop
-    const changed = (linear !== this.currentLinear || angular !== this.currentAngular);
-    
+    const changed = linear !== this.currentLinear || angular !== this.currentAngular;
+
     this.currentLinear = linear;
     this.currentAngular = angular;
-    
-    if (changed && (linear !== 0 || angular !== 0)) {
-      console.log(`🎮 Velocities updated: linear=${linear.toFixed(2)}, angular=${angular.toFixed(2)}`);
+
+    // Sent right away; the server coalesces bursts to its control rate
+    if (changed && this.isActive) {
+      this.sendVelocities();
     }
   }
 
   async stop(): Promise<void> {
     console.log("🛑 Stopping manual control...");
-    
-    // ✅ STEP 1: Send stop command (zero velocities)
+
     this.currentLinear = 0;
     this.currentAngular = 0;
-    
-    // Send stop command multiple times to ensure it's received
-    for (let i = 0; i < 5; i++) {
-      await this.sendCommand(0, 0);
-      await this.delay(50);
-    }
-    
-    // ✅ STEP 2: Stop command loop
+    this.sendVelocities();
+
+    // The server sends the final zero velocity when the session closes
+    const ws = this.ws;
+    this.ws = null;
     this.cleanup();
-    
-    // ✅ STEP 3: Close WebSocket
-    if (this.ws) {
-      this.ws.close(1000, "Manual control stopped");
-      this.ws = null;
-    }
-    
+    ws?.close(1000, "Manual control stopped");
+
     console.log("✅ Manual control stopped");
   }
 
   private cleanup(): void {
     this.isActive = false;
-    this.readyForControl = false;
-    
-    if (this.commandInterval) {
-      clearInterval(this.commandInterval);
-      this.commandInterval = null;
+
+    if (this.keepaliveTimer) {
+      clearInterval(this.keepaliveTimer);
+      this.keepaliveTimer = null;
     }
-    
+
     this.currentLinear = 0;
     this.currentAngular = 0;
   }
@@ -252,16 +229,11 @@ class ManualControlService {
     console.log("🚨 EMERGENCY STOP!");
     this.currentLinear = 0;
     this.currentAngular = 0;
-    
-    // Send stop command immediately (don't wait for command loop)
-    for (let i = 0; i < 5; i++) {
-      await this.sendCommand(0, 0);
-      await this.delay(50);
-    }
+    this.sendVelocities();
   }
 
   isControlActive(): boolean {
-    return this.isActive && this.readyForControl;
+    return this.isActive;
   }
 
   getCurrentVelocities() {
@@ -271,10 +243,13 @@ class ManualControlService {
     };
   }
 
-  private delay(ms: number): Promise<void> {
-    return new Promise(resolve => setTimeout(resolve, ms));
+  /**
+   * Latest session stats from the server, including the robot control round trip
+   */
+  getStats(): TeleopStats | null {
+    return this.stats;
   }
 }
 
 // Export singleton instance
-export const manualControl = new ManualControlService();
\ No newline at end of file
+export const manualControl = new ManualControlService();
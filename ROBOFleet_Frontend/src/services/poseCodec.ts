@@ -0,0 +1,97 @@
+// src/services/poseCodec.ts
+//
+// Decoder for the binary pose stream (/api/v1/robot/ws/current_pose?format=delta).
+// The format is documented in RoboFleetServerMal/posecodec.py. Frames are
+// little-endian:
+//
+//   keyframe 'K'  u8 type, u8 version, f64 ts, u16 count,
+//                 count x (u32 robot_id, i32 x mm, i32 y mm, i16 ori 1e-4 rad)
+//   delta    'D'  u8 type, u8 version, u32 ms since keyframe, u16 count,
+//                 count x (u16 robot index, i16 dx, i16 dy, i16 dori)
+
+export interface PoseMessage {
+  kind: "pose";
+  robot_id: number;
+  ts: number;
+  x: number;
+  y: number;
+  ori: number;
+}
+
+const KEYFRAME = 0x4b;
+const DELTA = 0x44;
+
+const POS_SCALE = 1000;
+const ORI_SCALE = 10000;
+const ORI_HALF_TURN = Math.round(Math.PI * ORI_SCALE);
+const ORI_TURN = 2 * ORI_HALF_TURN;
+
+const wrapOri = (value: number): number => {
+  if (value > ORI_HALF_TURN) return value - ORI_TURN;
+  if (value < -ORI_HALF_TURN) return value + ORI_TURN;
+  return value;
+};
+
+export class PoseDecoder {
+  private robots: number[] = [];
+  private values = new Map<number, [number, number, number]>();
+  private ts = 0;
+
+  /**
+   * Decode one binary frame into the poses it updates
+   * @param buffer Websocket message data (binaryType = "arraybuffer")
+   */
+  decode(buffer: ArrayBuffer): PoseMessage[] {
+    const view = new DataView(buffer);
+    const type = view.getUint8(0);
+
+    if (type === KEYFRAME) {
+      this.ts = view.getFloat64(2, true);
+      const count = view.getUint16(10, true);
+      this.robots = [];
+      this.values.clear();
+
+      for (let i = 0, offset = 12; i < count; i++, offset += 14) {
+        const robotId = view.getUint32(offset, true);
+        this.robots.push(robotId);
+        this.values.set(robotId, [
+          view.getInt32(offset + 4, true),
+          view.getInt32(offset + 8, true),
+          view.getInt16(offset + 12, true),
+        ]);
+      }
+      return this.robots.map((robotId) => this.pose(robotId, this.ts));
+    }
+
+    if (type === DELTA) {
+      const ts = this.ts + view.getUint32(2, true) / 1000;
+      const count = view.getUint16(6, true);
+      const poses: PoseMessage[] = [];
+
+      for (let i = 0, offset = 8; i < count; i++, offset += 8) {
+        const robotId = this.robots[view.getUint16(offset, true)];
+        const value = this.values.get(robotId);
+        if (!value) continue;
+        value[0] += view.getInt16(offset + 2, true);
+        value[1] += view.getInt16(offset + 4, true);
+        value[2] = wrapOri(value[2] + view.getInt16(offset + 6, true));
+        poses.push(this.pose(robotId, ts));
+      }
+      return poses;
+    }
+
+    throw new Error(`Unknown pose frame type ${type}`);
+  }
+
+  private pose(robotId: number, ts: number): PoseMessage {
+    const [x, y, ori] = this.values.get(robotId)!;
+    return {
+      kind: "pose",
+      robot_id: robotId,
+      ts,
+      x: x / POS_SCALE,
+      y: y / POS_SCALE,
+      ori: ori / ORI_SCALE,
+    };
+  }
+}
@@ -1,4 +1,5 @@
 // src/services/websocket.ts
+import { PoseDecoder } from "./poseCodec";
 
 type MessageCallback = (data: any) => void;
 type ErrorCallback = (error: any) => void;
@@ -54,7 +55,10 @@ export function connect() {
   wsService.isConnecting = true;
 
   try {
-    wsService.ws = new WebSocket(`${WS_URL}/api/v1/robot/ws/current_pose`);
+    // Binary keyframe + delta stream, decoded back into pose messages
+    const decoder = new PoseDecoder();
+    wsService.ws = new WebSocket(`${WS_URL}/api/v1/robot/ws/current_pose?format=delta`);
+    wsService.ws.binaryType = "arraybuffer";
 
     wsService.ws.onopen = () => {
       console.log("WebSocket connected successfully");
@@ -64,16 +68,20 @@ export function connect() {
 
     wsService.ws.onmessage = (event) => {
       try {
-        const data = JSON.parse(event.data);
-        console.log("WebSocket message received:", data);
+        const messages =
+          event.data instanceof ArrayBuffer
+            ? decoder.decode(event.data)
+            : [JSON.parse(event.data)];
 
         // Notify all subscribers
-        wsService.messageCallbacks.forEach((callback) => {
-          try {
-            callback(data);
-          } catch (error) {
-            console.error("Error in message callback:", error);
-          }
+        messages.forEach((data) => {
+          wsService.messageCallbacks.forEach((callback) => {
+            try {
+              callback(data);
+            } catch (error) {
+              console.error("Error in message callback:", error);
+            }
+          });
         });
       } catch (error) {
         console.error("Failed to parse WebSocket message:", error);
@@ -0,0 +1,156 @@
+"""
+Task history as JSON: Python encoding vs PostgreSQL rendering
+
+    python bench_json.py                     # 1k, 10k and 100k rows
+    python bench_json.py --rows 5000 --repeat 5
+
+Needs the PostgreSQL of database.py. The rows go into a scratch table,
+bench_json_tasks, with the columns of tasks_history; it is dropped again at
+the end. Each path is timed end to end, from the query to the last byte of
+the body:
+
+    python          conn.fetch -> dict(row) -> jsonable_encoder -> json.dumps,
+                    as FastAPI renders the list a handler returns
+    postgres        row_to_json through a server-side cursor, JSON_CHUNK rows
+                    per fetch, bytes passed on unchanged (stream_json_array)
+
+`cpu` is the process time of this Python process, i.e. what the API worker
+spends; `first byte` is when the first row could go to the client.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+import database
+from database import JSON_CHUNK, close_postgres, init_postgres, stream_json_array
+
+TABLE = "bench_json_tasks"
+
+TIMESTAMPS = ("start_time", "end_time")
+
+QUERY = f"SELECT * FROM {TABLE} ORDER BY start_time DESC LIMIT $1"
+
+
+async def create_table(rows: int):
+    async with database.pool.acquire() as conn:
+        await conn.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        await conn.execute(f'''
+            CREATE TABLE {TABLE} (
+                task_id     BIGINT PRIMARY KEY,
+                robot_id    INTEGER,
+                last_poi    TEXT,
+                target_poi  TEXT,
+                status      TEXT,
+                distance    DOUBLE PRECISION,
+                start_time  TIMESTAMPTZ,
+                end_time    TIMESTAMPTZ,
+                notes       TEXT
+            )
+        ''')
+        await conn.execute(f'''
+            INSERT INTO {TABLE}
+            SELECT 1700000000000 + i, 1 + i % 50, 'poi_' || (i % 40), 'poi_' || ((i + 7) % 40),
+                   (ARRAY['completed', 'completed', 'completed', 'failed', 'cancelled'])[1 + i % 5],
+                   random() * 80,
+                   NOW() - i * INTERVAL '37 seconds',
+                   NOW() - i * INTERVAL '37 seconds' + INTERVAL '95 seconds',
+                   CASE WHEN i % 5 = 3 THEN 'Failed: path blocked' END
+            FROM generate_series(1, $1) AS i
+        ''', rows)
+        await conn.execute(f"ANALYZE {TABLE}")
+
+
+async def python_path(rows: int) -> dict:
+    wall, cpu = time.perf_counter(), time.process_time()
+    async with database.pool.acquire() as conn:
+        records = await conn.fetch(QUERY, rows)
+    body = json.dumps(jsonable_encoder([dict(record) for record in records]),
+                      ensure_ascii=False, separators=(",", ":")).encode()
+    return {
+        "wall_ms": (time.perf_counter() - wall) * 1000,
+        "cpu_ms": (time.process_time() - cpu) * 1000,
+        "first_byte_ms": (time.perf_counter() - wall) * 1000,
+        "bytes": len(body),
+        "body": body
+    }
+
+
+async def postgres_path(rows: int) -> dict:
+    wall, cpu = time.perf_counter(), time.process_time()
+    first_byte = None
+    chunks = []
+    async for chunk in stream_json_array(QUERY, rows):
+        if first_byte is None and len(chunk) > 1:
+            first_byte = time.perf_counter()
+        chunks.append(chunk)
+    body = b"".join(chunks)
+    return {
+        "wall_ms": (time.perf_counter() - wall) * 1000,
+        "cpu_ms": (time.process_time() - cpu) * 1000,
+        "first_byte_ms": ((first_byte or time.perf_counter()) - wall) * 1000,
+        "bytes": len(body),
+        "body": body
+    }
+
+
+def instant(value: str) -> datetime.datetime:
+    # jsonable_encoder and row_to_json may differ in offset and fraction digits
+    return datetime.datetime.fromisoformat(value) if value is not None else None
+
+
+def check(python_body: bytes, postgres_body: bytes, rows: int):
+    """Same rows and values; timestamps are compared as instants, not strings"""
+    a, b = json.loads(python_body), json.loads(postgres_body)
+    assert len(a) == len(b) == rows, (len(a), len(b), rows)
+    for x, y in zip(a, b):
+        assert x.keys() == y.keys(), (x.keys(), y.keys())
+        for key in x:
+            if key in TIMESTAMPS:
+                assert instant(x[key]) == instant(y[key]), (key, x[key], y[key])
+            elif key == "distance":
+                assert abs(x[key] - y[key]) < 1e-9, (key, x[key], y[key])
+            else:
+                assert x[key] == y[key], (key, x[key], y[key])
+
+
+async def best_of(path, rows: int, repeat: int) -> dict:
+    results = [await path(rows) for _ in range(repeat)]
+    return min(results, key=lambda result: result["wall_ms"])
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rows", type=int, nargs="*", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per path, the fastest is shown")
+    args = parser.parse_args()
+
+    await init_postgres()
+    try:
+        await create_table(max(args.rows))
+        print(f"{TABLE}: {max(args.rows)} rows, cursor chunks of {JSON_CHUNK}, best of {args.repeat}\n")
+        print(f"{'rows':>7} {'path':>9} {'wall ms':>9} {'cpu ms':>9} {'first byte':>11} {'body':>10}")
+
+        for rows in args.rows:
+            # Warm the table and the connections before timing
+            await python_path(min(rows, 1000))
+            python = await best_of(python_path, rows, args.repeat)
+            postgres = await best_of(postgres_path, rows, args.repeat)
+            check(python["body"], postgres["body"], rows)
+
+            for name, result in (("python", python), ("postgres", postgres)):
+                print(f"{rows:>7} {name:>9} {result['wall_ms']:>9.1f} {result['cpu_ms']:>9.1f} "
+                      f"{result['first_byte_ms']:>8.1f} ms {result['bytes'] / 1024:>7.0f} KB")
+            print(f"{'':>7} {'speedup':>9} {python['wall_ms'] / postgres['wall_ms']:>8.1f}x "
+                  f"{python['cpu_ms'] / max(postgres['cpu_ms'], 0.01):>8.1f}x\n")
+    finally:
+        async with database.pool.acquire() as conn:
+            await conn.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        await close_postgres()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+"""
+Bytes per client per second on /ws/current_pose, JSON vs posecodec deltas
+
+    python bench_pose.py                     # 1, 50 and 500 robots
+    python bench_pose.py --robots 20 --rate 20 --idle 0.5
+
+Simulated robots publish poses at --rate Hz and drive at 0.3-1.2 m/s with
+slowly changing heading. A share of them (--idle) stand still. Each encoding
+is counted as it goes over the socket:
+
+    json            one text message per pose (the current format)
+    delta           one posecodec frame per FRAME_INTERVAL
+    +deflate        the same messages through permessage-deflate with context
+                    takeover, as negotiated by browsers and uvicorn
+
+Sizes include the websocket frame header. Every delta stream is decoded
+again and checked against the JSON poses to within the quantisation step.
+"""
+import argparse
+import math
+import random
+import zlib
+
+from posecodec import FRAME_INTERVAL, ORI_SCALE, POS_SCALE, PoseDeltaDecoder, PoseDeltaEncoder
+from telemetry import Pose, encode
+
+
+def ws_frame_size(payload: int) -> int:
+    """Payload plus the server-to-client websocket header"""
+    if payload < 126:
+        return payload + 2
+    if payload < 65536:
+        return payload + 4
+    return payload + 10
+
+
+class Deflate:
+    """permessage-deflate sender with context takeover"""
+
+    def __init__(self):
+        self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+
+    def size(self, message: bytes) -> int:
+        data = self.compressor.compress(message) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        # The trailing 00 00 ff ff is not sent
+        return len(data) - 4
+
+
+class Robot:
+    def __init__(self, robot_id: int, idle: bool):
+        self.robot_id = robot_id
+        self.x = random.uniform(-50, 50)
+        self.y = random.uniform(-50, 50)
+        self.ori = random.uniform(-math.pi, math.pi)
+        self.speed = 0.0 if idle else random.uniform(0.3, 1.2)
+
+    def step(self, dt: float, ts: float) -> Pose:
+        if self.speed:
+            self.ori = math.remainder(self.ori + random.gauss(0, 0.3) * dt, 2 * math.pi)
+            self.x += math.cos(self.ori) * self.speed * dt
+            self.y += math.sin(self.ori) * self.speed * dt
+        # Localisation noise, also present on a standing robot
+        noise = random.gauss(0, 0.0005)
+        return Pose(self.robot_id, ts, self.x + noise, self.y + noise, self.ori)
+
+
+def run(robots: int, rate: float, seconds: float, idle: float) -> dict:
+    fleet = [Robot(robot_id, random.random() < idle) for robot_id in range(1, robots + 1)]
+    encoder = PoseDeltaEncoder()
+    decoder = PoseDeltaDecoder()
+    json_deflate, delta_deflate = Deflate(), Deflate()
+
+    sizes = {"json": 0, "json+deflate": 0, "delta": 0, "delta+deflate": 0}
+    messages = {"json": 0, "delta": 0}
+    latest = {}
+    max_error = 0.0
+
+    dt = 1.0 / rate
+    ticks = int(seconds * rate)
+    frame_every = max(1, round(FRAME_INTERVAL * rate))
+    start = 1_700_000_000.0
+
+    for tick in range(ticks):
+        ts = start + tick * dt
+        for robot in fleet:
+            pose = robot.step(dt, ts)
+            latest[pose.robot_id] = pose
+            encoder.update(pose)
+
+            payload = encode(pose)
+            sizes["json"] += ws_frame_size(len(payload))
+            sizes["json+deflate"] += ws_frame_size(json_deflate.size(payload))
+            messages["json"] += 1
+
+        if tick % frame_every == frame_every - 1:
+            frame = encoder.flush(now=tick * dt)
+            if frame:
+                sizes["delta"] += ws_frame_size(len(frame))
+                sizes["delta+deflate"] += ws_frame_size(delta_deflate.size(frame))
+                messages["delta"] += 1
+                for decoded in decoder.decode(frame):
+                    sent = latest[decoded.robot_id]
+                    max_error = max(max_error, abs(decoded.x - sent.x), abs(decoded.y - sent.y))
+
+    assert max_error <= 0.5 / POS_SCALE + 1e-9, f"decoded pose off by {max_error} m"
+    return {
+        "robots": robots,
+        "bytes_per_s": {name: size / seconds for name, size in sizes.items()},
+        "messages_per_s": {name: count / seconds for name, count in messages.items()},
+        "keyframes": encoder.keyframes,
+        "max_error_mm": max_error * POS_SCALE
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--robots", type=int, nargs="*", default=[1, 50, 500])
+    parser.add_argument("--rate", type=float, default=10.0, help="native pose rate per robot (Hz)")
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--idle", type=float, default=0.3, help="share of robots standing still")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    print(f"{args.rate:g} Hz per robot, {args.seconds:g} s, {args.idle:.0%} idle, "
+          f"frames every {FRAME_INTERVAL * 1000:.0f} ms, resolution {1000 / POS_SCALE:g} mm / {1000 / ORI_SCALE:g} mrad\n")
+    print(f"{'robots':>6} {'json':>12} {'json+deflate':>13} {'delta':>12} {'delta+deflate':>14} {'msgs/s json':>12} {'msgs/s delta':>13}")
+
+    for robots in args.robots:
+        result = run(robots, args.rate, args.seconds, args.idle)
+        rates = result["bytes_per_s"]
+        print(f"{robots:>6} {rates['json'] / 1024:>9.1f} KB {rates['json+deflate'] / 1024:>10.1f} KB "
+              f"{rates['delta'] / 1024:>9.1f} KB {rates['delta+deflate'] / 1024:>11.1f} KB "
+              f"{result['messages_per_s']['json']:>12.0f} {result['messages_per_s']['delta']:>13.0f}")
+
+    print("\nbytes per client per second; KB = 1024 bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+# cloud.py
+"""
+Gateway to the AutoXing (Fielder) cloud API.
+
+Every cloud call in the server goes through one CloudGateway:
+
+    token       - signed token request, cached until shortly before expiry and
+                  refreshed once for all waiting callers (or on a 401)
+    client      - one pooled httpx client behind a token-bucket rate limiter
+    cache       - read responses kept for a short TTL; identical requests in
+                  flight share one upstream call
+    polling     - one robot list call per interval refreshes the state of every
+                  cloud robot, instead of one /state call per robot
+    oversee     - one upstream oversee websocket per robot, shared by any number
+                  of local subscribers, with a single heartbeat task for all
+
+CLOUD_BASE_URL / CLOUD_WS_URL can point at cloud_standin.py for local testing.
+"""
+import asyncio
+import hashlib
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Set
+
+import httpx
+import websockets
+from fastapi import WebSocket
+
+from logger import get_logger
+from reconnect import Backoff
+from telemetry import codec
+
+log = get_logger(__name__)
+
+BASE_URL = os.getenv("CLOUD_BASE_URL", "https://apiglobal.autoxing.com")
+WS_URL = os.getenv("CLOUD_WS_URL", "wss://serviceglobal.autoxing.com")
+APP_ID = os.getenv("CLOUD_APP_ID", "")
+APP_SECRET = os.getenv("CLOUD_APP_SECRET", "")
+APP_CODE = os.getenv("CLOUD_APP_CODE", "")
+
+# Refresh this long before the token expires
+TOKEN_MARGIN = 60.0
+
+RATE_PER_SECOND = 10.0
+RATE_BURST = 20
+REQUEST_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+
+# Answer of every cloud endpoint while APP_ID / APP_SECRET are missing
+NOT_CONFIGURED = {"status": 503, "msg": "Cloud API credentials are not configured"}
+
+LIST_TTL = 2.0
+STATE_TTL = 1.0
+POLL_INTERVAL = 2.0
+
+HEARTBEAT_INTERVAL = 5.0
+OVERSEE_QUEUE = 100
+
+
+class CloudError(Exception):
+    """The cloud API answered with an error status in its envelope"""
+
+
+class RateLimiter:
+    """Token bucket: `rate` requests per second with bursts up to `burst`"""
+
+    def __init__(self, rate: float = RATE_PER_SECOND, burst: int = RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self.throttled = 0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            self.throttled += 1
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def sign(app_id: str, timestamp: int, app_secret: str) -> str:
+    return hashlib.md5(f"{app_id}{timestamp}{app_secret}".encode()).hexdigest()
+
+
+class CloudGateway:
+    def __init__(self,
+                 base_url: str = BASE_URL,
+                 ws_url: str = WS_URL,
+                 app_id: str = APP_ID,
+                 app_secret: str = APP_SECRET,
+                 app_code: str = APP_CODE):
+        self.base_url = base_url
+        self.ws_url = ws_url
+        self.app_id = app_id
+        self.app_secret = app_secret
+        self.app_code = app_code
+        self.limiter = RateLimiter()
+        self.oversee = OverseeHub(self)
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._token: Optional[str] = None
+        self._token_expires = 0.0
+        self._token_lock = asyncio.Lock()
+        self._cache: Dict[tuple, tuple] = {}
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+
+        # Latest state of every cloud robot from the batched poll
+        self.states: Dict[str, dict] = {}
+        self.polled_at = 0.0
+
+        self.requests = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.token_refreshes = 0
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.app_id and self.app_secret)
+
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=REQUEST_TIMEOUT,
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=10)
+            )
+        return self._client
+
+    async def close(self):
+        await self.oversee.close()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # ============ TOKEN ============
+
+    async def token(self, stale: str = None) -> str:
+        """A valid token; pass the token that was just rejected to force a refresh"""
+        if self._token and self._token != stale and time.time() < self._token_expires - TOKEN_MARGIN:
+            return self._token
+
+        async with self._token_lock:
+            # Someone else may have refreshed while we waited
+            if self._token and self._token != stale and time.time() < self._token_expires - TOKEN_MARGIN:
+                return self._token
+
+            timestamp = int(time.time() * 1000)
+            headers = {"Authorization": self.app_code} if self.app_code else {}
+            await self.limiter.acquire()
+            r = await self.client().post("/auth/v1.1/token", headers=headers, json={
+                "appId": self.app_id,
+                "timestamp": timestamp,
+                "sign": sign(self.app_id, timestamp, self.app_secret)
+            })
+            r.raise_for_status()
+            body = r.json()
+            if body.get("status") != 200:
+                raise CloudError(f"Token request failed: {body.get('message')}")
+
+            self._token = body["data"]["token"]
+            self._token_expires = body["data"]["expireTime"] / 1000
+            self.token_refreshes += 1
+            log.info("Cloud token refreshed, valid for %.0f s", self._token_expires - time.time())
+            return self._token
+
+    # ============ REQUESTS ============
+
+    async def request(self, method: str, path: str, json: dict = None, ttl: float = 0.0):
+        """Call the cloud API; with a ttl the response is cached and identical calls share it"""
+        if not ttl:
+            return await self._send(method, path, json)
+
+        key = (method, path, codec.dumps(json) if json is not None else None)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            self.cache_hits += 1
+            return cached[1]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        inflight = self._inflight[key] = asyncio.ensure_future(self._send(method, path, json))
+        try:
+            result = await asyncio.shield(inflight)
+            self._cache[key] = (time.monotonic() + ttl, result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _send(self, method: str, path: str, json: dict = None):
+        token = await self.token()
+        for attempt in range(2):
+            await self.limiter.acquire()
+            self.requests += 1
+            r = await self.client().request(method, path, json=json, headers={"X-Token": token})
+            if r.status_code == 401 and attempt == 0:
+                token = await self.token(stale=token)
+                continue
+            r.raise_for_status()
+            return r.json()
+
+    # ============ ROBOTS ============
+
+    async def robot_list(self) -> list:
+        body = await self.request("POST", "/robot/v1.1/list", {"pageSize": 0, "timestamp": 0}, ttl=LIST_TTL)
+        data = body.get("data") or {}
+        return data.get("list", []) if isinstance(data, dict) else data
+
+    async def robot_state(self, robot_id: str) -> dict:
+        """State from the latest batched poll, or a cached /state call if polling is not running"""
+        if robot_id in self.states and time.time() - self.polled_at < POLL_INTERVAL * 3:
+            return self.states[robot_id]
+        body = await self.request("GET", f"/robot/v1.1/{robot_id}/state", ttl=STATE_TTL)
+        return body.get("data") or {}
+
+    async def poll_states(self, stop_event: asyncio.Event, interval: float = POLL_INTERVAL):
+        """Refresh every cloud robot's state from one list call per interval"""
+        log.info("Cloud state polling every %.1f s", interval)
+        while not stop_event.is_set():
+            try:
+                robots = await self.robot_list()
+                self.states = {str(robot.get("robotId") or robot.get("id")): robot for robot in robots}
+                self.polled_at = time.time()
+            except (httpx.HTTPError, CloudError, ValueError) as e:
+                log.warning("Cloud state poll failed: %s", e, every=60.0)
+
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "configured": self.configured,
+            "base_url": self.base_url,
+            "requests": self.requests,
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+            "throttled": self.limiter.throttled,
+            "token_refreshes": self.token_refreshes,
+            "token_valid_for": max(0, round(self._token_expires - time.time())) if self._token else 0,
+            "robots_polled": len(self.states),
+            "polled_at": self.polled_at,
+            "oversee": self.oversee.stats()
+        }
+
+
+# ============ OVERSEE WEBSOCKETS ============
+
+class OverseeLink:
+    """One upstream oversee websocket fanned out to local subscriber queues"""
+
+    def __init__(self, gateway: CloudGateway, robot_id: str):
+        self.gateway = gateway
+        self.robot_id = robot_id
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.ws = None
+        self.received = 0
+        self.dropped = 0
+        self._task = asyncio.create_task(self._run(), name=f"oversee:{robot_id}")
+
+    async def _run(self):
+        backoff = Backoff()
+        while True:
+            try:
+                token = await self.gateway.token()
+                url = f"{self.gateway.ws_url}/robot-control/oversee/{self.robot_id}"
+                async with websockets.connect(url, subprotocols=[token]) as ws:
+                    self.ws = ws
+                    backoff.reset()
+                    log.info("Oversee connected for cloud robot %s", self.robot_id)
+                    async for message in ws:
+                        self.received += 1
+                        self._fan_out(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("Oversee link for %s dropped: %s", self.robot_id, e, every=60.0)
+            finally:
+                self.ws = None
+            await asyncio.sleep(backoff.next_delay())
+
+    def _fan_out(self, message):
+        for queue in self.subscribers:
+            if queue.full():
+                # Slow subscriber: drop its oldest message rather than stall the link
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(message)
+
+    async def send(self, message: dict) -> bool:
+        if self.ws is None:
+            return False
+        await self.ws.send(codec.dumps(message).decode())
+        return True
+
+    async def close(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+async def relay_oversee(websocket: WebSocket, messages: asyncio.Queue):
+    """Forward oversee messages to a local client until it disconnects
+
+    The client is read at the same time, so a browser leaving a quiet robot
+    is noticed at once and its subscription (and the shared link) released.
+    """
+    async def until_disconnect():
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    receiver = asyncio.create_task(until_disconnect())
+    try:
+        while True:
+            getter = asyncio.ensure_future(messages.get())
+            done, _ = await asyncio.wait({receiver, getter}, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
+                return
+            message = getter.result()
+            if isinstance(message, bytes):
+                await websocket.send_bytes(message)
+            else:
+                await websocket.send_text(message)
+    finally:
+        receiver.cancel()
+
+
+class OverseeHub:
+    def __init__(self, gateway: CloudGateway):
+        self.gateway = gateway
+        self._links: Dict[str, OverseeLink] = {}
+        self._heartbeat: Optional[asyncio.Task] = None
+
+    @asynccontextmanager
+    async def subscribe(self, robot_id: str):
+        """Queue of oversee messages for a robot; the upstream link is shared and
+        closed when its last subscriber leaves"""
+        link = self._links.get(robot_id)
+        if link is None:
+            link = self._links[robot_id] = OverseeLink(self.gateway, robot_id)
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.create_task(self._beat(), name="oversee-heartbeat")
+
+        queue = asyncio.Queue(maxsize=OVERSEE_QUEUE)
+        link.subscribers.add(queue)
+        try:
+            yield queue
+        finally:
+            link.subscribers.discard(queue)
+            if not link.subscribers and self._links.get(robot_id) is link:
+                del self._links[robot_id]
+                await link.close()
+
+    async def send(self, robot_id: str, message: dict) -> bool:
+        link = self._links.get(robot_id)
+        return await link.send(message) if link else False
+
+    async def _beat(self):
+        """One heartbeat loop for every open link"""
+        while self._links:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            for link in list(self._links.values()):
+                try:
+                    await link.send({"reqType": "onHeartBeat"})
+                except Exception as e:
+                    log.debug("Heartbeat to %s failed: %s", link.robot_id, e)
+
+    async def close(self):
+        for link in list(self._links.values()):
+            await link.close()
+        self._links.clear()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+
+    def stats(self) -> dict:
+        return {
+            robot_id: {
+                "connected": link.ws is not None,
+                "subscribers": len(link.subscribers),
+                "received": link.received,
+                "dropped": link.dropped
+            }
+            for robot_id, link in self._links.items()
+        }
+
+
+cloud = CloudGateway()
@@ -0,0 +1,108 @@
+"""
+Local stand-in for the AutoXing cloud API, for exercising cloud.py without
+real credentials or robots
+
+    uvicorn cloud_standin:app --port 9100
+    CLOUD_BASE_URL=http://127.0.0.1:9100 CLOUD_WS_URL=ws://127.0.0.1:9100 \
+    CLOUD_APP_ID=test CLOUD_APP_SECRET=secret uvicorn fastapi_edge:app
+
+It implements the token, robot list, robot state and oversee endpoints with
+fake robots, and counts every call on GET /standin/stats
+"""
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from collections import Counter
+
+from fastapi import FastAPI, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
+
+app = FastAPI()
+
+ROBOTS = int(os.getenv("STANDIN_ROBOTS", "20"))
+TOKEN_SECONDS = float(os.getenv("STANDIN_TOKEN_SECONDS", "3600"))
+
+calls = Counter()
+tokens = {}
+
+
+def fake_state(robot_id: str) -> dict:
+    return {
+        "robotId": robot_id,
+        "isOnLine": True,
+        "battery": random.randint(20, 100),
+        "x": round(random.uniform(-10, 10), 2),
+        "y": round(random.uniform(-10, 10), 2),
+        "yaw": round(random.uniform(-3.14, 3.14), 2),
+        "timestamp": int(time.time() * 1000)
+    }
+
+
+def valid(token: str) -> bool:
+    return tokens.get(token, 0) > time.time()
+
+
+def json_401():
+    return JSONResponse({"status": 401, "message": "token expired"}, status_code=401)
+
+
+@app.post("/auth/v1.1/token")
+async def token(body: dict):
+    calls["token"] += 1
+    if not body.get("appId") or not body.get("sign"):
+        return {"status": 400, "message": "appId and sign are required"}
+    value = uuid.uuid4().hex
+    tokens[value] = time.time() + TOKEN_SECONDS
+    return {"status": 200, "message": "ok", "data": {"token": value, "expireTime": int(tokens[value] * 1000)}}
+
+
+@app.post("/robot/v1.1/list")
+async def robot_list(x_token: str = Header(None)):
+    calls["list"] += 1
+    if not valid(x_token):
+        return json_401()
+    robots = [fake_state(f"SIM{i:04d}") for i in range(ROBOTS)]
+    return {"status": 200, "data": {"total": len(robots), "list": robots}}
+
+
+@app.get("/robot/v1.1/{robot_id}/state")
+async def robot_state(robot_id: str, x_token: str = Header(None)):
+    calls["state"] += 1
+    if not valid(x_token):
+        return json_401()
+    return {"status": 200, "data": fake_state(robot_id)}
+
+
+@app.websocket("/robot-control/oversee/{robot_id}")
+async def oversee(websocket: WebSocket, robot_id: str):
+    token = (websocket.headers.get("sec-websocket-protocol") or "").split(",")[0].strip()
+    if not valid(token):
+        await websocket.close(code=4001)
+        return
+
+    calls["oversee"] += 1
+    await websocket.accept(subprotocol=token)
+
+    async def receive():
+        while True:
+            message = json.loads(await websocket.receive_text())
+            if message.get("reqType") == "onHeartBeat":
+                calls["heartbeat"] += 1
+
+    receiver = asyncio.create_task(receive())
+    try:
+        while not receiver.done():
+            await websocket.send_text(json.dumps({"type": "state", "data": fake_state(robot_id)}))
+            await asyncio.sleep(0.5)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+
+
+@app.get("/standin/stats")
+async def stats():
+    return dict(calls)
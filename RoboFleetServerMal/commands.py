@@ -0,0 +1,264 @@
+# commands.py
+"""
+Per-robot command executor.
+
+Commands to one robot run one at a time in submission order, so two
+`/move/poi` calls can no longer interleave their task bookkeeping and HTTP
+calls. A pending command submitted with a `key` is replaced by a newer one
+with the same key (e.g. repeated set_velocity), and all callers get the
+result of the command that actually ran.
+
+Emergency stop and cancel use a separate priority lane with its own
+pre-opened HTTP client: they never wait behind a slow move, and pending
+normal commands are dropped when `preempt` is set. Priority latency is
+tracked against PRIORITY_BUDGET_MS.
+
+`broadcast` fans one command out to many robots concurrently through their
+executors, bounded by a semaphore and a per-robot timeout.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+import httpx
+
+from drivers import driver_for
+from health import COMMAND_TIMEOUT
+from logger import get_logger
+
+log = get_logger(__name__)
+
+PRIORITY_BUDGET_MS = 250
+PRIORITY_TIMEOUT = httpx.Timeout(2.0, connect=1.0)
+
+# Robots contacted at once by a fleet command
+BROADCAST_CONCURRENCY = 16
+PRIORITY_BROADCAST_CONCURRENCY = 128
+BROADCAST_TIMEOUT = 10.0
+
+CommandFn = Callable[[httpx.AsyncClient], Awaitable]
+
+
+class CommandPreempted(Exception):
+    """A pending command was dropped by a priority command"""
+
+
+class Command:
+    __slots__ = ("name", "key", "fn", "futures", "submitted_at")
+
+    def __init__(self, name: str, key: Optional[str], fn: CommandFn):
+        self.name = name
+        self.key = key
+        self.fn = fn
+        self.futures = [asyncio.get_running_loop().create_future()]
+        self.submitted_at = time.perf_counter()
+
+
+class CommandExecutor:
+    def __init__(self, robot_id: int, base_url: str):
+        self.robot_id = robot_id
+        self.base_url = base_url
+        self.client = httpx.AsyncClient(base_url=base_url, timeout=COMMAND_TIMEOUT)
+        # Kept separate so an in-flight move never holds the connection a stop needs
+        self.priority_client = httpx.AsyncClient(base_url=base_url, timeout=PRIORITY_TIMEOUT)
+        self.running: Optional[str] = None
+        self.executed = 0
+        self.coalesced = 0
+        self.preempted = 0
+        self.priority_count = 0
+        self.priority_last_ms: Optional[float] = None
+        self.priority_max_ms = 0.0
+        self.priority_over_budget = 0
+        self._pending: Deque[Command] = deque()
+        self._ready = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self._warmup = asyncio.create_task(self._warm())
+
+    async def _warm(self):
+        """Open the priority connection before the first stop needs it"""
+        try:
+            await self.priority_client.get("/device/info")
+        except httpx.HTTPError as e:
+            log.debug("Priority lane warm-up failed: %s", e, robot_id=self.robot_id)
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run(), name=f"commands:{self.robot_id}")
+
+    async def submit(self, name: str, fn: CommandFn, key: str = None):
+        """Queue a command behind the ones already pending and wait for its result"""
+        if key is not None:
+            for pending in self._pending:
+                if pending.key == key:
+                    # Keep the queue position, run the newest arguments
+                    pending.fn = fn
+                    future = asyncio.get_running_loop().create_future()
+                    pending.futures.append(future)
+                    self.coalesced += 1
+                    return await future
+
+        command = Command(name, key, fn)
+        self._pending.append(command)
+        self._ready.set()
+        self._ensure_worker()
+        return await command.futures[0]
+
+    async def priority(self, name: str, fn: CommandFn, preempt: bool = True):
+        """Run immediately on the priority lane, optionally dropping pending commands"""
+        if preempt:
+            while self._pending:
+                command = self._pending.popleft()
+                for future in command.futures:
+                    if not future.done():
+                        future.set_exception(CommandPreempted(f"{command.name} preempted by {name}"))
+                self.preempted += 1
+
+        started = time.perf_counter()
+        try:
+            return await fn(self.priority_client)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.priority_count += 1
+            self.priority_last_ms = round(elapsed, 1)
+            self.priority_max_ms = max(self.priority_max_ms, self.priority_last_ms)
+            if elapsed > PRIORITY_BUDGET_MS:
+                self.priority_over_budget += 1
+                log.warning("Priority command %s took %.0f ms (budget %d ms)", name, elapsed, PRIORITY_BUDGET_MS,
+                            robot_id=self.robot_id)
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            while self._pending:
+                command = self._pending.popleft()
+                self.running = command.name
+                try:
+                    result = await command.fn(self.client)
+                except Exception as e:
+                    for future in command.futures:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for future in command.futures:
+                        if not future.done():
+                            future.set_result(result)
+                finally:
+                    self.running = None
+                    self.executed += 1
+            self._ready.clear()
+
+    async def close(self):
+        tasks = [task for task in (self._worker, self._warmup) if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.client.aclose()
+        await self.priority_client.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "pending": [command.name for command in self._pending],
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "preempted": self.preempted,
+            "priority": {
+                "count": self.priority_count,
+                "last_ms": self.priority_last_ms,
+                "max_ms": round(self.priority_max_ms, 1),
+                "over_budget": self.priority_over_budget,
+                "budget_ms": PRIORITY_BUDGET_MS
+            }
+        }
+
+
+_executors: Dict[int, CommandExecutor] = {}
+
+
+def robot_url(robot: dict) -> str:
+    """Command base URL of a robot row, as given by its model's driver"""
+    return driver_for(robot).base_url
+
+
+def open_executors(robots: List[dict]):
+    """Create executors (and warm their priority lanes) for registered robots"""
+    for robot in robots:
+        executor(robot["id"], robot_url(robot))
+
+
+def executor(robot_id: int, base_url: str) -> CommandExecutor:
+    """The executor for a robot, created (and its clients opened) on first use"""
+    current = _executors.get(robot_id)
+    if current is None:
+        current = _executors[robot_id] = CommandExecutor(robot_id, base_url)
+    return current
+
+
+async def close_executors():
+    for current in list(_executors.values()):
+        await current.close()
+    _executors.clear()
+
+
+def executor_stats() -> dict:
+    return {robot_id: current.stats() for robot_id, current in _executors.items()}
+
+
+def _failed(result) -> bool:
+    return isinstance(result, dict) and isinstance(result.get("status"), int) and result["status"] >= 400
+
+
+async def broadcast(robots: List[dict],
+                    name: str,
+                    make_command: Callable[[int], CommandFn],
+                    priority: bool = False,
+                    preempt: bool = True,
+                    key: str = None,
+                    concurrency: int = None,
+                    timeout: float = BROADCAST_TIMEOUT) -> dict:
+    """Run make_command(robot_id) on every robot and aggregate the per-robot results
+
+    Normal commands are queued behind each robot's pending commands; a robot
+    whose command times out here may still run it later. Priority commands use
+    the priority lanes and a much higher concurrency limit.
+    """
+    if concurrency is None:
+        concurrency = PRIORITY_BROADCAST_CONCURRENCY if priority else BROADCAST_CONCURRENCY
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.perf_counter()
+
+    async def run_one(robot: dict) -> dict:
+        async with semaphore:
+            current = executor(robot["id"], robot_url(robot))
+            command = make_command(robot["id"])
+            sent = time.perf_counter()
+            try:
+                if priority:
+                    result = await asyncio.wait_for(current.priority(name, command, preempt), timeout)
+                else:
+                    result = await asyncio.wait_for(current.submit(name, command, key), timeout)
+                outcome = {"ok": not _failed(result), "result": result}
+            except asyncio.TimeoutError:
+                outcome = {"ok": False, "error": f"timeout after {timeout}s"}
+            except CommandPreempted as e:
+                outcome = {"ok": False, "error": str(e)}
+            except Exception as e:
+                outcome = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            outcome["ms"] = round((time.perf_counter() - sent) * 1000, 1)
+            return outcome
+
+    outcomes = await asyncio.gather(*(run_one(robot) for robot in robots))
+    results = {robot["id"]: outcome for robot, outcome in zip(robots, outcomes)}
+    succeeded = sum(1 for outcome in outcomes if outcome["ok"])
+
+    summary = {
+        "command": name,
+        "robots": len(robots),
+        "succeeded": succeeded,
+        "failed": len(robots) - succeeded,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        "results": results
+    }
+    log.info("Fleet %s: %d/%d succeeded in %.0f ms", name, succeeded, len(robots), summary["elapsed_ms"])
+    return summary
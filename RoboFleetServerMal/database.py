@@ -1,10 +1,12 @@
 # database.py
 import asyncpg
-from typing import Optional
+from typing import AsyncIterator, Optional, Tuple
 import math
 import asyncio
 import datetime
 
+from versions import versions
+
 pool: Optional[asyncpg.Pool] = None
 
 async def init_postgres():
@@ -19,6 +21,11 @@ async def init_postgres():
         min_size=5,
         max_size=20
     )
+
+    # Session and task writes add into the rollups in the same statement, so
+    # the table has to exist before the first one (backfill: migrate_rollups.py)
+    async with pool.acquire() as conn:
+        await conn.execute(ROLLUP_SCHEMA)
         
     print("PostgresSQL connection pool created")
 
@@ -33,6 +40,39 @@ def calculate_distance(x1: float, y1: float, x2: float, y2: float) -> float:
     """Calculate Euclidean distance"""
     return math.sqrt((x2 - x1)**2 +(y2 - y1)**2)
 
+# ============ JSON STREAMING ============
+# List endpoints with large results let PostgreSQL render the JSON: every row
+# is one row_to_json text, read through a server-side cursor JSON_CHUNK rows
+# at a time and passed on as bytes. No Record -> dict -> jsonable_encoder ->
+# json.dumps per row in Python, and at most one chunk in memory.
+#
+# A stream holds its connection until the client has read the last chunk, so
+# at most JSON_STREAMS of them run at once and slow clients can never take
+# the pool (max_size 20) from task and session writes. Stalled clients are cut
+# off by versions.STREAM_SEND_TIMEOUT, which gives the connection back.
+
+JSON_CHUNK = 1000
+JSON_STREAMS = 4
+
+_json_streams = asyncio.Semaphore(JSON_STREAMS)
+
+async def stream_json_array(query: str, *args, chunk: int = JSON_CHUNK) -> AsyncIterator[bytes]:
+    """The rows of `query` as a JSON array, in byte chunks"""
+    async with _json_streams:
+        async with pool.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                cursor = await conn.cursor(f"SELECT row_to_json(r)::text FROM ({query}) r", *args)
+                yield b"["
+                separator = ""
+                while True:
+                    rows = await cursor.fetch(chunk)
+                    if rows:
+                        yield (separator + ",".join(row[0] for row in rows)).encode()
+                        separator = ","
+                    if len(rows) < chunk:
+                        break
+                yield b"]"
+
 # =========== ROBOT OPERATIONS ============
 
 async def insert_robot(name: str, nickname: str, sn: str, ip: str, model: str = "AMR"):
@@ -55,6 +95,30 @@ async def get_robot_id_by_sn(sn: str) -> Optional[int]:
 
         return robot_id
     
+async def get_robot_ip(robot_id: int) -> Optional[str]:
+    """Get robot IP address from robot ID"""
+    async with pool.acquire() as conn:
+        ip = await conn.fetchval(
+            'SELECT ip FROM robots WHERE id = $1', robot_id
+        )
+
+        return ip
+
+async def get_all_robots() -> list:
+    """All registered robots with their connection details"""
+    async with pool.acquire() as conn:
+        rows = await conn.fetch('SELECT id, sn, ip, model, name, nickname FROM robots ORDER BY id')
+
+        return [dict(row) for row in rows]
+
+def stream_robots() -> AsyncIterator[bytes]:
+    """The robot registry as a JSON array"""
+    return stream_json_array('''
+        SELECT id, name, nickname, sn, ip, model, status, time_created
+        FROM robots
+        ORDER BY id
+    ''')
+
 async def update_robot_status(robot_id: int, status: str, last_poi: str = None):
     """Update robot status and last POI"""
     async with pool.acquire() as conn:
@@ -89,27 +153,40 @@ async def create_task(
             (task_id, robot_id, last_poi, target_poi, status, distance, start_time, end_time)
             VALUES ($1, $2, $3, $4, 'in_progress', $5, NOW(), NOW())
         ''', task_id, robot_id, last_poi, target_poi, distance)
-        
-        return task_id
+
+    await versions.bump("tasks")
+    return task_id
     
 async def update_task_status(task_id: int, status: str, fail_reason: str = None):
-    """Update task status (Complete, Failed, Cancel )"""
+    """Update task status (Complete, Failed, Cancel ) and roll a finished task into its hours"""
+    notes = f"Failed: {fail_reason}" if fail_reason else None
+
     async with pool.acquire() as conn:
-        if fail_reason:
-            await conn.execute('''
-                UPDATE tasks_history
-                SET status = $1, end_time = NOW(), notes = $2
+        # Only the transition out of in_progress is rolled up, so repeated
+        # updates of a finished task are not counted twice
+        await conn.execute('''
+            WITH previous AS (
+                SELECT task_id, status FROM tasks_history
                 WHERE task_id = $3
-            ''', status, f"Failed: {fail_reason}", task_id)
-
-        else:
-            await conn.execute('''
-                UPDATE tasks_history
-                SET status = $1, end_time = NOW()
-                WHERE task_id = $2
-            ''', status, task_id)
+                FOR UPDATE
+            ),
+            finished AS (
+                UPDATE tasks_history t
+                SET status = $1, end_time = NOW(), notes = COALESCE($2, t.notes)
+                FROM previous
+                WHERE t.task_id = previous.task_id
+                RETURNING t.robot_id, t.status, t.start_time, t.end_time, t.distance, previous.status AS previous_status
+            ),
+            tasks AS (
+                SELECT robot_id, status, start_time, end_time, distance FROM finished
+                WHERE previous_status = 'in_progress' AND status <> 'in_progress'
+            )
+            ''' + ROLLUP_TASKS + '''
+        ''', status, notes, task_id)
 
         print(f"Task {task_id} update status to {status}")
+
+    await versions.bump("tasks")
         
 async def get_active_task(robot_id: int):
     """Get currently active task for a robot"""
@@ -132,25 +209,33 @@ async def get_task_by_id(task_id: int):
     
     return dict(row) if row else None
 
+def task_history_query(robot_id: int = None, limit: int = 100) -> Tuple[str, tuple]:
+    if robot_id:
+        return '''
+            SELECT * FROM tasks_history
+            WHERE robot_id = $1
+            ORDER BY start_time DESC
+            LIMIT $2
+        ''', (robot_id, limit)
+
+    return '''
+        SELECT * FROM tasks_history
+        ORDER BY start_time DESC
+        LIMIT $1
+    ''', (limit,)
+
 async def get_task_history(robot_id: int = None, limit: int = 100):
     """Get task history"""
+    query, args = task_history_query(robot_id, limit)
     async with pool.acquire() as conn:
-        if robot_id:
-            rows = await conn.fetch('''
-                SELECT * FROM tasks_history
-                WHERE robot_id = $1
-                ORDER BY start_time DESC
-                LIMIT $2
-            ''', robot_id, limit)
-        
-        else:
-            rows = await conn.fetch('''
-                SELECT * FROM tasks_history
-                ORDER BY start_time DESC
-                LIMIT $1    
-            ''', limit)
+        rows = await conn.fetch(query, *args)
 
         return[dict(row) for row in rows]
+
+def stream_task_history(robot_id: int = None, limit: int = 100) -> AsyncIterator[bytes]:
+    """Task history as a JSON array rendered by PostgreSQL"""
+    query, args = task_history_query(robot_id, limit)
+    return stream_json_array(query, *args)
     
 async def get_task_statistics(robot_id: int = None):
     """Get comprehensive task statistics"""
@@ -203,6 +288,26 @@ async def record_position(robot_id: int, x: float, y: float, ori: float, prev_x:
             VALUES (NOW(), $1, $2, $3, $4, $5)
         ''', robot_id, x, y, ori, distance)
 
+    await versions.bump("movement")
+
+async def record_positions(rows: list):
+    """Record a batch of positions: (robot_id, x, y, ori, prev_x, prev_y, ts) tuples"""
+
+    records = []
+    for robot_id, x, y, ori, prev_x, prev_y, ts in rows:
+        distance = 0.0
+        if prev_x is not None and prev_y is not None:
+            distance = calculate_distance(prev_x, prev_y, x, y)
+        records.append((ts, robot_id, x, y, ori, distance))
+
+    async with pool.acquire() as conn:
+        await conn.executemany('''
+            INSERT INTO robot_movement (time, robot_id, x, y, ori, distance)
+            VALUES (to_timestamp($1), $2, $3, $4, $5, $6)
+        ''', records)
+
+    await versions.bump("movement")
+
 async def get_movement_history(robot_id: int, limit: int = 1000):
     """Get movement history"""
     async with pool.acquire() as conn:
@@ -214,6 +319,20 @@ async def get_movement_history(robot_id: int, limit: int = 1000):
         
         return [dict(row) for row in rows]
 
+async def get_trajectory_columns(robot_id: int, start: datetime.datetime, end: datetime.datetime):
+    """Positions in [start, end) as three parallel lists (epoch seconds, x, y), ordered by time"""
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow('''
+            SELECT
+                array_agg(EXTRACT(EPOCH FROM time)::float8 ORDER BY time) AS ts,
+                array_agg(x ORDER BY time) AS xs,
+                array_agg(y ORDER BY time) AS ys
+            FROM robot_movement
+            WHERE robot_id = $1 AND time >= $2 AND time < $3
+        ''', robot_id, start, end)
+
+        return row['ts'] or [], row['xs'] or [], row['ys'] or []
+
 async def get_total_distance(robot_id: int, start_date:datetime.datetime = None ):
     """Calculate total distance traveled"""
     async with pool.acquire() as conn:
@@ -265,145 +384,209 @@ async def get_robot_stats(robot_id: int):
             "total_distance_traveled": float(movement_distance)
         }
     
+# ============ HOURLY ROLLUPS ============
+# robot_hourly_rollup (see migrate_rollups.py) holds per robot and hour:
+# online_seconds, busy_seconds (task time), tasks_completed / _failed /
+# _cancelled, task_distance and completed_task_seconds. robot_id FLEET_ROLLUP
+# holds the fleet totals, so any 1h-30d window reads at most 720 rows.
+# Rows are added to as sessions and tasks close, in the same statement.
+
+FLEET_ROLLUP = 0
+
+ROLLUP_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS robot_hourly_rollup (
+        robot_id                INTEGER NOT NULL,          -- 0 = whole fleet
+        hour                    TIMESTAMPTZ NOT NULL,
+        online_seconds          DOUBLE PRECISION NOT NULL DEFAULT 0,
+        busy_seconds            DOUBLE PRECISION NOT NULL DEFAULT 0,
+        tasks_completed         INTEGER NOT NULL DEFAULT 0,
+        tasks_failed            INTEGER NOT NULL DEFAULT 0,
+        tasks_cancelled         INTEGER NOT NULL DEFAULT 0,
+        task_distance           DOUBLE PRECISION NOT NULL DEFAULT 0,
+        completed_task_seconds  DOUBLE PRECISION NOT NULL DEFAULT 0,
+        PRIMARY KEY (robot_id, hour)
+    );
+'''
+
+# Append to a WITH whose last CTE is `closed(robot_id, started_at, ended_at)`
+ROLLUP_SESSIONS = '''
+    INSERT INTO robot_hourly_rollup (robot_id, hour, online_seconds)
+    SELECT COALESCE(robot_id, 0), hour, SUM(seconds)
+    FROM (
+        SELECT c.robot_id, h.hour,
+               EXTRACT(EPOCH FROM LEAST(c.ended_at, h.hour + INTERVAL '1 hour') - GREATEST(c.started_at, h.hour)) AS seconds
+        FROM closed c, generate_series(date_trunc('hour', c.started_at), c.ended_at, INTERVAL '1 hour') AS h(hour)
+    ) parts
+    GROUP BY GROUPING SETS ((robot_id, hour), (hour))
+    ON CONFLICT (robot_id, hour) DO UPDATE
+    SET online_seconds = robot_hourly_rollup.online_seconds + EXCLUDED.online_seconds
+'''
+
+# Append to a WITH whose last CTE is `tasks(robot_id, status, start_time, end_time, distance)`.
+# Busy time is split across the hours the task ran; counts and distance go to its end hour.
+ROLLUP_TASKS = '''
+    INSERT INTO robot_hourly_rollup (robot_id, hour, busy_seconds, tasks_completed, tasks_failed,
+                                     tasks_cancelled, task_distance, completed_task_seconds)
+    SELECT COALESCE(robot_id, 0), hour, SUM(busy), SUM(completed), SUM(failed), SUM(cancelled),
+           SUM(distance), SUM(completed_seconds)
+    FROM (
+        SELECT t.robot_id, h.hour,
+               EXTRACT(EPOCH FROM LEAST(t.end_time, h.hour + INTERVAL '1 hour') - GREATEST(t.start_time, h.hour)) AS busy,
+               0 AS completed, 0 AS failed, 0 AS cancelled, 0 AS distance, 0 AS completed_seconds
+        FROM tasks t, generate_series(date_trunc('hour', t.start_time), t.end_time, INTERVAL '1 hour') AS h(hour)
+        UNION ALL
+        SELECT t.robot_id, date_trunc('hour', t.end_time), 0,
+               (t.status = 'completed')::int, (t.status = 'failed')::int, (t.status = 'cancelled')::int,
+               COALESCE(t.distance, 0),
+               CASE WHEN t.status = 'completed' THEN EXTRACT(EPOCH FROM t.end_time - t.start_time) ELSE 0 END
+        FROM tasks t
+    ) parts
+    GROUP BY GROUPING SETS ((robot_id, hour), (hour))
+    ON CONFLICT (robot_id, hour) DO UPDATE
+    SET busy_seconds = robot_hourly_rollup.busy_seconds + EXCLUDED.busy_seconds,
+        tasks_completed = robot_hourly_rollup.tasks_completed + EXCLUDED.tasks_completed,
+        tasks_failed = robot_hourly_rollup.tasks_failed + EXCLUDED.tasks_failed,
+        tasks_cancelled = robot_hourly_rollup.tasks_cancelled + EXCLUDED.tasks_cancelled,
+        task_distance = robot_hourly_rollup.task_distance + EXCLUDED.task_distance,
+        completed_task_seconds = robot_hourly_rollup.completed_task_seconds + EXCLUDED.completed_task_seconds
+'''
+
+async def get_rollup_totals(conn, window: datetime.timedelta, robot_id: int = None) -> dict:
+    """Summed hourly rollups for the last `window` (whole hours), plus the open sessions
+
+    Open sessions are not rolled up until they close, so their time since the
+    window start is added from robot_session_intervals.
+    """
+    row = await conn.fetchrow('''
+        WITH since AS (SELECT date_trunc('hour', NOW() - $1::interval) AS hour)
+        SELECT
+            COALESCE(SUM(online_seconds), 0) AS online_seconds,
+            COALESCE(SUM(busy_seconds), 0) AS busy_seconds,
+            COALESCE(SUM(tasks_completed), 0) AS tasks_completed,
+            COALESCE(SUM(tasks_failed), 0) AS tasks_failed,
+            COALESCE(SUM(tasks_cancelled), 0) AS tasks_cancelled,
+            COALESCE(SUM(task_distance), 0) AS task_distance,
+            COALESCE(SUM(completed_task_seconds), 0) AS completed_task_seconds,
+            (
+                SELECT COALESCE(SUM(EXTRACT(EPOCH FROM NOW() - GREATEST(started_at, since.hour))), 0)
+                FROM robot_session_intervals
+                WHERE ended_at IS NULL AND ($2::int IS NULL OR robot_id = $2)
+            ) AS open_seconds
+        FROM since
+        LEFT JOIN robot_hourly_rollup r ON r.robot_id = COALESCE($2, $3) AND r.hour >= since.hour
+        GROUP BY since.hour
+    ''', window, robot_id, FLEET_ROLLUP)
+
+    totals = {key: float(value) for key, value in row.items()}
+    totals["online_seconds"] += totals.pop("open_seconds")
+    return totals
+
 # ============ ROBOT SESSION TRACKING ============
+# One row per online interval in robot_session_intervals (see migrate_sessions.py).
+# `period` is tstzrange(started_at, ended_at) with an open upper bound while the
+# robot is online; the GiST exclusion constraint keeps a robot's intervals from
+# overlapping and serves the window overlap queries below.
+
+def time_range_interval(time_range: str) -> datetime.timedelta:
+    """Window length for a time_range string ("1h", "24h", "7d", "30d")"""
+    return {
+        "1h": datetime.timedelta(hours=1),
+        "24h": datetime.timedelta(hours=24),
+        "7d": datetime.timedelta(days=7),
+        "30d": datetime.timedelta(days=30)
+    }.get(time_range, datetime.timedelta(hours=24))
 
 async def start_robot_session(robot_id: int):
     """Record when robot comes online & Called when robot connects to system"""
+    session_ids = await start_robot_sessions([robot_id])
+    session_id = session_ids.get(robot_id)
+    print(f"Robot {robot_id} session started - ID: {session_id}")
+    return session_id
 
-    async with pool.acquire() as conn:
-
-        unclosed = await conn.fetchval('''
-            SELECT id FROM robot_sessions
-            WHERE robot_id = $1 AND status = 'online'
-            ORDER BY timestamp DESC
-            LIMIT 1
-        ''', robot_id)
-
-        if unclosed:
-            duration = await conn.fetchval('''SELECT NOW() - timestamp FROM robot_sessions WHERE id = $1''', unclosed)
-
-            await conn.execute('''
-                INSERT INTO robot_sessions (robot_id, status, timestamp, session_duration, notes)
-                VALUES ($1, 'offline', NOW(), $2, 'Auto-closed: New session started')
-        ''', robot_id, duration)
-            
-        print(f"Auto-closed previous session {unclosed} for robot {robot_id}")
-
-        session_id = await conn.fetchval('''
-            INSERT INTO robot_sessions (robot_id, status, timestamp)
-            VALUES ($1, 'online', NOW())
-            RETURNING id
-        ''', robot_id)
-
-        print(f"Robot {robot_id} session started - ID: {session_id}")
-        return session_id
-    
 async def end_robot_session(robot_id: int, reason: str = "normal"):
     """Record when robot offline & Calculate how long the session lasted"""
     async with pool.acquire() as conn:
-        last_online = await conn.fetchrow('''
-            SELECT id, timestamp
-            FROM robot_sessions
-            WHERE robot_id = $1
-            AND status = 'online'
-            ORDER BY timestamp DESC
-            LIMIT 1
-        ''', robot_id)
-
-        if not last_online:
+        row = await conn.fetchrow('''
+            WITH closed AS (
+                UPDATE robot_session_intervals
+                SET ended_at = NOW(), end_reason = $2
+                WHERE robot_id = $1 AND ended_at IS NULL
+                RETURNING id, robot_id, started_at, ended_at
+            ),
+            rollup AS (''' + ROLLUP_SESSIONS + ''')
+            SELECT id, ended_at - started_at AS duration FROM closed
+        ''', robot_id, f"Disconnected: {reason}")
+
+        await versions.bump("sessions")
+        if not row:
             print(f"No active session found for robot {robot_id}")
             return None
-        
-        #calculate duration
-        duration = await conn.fetchval('''SELECT NOW() - $1''', last_online['timestamp'])
 
-        #Insert offline record
-        session_id = await conn.fetchval('''
-            INSERT INTO robot_sessions (robot_id, status, timestamp, session_duration, notes)
-            VALUES ($1, 'offline', NOW(), $2, $3)
-            RETURNING id    
-        ''', robot_id, duration, f"Disconnected: {reason}")
+        print(f"Robot {robot_id} session ended - Duration: {row['duration']} - Reason: {reason}")
+        return row['id']
 
-        print(f"Robot {robot_id} session ended - Duration: {duration} - Reason: {reason}")
-        return session_id
+async def start_robot_sessions(robot_ids: list) -> dict:
+    """Start sessions for many robots in one statement, returning {robot_id: session_id}
 
-async def get_robot_operating_hours(robot_id: int = None, time_range: str = "24h"):
-    """Calculate total operating hours = Sum of all (offline_time - online_time) for completed sessions"""
+    A session still open for one of the robots is closed in the same statement.
+    The exclusion constraint is deferred, so the order of the two writes does
+    not matter.
+    """
     async with pool.acquire() as conn:
+        rows = await conn.fetch('''
+            WITH closed AS (
+                UPDATE robot_session_intervals
+                SET ended_at = NOW(), end_reason = 'Auto-closed: New session started'
+                WHERE robot_id = ANY($1::int[]) AND ended_at IS NULL
+                RETURNING robot_id, started_at, ended_at
+            ),
+            rollup AS (''' + ROLLUP_SESSIONS + ''')
+            INSERT INTO robot_session_intervals (robot_id, started_at)
+            SELECT unnest($1::int[]), NOW()
+            RETURNING robot_id, id
+        ''', robot_ids)
+
+        print(f"Started {len(rows)} robot sessions")
+        await versions.bump("sessions")
+        return {row['robot_id']: row['id'] for row in rows}
+
+async def end_robot_sessions(items: list):
+    """End sessions for many robots at once: (robot_id, reason) tuples"""
+    robot_ids = [robot_id for robot_id, _ in items]
+    reasons = [reason for _, reason in items]
 
-        if time_range == "1h":
-            interval = "1 hour"
-        elif time_range == "24h":
-            interval = "24 hours"
-        elif time_range == "7d":
-            interval = "7 days"
-        else:
-            interval = "8 days"
+    async with pool.acquire() as conn:
+        rows = await conn.fetch('''
+            WITH closed AS (
+                UPDATE robot_session_intervals s
+                SET ended_at = NOW(), end_reason = 'Disconnected: ' || e.reason
+                FROM unnest($1::int[], $2::text[]) AS e(robot_id, reason)
+                WHERE s.robot_id = e.robot_id AND s.ended_at IS NULL
+                RETURNING s.robot_id, s.id, s.started_at, s.ended_at
+            ),
+            rollup AS (''' + ROLLUP_SESSIONS + ''')
+            SELECT robot_id, id FROM closed
+        ''', robot_ids, reasons)
+
+        print(f"Ended {len(rows)} robot sessions")
+        await versions.bump("sessions")
+        return {row['robot_id']: row['id'] for row in rows}
 
-        if robot_id:
-            query = '''
-                SELECT COALESCE(
-                    SUM(EXTRACT(EPOCH FROM session_duration)) / 3600,
-                    0
-                ) as operating_hours
-                FROM robot_sessions
-                WHERE robot_id = $1
-                AND status = 'offline'
-                AND timestamp >= NOW() - INTERVAL $2
-            '''
-            hours = await conn.fetchval(query, robot_id, interval)
-        else:
-            query = '''
-                SELECT COALESCE(
-                    SUM(EXTRACT(EPOCH FROM session_duration)) / 3600,
-                    0
-                ) as operating_hours
-                FROM robot_sessions
-                WHERE status = 'offline'
-                AND timestamp >= NOW() - INTERVAL $1
-            '''
-            hours = await conn.fetchval(query, interval)
-
-        return round(float(hours), 2)
+async def get_robot_operating_hours(robot_id: int = None, time_range: str = "24h"):
+    """Calculate total operating hours = online time in the window (hourly rollups + open sessions)"""
+    async with pool.acquire() as conn:
+        totals = await get_rollup_totals(conn, time_range_interval(time_range), robot_id)
+        return round(totals["online_seconds"] / 3600, 2)
     
 async def get_fleet_uptime_percentange(time_range: str = "24h"):
     """Fleet Uptime = (Total time spent on tasks) / (Total operating hours)
     Your insight: Compare task time vs robot online time
     """
     async with pool.acquire() as conn:
-        if time_range == "1h":
-            interval = "1 hour"
-        elif time_range == "24h":
-            interval = "24 hours"
-        elif time_range == "7d":
-            interval = "7 days"
-        elif time_range == "30d":
-            interval = "30 days"
-        else:
-            interval = "24 hours"
+        totals = await get_rollup_totals(conn, time_range_interval(time_range))
 
-        total_operating_hours = await conn.fetchval('''
-            SELECT COALESCE(
-                SUM(EXTRACT(EPOCH FROM session_duration)) / 3600, 
-                0
-            )
-            FROM robot_sessions
-            WHERE status = 'offline'
-            AND timestamp >= NOW() - INTERVAL $1
-        ''', interval)
-
-        total_task_hours = await conn.fetchval('''
-            SELECT COALESCE(
-                SUM(EXTRACT(EPOCH FROM (end_time - start_time))) / 3600,
-                0
-            )
-            FROM task_history
-            WHERE status = 'completed'
-            AND start_time >= NOW() - INTERVAL $1
-        ''', interval)
-
-        if total_operating_hours > 0:
-            uptime_percentage = (total_task_hours / total_operating_hours) * 100
+        if totals["online_seconds"] > 0:
+            uptime_percentage = (totals["busy_seconds"] / totals["online_seconds"]) * 100
         else:
             uptime_percentage = 0
 
@@ -413,67 +596,61 @@ async def get_robot_current_session_duration(robot_id: int):
     """If robot is currently online, how long has it been online"""
 
     async with pool.acquire() as conn:
-        last_session = await conn.fetchrow('''
-            SELECT status, timestamp
-            FROM robot_sessions
-            WHERE robot_id = $1
-            ORDER BY timestamp DESC
-            LIMIT 1
-        ''', robot_id)
-
-        if not last_session or last_session['status'] != 'online':
-            return 0
-        
         duration = await conn.fetchval('''
-            SELECT EXTRACT(EPOCH FROM (NOW() - $1)) /3600
-        ''', last_session['timestamp'])
+            SELECT EXTRACT(EPOCH FROM (NOW() - started_at)) / 3600
+            FROM robot_session_intervals
+            WHERE robot_id = $1 AND ended_at IS NULL
+        ''', robot_id)
 
-        return round(float(duration), 2)
+        return round(float(duration), 2) if duration is not None else 0
     
-async def get_session_history(robot_id: int = None, limit: int = 100):
-    """Get history of robot online/offline events"""
+def session_history_query(robot_id: int = None, limit: int = 100, duration_seconds: bool = False) -> Tuple[str, tuple]:
+    # row_to_json writes an interval as "01:02:03", the Python path as seconds
+    duration = "COALESCE(s.ended_at, NOW()) - s.started_at"
+    if duration_seconds:
+        duration = f"EXTRACT(EPOCH FROM {duration})::float8"
+
+    if robot_id:
+        return f'''
+            SELECT s.id, s.robot_id, s.started_at, s.ended_at, s.end_reason,
+                   {duration} AS session_duration
+            FROM robot_session_intervals s
+            WHERE s.robot_id = $1
+            ORDER BY s.started_at DESC
+            LIMIT $2
+        ''', (robot_id, limit)
+
+    return f'''
+        SELECT s.id, s.robot_id, s.started_at, s.ended_at, s.end_reason,
+               {duration} AS session_duration, r.nickname
+        FROM robot_session_intervals s
+        JOIN robots r ON s.robot_id = r.id
+        ORDER BY s.started_at DESC
+        LIMIT $1
+    ''', (limit,)
 
+async def get_session_history(robot_id: int = None, limit: int = 100):
+    """Get history of robot sessions, newest first"""
+    query, args = session_history_query(robot_id, limit)
     async with pool.acquire() as conn:
-        if robot_id:
-            rows = await conn.fetch('''
-                SELECT * FROM robot_sessions
-                WHERE robot_id = $1
-                ORDER BY timestamp DESC
-                LIMIT $2
-            ''', robot_id, limit)
-        else:
-            rows = await conn.fetch('''
-                SELECT rs.*, r.nickname
-                FROM robot_sessions rs
-                JOIN robots r ON rs.robot_id = r.id
-                ORDER BY timestamp DESC
-                LIMIT $1
-            ''', limit)
-        
+        rows = await conn.fetch(query, *args)
+
         return [dict(row) for row in rows]
+
+def stream_session_history(robot_id: int = None, limit: int = 100) -> AsyncIterator[bytes]:
+    """Session history as a JSON array rendered by PostgreSQL, durations in seconds"""
+    query, args = session_history_query(robot_id, limit, duration_seconds=True)
+    return stream_json_array(query, *args)
     
 async def get_fleet_analytics(time_range: str = "24h"):
-    """UPDATED: Uses your session tracking concept"""
+    """UPDATED: Uses your session tracking concept, read from the hourly rollups"""
 
     async with pool.acquire() as conn:
-        if time_range == "1h":
-            interval = "1 hour"
-        elif time_range == "24h":
-            interval = "24 hours"
-        elif time_range == "7d":
-            interval = "7 days"
-        elif time_range == "30d":
-            interval = "30 days"
-        else:
-            interval = "24 hours"
+        window = time_range_interval(time_range)
 
         total_robots = await conn.fetchval('SELECT COUNT(*) FROM robots')
 
-        tasks_completed = await conn.fetchval('''
-            SELECT COUNT(*) FROM tasks_history
-            WHERE status = 'completed
-            AND start_time >= NOW() - INTERVAL $1
-        ''', interval)
+        totals = await get_rollup_totals(conn, window)
 
         task_in_progress = await conn.fetchval('''
             SELECT COUNT(*) FROM tasks_history
@@ -482,50 +659,28 @@ async def get_fleet_analytics(time_range: str = "24h"):
 
         total_distance = await conn.fetchval('''
             SELECT COALESCE(SUM(distance), 0) FROM robot_movement
-            WHERE time >= NOW() - INTERVAL $1
-        ''', interval)
+            WHERE time >= NOW() - $1::interval
+        ''', window)
         total_milage_km = float(total_distance) / 1000.0
 
-        operating_hours = await conn.fetchval('''
-            SELECT COALESCE(
-                SUM(EXTRACT(EPOCH FROM session_duration)) / 3600, 0
-            )
-            FROM robot_sessions
-            WHERE status = 'offline'
-            AND timestamp >= NOW() - INTERVAL $1        
-        ''', interval)
-
-        total_task_hours = await conn.fetchval('''
-            SELECT COALESCE(
-                SUM(EXTRACT(EPOCH FROM (end_time - start_time))) / 3600,
-                0
-            )
-            FROM tasks_history
-            WHERE status = 'completed'
-            AND start_time >= NOW() - INTERVAL $1
-        ''', interval)
+        operating_hours = totals["online_seconds"] / 3600
 
-        if operating_hours > 0:
-            fleet_uptime_pct = (total_task_hours / operating_hours) * 100
+        if totals["online_seconds"] > 0:
+            fleet_uptime_pct = (totals["busy_seconds"] / totals["online_seconds"]) * 100
         else:
             fleet_uptime_pct = 0
 
-        avg_task_time = await conn.fetchval('''
-            SELECT COALESCE(
-                AVG(EXTRACT(EPOCH FROM (end_time - start_time)) / 60),
-                0
-            )
-            FROM tasks_history
-            WHERE status = 'completed'
-            AND start_time >= NOW() - INTERVAL $1
-        ''', interval)
+        if totals["tasks_completed"]:
+            avg_task_time = totals["completed_task_seconds"] / totals["tasks_completed"] / 60
+        else:
+            avg_task_time = 0
 
         return {
             "total_robots": total_robots,
-            "task_completed": tasks_completed,
+            "task_completed": int(totals["tasks_completed"]),
             "tasks_in_progress": task_in_progress,
             "total_mileage_km": round(total_milage_km, 2),
-            "operating_hours": round(float(operating_hours), 1),
-            "avg_task_time_min": round(float(avg_task_time), 1),
+            "operating_hours": round(operating_hours, 1),
+            "avg_task_time_min": round(avg_task_time, 1),
             "fleet_uptime_pct": round(fleet_uptime_pct, 1)
-        }
\ No newline at end of file
+        }
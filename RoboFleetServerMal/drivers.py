@@ -0,0 +1,202 @@
+# drivers.py
+"""
+Robot drivers: everything that depends on the robot model.
+
+A driver knows how to reach one robot and speak its protocol:
+
+    connect / subscribe   - open the telemetry connection and enable topics
+    decode                - raw frame -> normalised telemetry message
+                            (Pose, Battery, PlanningState, Lidar, Status)
+    commands              - DriverRequest (method, path, body) for move,
+                            charge, cancel, emergency stop, ...
+
+Drivers hold no tasks or connections of their own. The ingest engine
+(redis_server.py) runs one monitor per robot whatever its model. Commands go
+through the robot's CommandExecutor clients, and all decoded messages feed
+the same pipeline and FleetState. Adding a robot model means adding a driver
+class and registering it under the model name stored in `robots.model`.
+"""
+import json
+from typing import Dict, NamedTuple, Optional, Type
+
+import httpx
+import websockets
+from websockets.exceptions import WebSocketException
+
+from logger import get_logger
+from telemetry import decode_frame
+
+log = get_logger(__name__)
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+class UnsupportedCommand(NotImplementedError):
+    """The robot model has no equivalent of this command"""
+
+
+class DriverRequest(NamedTuple):
+    method: str
+    path: str
+    json: Optional[dict] = None
+
+
+async def send(client: httpx.AsyncClient, request: DriverRequest):
+    """Run a driver request on one of the robot's pooled clients and return the JSON reply"""
+    r = await client.request(request.method, request.path, headers=JSON_HEADERS, json=request.json)
+    r.raise_for_status()
+    return r.json()
+
+
+class RobotDriver:
+    """Base class; subclasses set `model` and implement what their robot supports"""
+    model: str = None
+
+    # Exceptions that mean the telemetry link dropped (reconnect with backoff)
+    connection_errors: tuple = (OSError,)
+
+    def __init__(self, robot_id: Optional[int], ip: str):
+        self.robot_id = robot_id
+        self.ip = ip
+
+    @property
+    def base_url(self) -> str:
+        raise NotImplementedError
+
+    # ============ TELEMETRY ============
+
+    async def connect(self):
+        """Open the telemetry connection: an async context manager with recv()"""
+        raise NotImplementedError
+
+    async def subscribe(self, connection):
+        """Enable the topics the ingest engine needs"""
+
+    def decode(self, raw):
+        """Normalised message for a raw frame, or None for frames we ignore"""
+        raise NotImplementedError
+
+    # ============ COMMANDS ============
+
+    def _unsupported(self, name: str):
+        raise UnsupportedCommand(f"{name} is not supported by {self.model} robots")
+
+    def move(self, target: dict) -> DriverRequest:
+        """Move to {"target_x", "target_y", "target_ori"}"""
+        self._unsupported("move")
+
+    def charge(self) -> DriverRequest:
+        self._unsupported("charge")
+
+    def cancel(self) -> DriverRequest:
+        self._unsupported("cancel")
+
+    def emergency_stop(self, payload: dict) -> DriverRequest:
+        self._unsupported("emergency_stop")
+
+    def set_control_mode(self, mode: str) -> DriverRequest:
+        self._unsupported("set_control_mode")
+
+    def set_max_velocity(self, velocity: float) -> DriverRequest:
+        self._unsupported("set_max_velocity")
+
+    def jack(self, service: str) -> DriverRequest:
+        self._unsupported(service)
+
+
+class AutoXingDriver(RobotDriver):
+    """AutoXing AMRs: REST and topic websocket on port 8090"""
+    model = "autoxing"
+
+    PORT = 8090
+    TOPICS = ["/battery_state", "/tracked_pose", "/planning_state", "/scan_matched_points2"]
+    DISABLED_TOPICS = ["/slam/state"]
+
+    connection_errors = (WebSocketException, OSError)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.ip}:{self.PORT}"
+
+    @property
+    def ws_url(self) -> str:
+        return f"ws://{self.ip}:{self.PORT}/ws/v2/topics"
+
+    async def connect(self):
+        return await websockets.connect(self.ws_url, ping_interval=20, ping_timeout=10, close_timeout=10, open_timeout=10)
+
+    async def subscribe(self, connection):
+        await connection.send(json.dumps({"disable_topic": self.DISABLED_TOPICS}))
+        await connection.send(json.dumps({"enable_topic": self.TOPICS}))
+
+    def decode(self, raw):
+        return decode_frame(self.robot_id, raw)
+
+    def move(self, target: dict) -> DriverRequest:
+        return DriverRequest("POST", "/chassis/moves", target)
+
+    def charge(self) -> DriverRequest:
+        return DriverRequest("POST", "/chassis/moves", {"type": "charge", "charge_retry_count": 3})
+
+    def cancel(self) -> DriverRequest:
+        return DriverRequest("PATCH", "/chassis/moves/current", {"state": "cancelled"})
+
+    def emergency_stop(self, payload: dict) -> DriverRequest:
+        return DriverRequest("POST", "/services/wheel_control/set_emergency_stop", payload)
+
+    def set_control_mode(self, mode: str) -> DriverRequest:
+        return DriverRequest("POST", "/services/wheel_control/set_control_mode", {"control_mode": mode})
+
+    def set_max_velocity(self, velocity: float) -> DriverRequest:
+        return DriverRequest("POST", "/robot-params", {"/wheel_control/max_forward_velocity": velocity})
+
+    def jack(self, service: str) -> DriverRequest:
+        if service not in ("jack_up", "jack_down"):
+            self._unsupported(service)
+        return DriverRequest("POST", "/services/" + service)
+
+
+# ============ REGISTRY ============
+
+DRIVERS: Dict[str, Type[RobotDriver]] = {}
+
+# robots.model values written before drivers existed
+MODEL_ALIASES = {"AMR": "autoxing"}
+
+DEFAULT_MODEL = "autoxing"
+
+_drivers: Dict[int, RobotDriver] = {}
+
+
+def register_driver(cls: Type[RobotDriver]) -> Type[RobotDriver]:
+    DRIVERS[cls.model] = cls
+    return cls
+
+
+register_driver(AutoXingDriver)
+
+
+def driver_class(model: str = None) -> Type[RobotDriver]:
+    model = MODEL_ALIASES.get(model, model) or DEFAULT_MODEL
+    cls = DRIVERS.get(model)
+    if cls is None:
+        log.warning("No driver for robot model %s, using %s", model, DEFAULT_MODEL, every=300.0)
+        cls = DRIVERS[DEFAULT_MODEL]
+    return cls
+
+
+def driver_for(robot: dict) -> RobotDriver:
+    """Driver for a robot row ({"id", "ip", "model"}), kept per robot id"""
+    current = _drivers.get(robot["id"])
+    cls = driver_class(robot.get("model"))
+    if current is None or type(current) is not cls or current.ip != robot["ip"]:
+        current = _drivers[robot["id"]] = cls(robot["id"], robot["ip"])
+    return current
+
+
+def driver(robot_id: int, ip: str) -> RobotDriver:
+    """Known driver for a robot, or the default model at `ip`"""
+    current = _drivers.get(robot_id)
+    if current is None:
+        current = _drivers[robot_id] = driver_class()(robot_id, ip)
+    return current
@@ -4,6 +4,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from pymongo import MongoClient
 from contextlib import asynccontextmanager
 import asyncio
+import os
 import time
 import uvicorn     
 import websockets
@@ -13,7 +14,19 @@ import robot
 import database
 from redis.asyncio import Redis
 from database import init_postgres, close_postgres
-from redis_server import init_redis, cleanup_active_sessions, shutdown_event
+import redis_server
+from redis_server import init_redis, cleanup_active_sessions, shutdown_event, ingest
+from logger import setup_logging, shutdown_logging
+from sharding import shard_status
+from reconnect import reconnects, session_writer
+from geofence import geofence
+from trajectory import trajectory_cache
+from maptiles import map_tiles
+from cloud import cloud
+from subscriptions import telemetry_hub
+from fleetfeed import fleet_feed
+from versions import response_cache
+from commands import close_executors, open_executors
 
 
 mongo_client = None
@@ -25,6 +38,7 @@ background_tasks = []
 async def lifespan(app: FastAPI):
     global mongo_client, robot_col, poi_col, background_tasks
 
+    setup_logging()
     print("SERVER STARTUP..")
     
     try:
@@ -42,12 +56,19 @@ async def lifespan(app: FastAPI):
         await init_postgres()
         print("PostgreSQL connected")
 
+        # Open command clients up front so the first fleet stop needs no handshake
+        open_executors(await database.get_all_robots())
+
         # ============ Initialize Redis ============
 
         redis_task = asyncio.create_task(init_redis(app))
         background_tasks.append(redis_task)
         print("Redis initializing")
 
+        # ============ Cloud state polling ============
+        if cloud.configured:
+            background_tasks.append(asyncio.create_task(cloud.poll_states(shutdown_event)))
+
         await asyncio.sleep(2)
         print("SERVER INITIALIZED")
 
@@ -72,6 +93,8 @@ async def lifespan(app: FastAPI):
                     except (asyncio.CancelledError, asyncio.TimeoutError):
                         pass
 
+        await close_executors()
+        await cloud.close()
         await close_postgres()
         if mongo_client:
             mongo_client.close()
@@ -80,6 +103,8 @@ async def lifespan(app: FastAPI):
         print("SERVER SHUTDOWN COMPLETE")
         print("************************")
 
+        shutdown_logging()
+
 
 app = FastAPI(lifespan=lifespan)
 app.include_router(robot.router)
@@ -96,5 +121,74 @@ app.add_middleware(
 async def main_hello():
     return "hello from main server!"
 
+@app.get('/metrics/ingest')
+async def ingest_metrics():
+    """Queue depth, drops and handler latency per ingest sink"""
+    return ingest.stats()
+
+@app.get('/metrics/reconnect')
+async def reconnect_metrics():
+    """Connection attempts in flight, per-robot backoff and session batching"""
+    return {"scheduler": reconnects.stats(), "sessions": session_writer.stats()}
+
+@app.get('/metrics/geofence')
+async def geofence_metrics():
+    """Loaded zones, tracked robots and the cost of the last point-in-zone check"""
+    return geofence.stats()
+
+
+@app.get('/metrics/trajectory')
+async def trajectory_metrics():
+    """Trajectory analytics cache size and hit rate"""
+    return trajectory_cache.stats()
+
+
+@app.get('/metrics/maptiles')
+async def maptile_metrics():
+    """Cached map pyramids, image downloads and 304 responses"""
+    return map_tiles.stats()
+
+
+@app.get('/metrics/cloud')
+async def cloud_metrics():
+    """Cloud API calls, cache hits, throttling, token validity and oversee links"""
+    return cloud.stats()
+
+
+@app.get('/metrics/subscriptions')
+async def subscription_metrics():
+    """Shared telemetry readers and what each websocket subscriber receives and is sent"""
+    return telemetry_hub.stats()
+
+
+@app.get('/metrics/fleet_feed')
+async def fleet_feed_metrics():
+    """/ws/fleet clients, document version and diff cost"""
+    return fleet_feed.stats()
+
+
+@app.get('/metrics/http_cache')
+async def http_cache_metrics():
+    """ETag 304s, cached bodies and compression of the list and analytics endpoints"""
+    return response_cache.stats()
+
+@app.get('/cluster/leader')
+async def cluster_leader():
+    """Which worker currently runs robot ingest"""
+    elector = redis_server.elector
+    if elector is None:
+        return {"status": 503, "msg": "Leader election not started"}
+
+    return {**elector.status(), "leader": await elector.current_leader()}
+
+@app.get('/cluster/shards')
+async def cluster_shards():
+    """Live ingest members, their load and which robots each one owns"""
+    robots = await database.get_all_robots()
+    return await shard_status(app.state.redis, [robot["id"] for robot in robots])
+
 if __name__ == "__main__":
-    uvicorn.run("fastapi_edge:app", host='0.0.0.0', reload=True)
\ No newline at end of file
+    # permessage-deflate is negotiated with clients that offer it (browsers do);
+    # WS_DEFLATE=false trades bandwidth for CPU on large fleets
+    uvicorn.run("fastapi_edge:app", host='0.0.0.0', reload=True,
+                ws_per_message_deflate=os.getenv("WS_DEFLATE", "true").lower() in ("1", "true", "yes"))
\ No newline at end of file
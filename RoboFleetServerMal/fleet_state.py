@@ -0,0 +1,188 @@
+# fleet_state.py
+"""
+Process-local latest state of every robot.
+
+The ingest loops write here as telemetry arrives and REST / websocket readers
+read straight from memory instead of issuing Redis GETs or waiting on pub/sub.
+All writes happen on the event loop thread and every field is replaced with a
+new immutable value, so readers never need a lock. Redis stays the
+cross-process replica: field updates are published on `fleet:state` and every
+worker applies the updates and telemetry published by the others.
+"""
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional
+
+from redis.asyncio import Redis
+
+from logger import get_logger
+from telemetry import Battery, Lidar, PlanningState, Pose, Status, codec, decode
+
+log = get_logger(__name__)
+
+REPLICA_CHANNEL = "fleet:state"
+
+# Telemetry channels published by the ingest members
+TELEMETRY_CHANNELS = ("robot:pose", "robot:status", "robot:planning")
+
+
+def robot_key(robot_id: int, name: str) -> str:
+    """Redis key of a robot's command state: current_task_id, last_poi, status, state"""
+    return f"robot:{robot_id}:{name}"
+
+
+class RobotState:
+    __slots__ = ("robot_id", "sn", "status", "state", "last_poi", "task_id",
+                 "pose", "battery", "planning", "updated_at")
+
+    def __init__(self, robot_id: int, sn: str = None):
+        self.robot_id = robot_id
+        self.sn = sn
+        self.status = "offline"
+        self.state = "unknown"
+        self.last_poi = "origin"
+        self.task_id: Optional[int] = None
+        self.pose: Optional[Pose] = None
+        self.battery: Optional[Battery] = None
+        self.planning: Optional[PlanningState] = None
+        self.updated_at = 0.0
+
+    @property
+    def battery_percent(self) -> float:
+        return self.battery.percentage * 100 if self.battery else 0
+
+    def to_dict(self) -> dict:
+        return {
+            "robot_id": self.robot_id,
+            "sn": self.sn,
+            "status": self.status,
+            "state": self.state,
+            "last_poi": self.last_poi,
+            "task_id": self.task_id,
+            "battery": self.battery_percent,
+            "pose": self.pose.to_dict() if self.pose else None,
+            "move_state": self.planning.move_state if self.planning else None,
+            "updated_at": self.updated_at
+        }
+
+
+class FleetState:
+    def __init__(self):
+        self._robots: Dict[int, RobotState] = {}
+        self._by_sn: Dict[str, RobotState] = {}
+        self._listeners: List[Callable[[int, dict], None]] = []
+
+    def on_update(self, listener: Callable[[int, dict], None]):
+        """Call listener(robot_id, fields) for every local update"""
+        self._listeners.append(listener)
+
+    def _notify(self, robot_id: int, fields: dict):
+        for listener in self._listeners:
+            listener(robot_id, fields)
+
+    def register(self, robot_id: int, sn: str = None, replicate: bool = True) -> RobotState:
+        """Get or create the record for a robot"""
+        robot = self._robots.get(robot_id)
+        if robot is None:
+            robot = self._robots[robot_id] = RobotState(robot_id)
+        if sn and robot.sn != sn:
+            robot.sn = sn
+            self._by_sn[sn] = robot
+            if replicate:
+                self._notify(robot_id, {"sn": sn})
+        return robot
+
+    def get(self, robot_id: int) -> Optional[RobotState]:
+        return self._robots.get(robot_id)
+
+    def get_by_sn(self, sn: str) -> Optional[RobotState]:
+        return self._by_sn.get(sn)
+
+    def first(self) -> Optional[RobotState]:
+        """The first robot seen, for single-robot endpoints without an id"""
+        return next(iter(self._robots.values()), None)
+
+    def robots(self):
+        return list(self._robots.values())
+
+    # ============ WRITERS ============
+
+    def apply(self, message):
+        """Store a decoded telemetry message as the latest value"""
+        if message.robot_id is None:
+            return
+
+        robot = self.register(message.robot_id)
+        if isinstance(message, Pose):
+            robot.pose = message
+        elif isinstance(message, Battery):
+            robot.battery = message
+        elif isinstance(message, PlanningState):
+            robot.planning = message
+        elif isinstance(message, Status):
+            robot.status = message.status
+        elif isinstance(message, Lidar):
+            return
+        robot.updated_at = message.ts
+
+    def update(self, robot_id: int, replicate: bool = True, **fields):
+        """Set status / state / last_poi / task_id for a robot"""
+        if robot_id is None:
+            return
+
+        robot = self.register(robot_id, fields.pop("sn", None), replicate)
+        for name, value in fields.items():
+            setattr(robot, name, value)
+        robot.updated_at = time.time()
+
+        if replicate and fields:
+            self._notify(robot_id, fields)
+
+    def snapshot(self) -> list:
+        return [robot.to_dict() for robot in self._robots.values()]
+
+
+fleet_state = FleetState()
+
+# ============ REPLICATION ============
+
+_pending_publishes = set()
+
+
+def start_replication(redis: Redis, node_id: str):
+    """Publish every local field update so other workers can apply it"""
+
+    def publish(robot_id: int, fields: dict):
+        payload = codec.dumps({"node": node_id, "robot_id": robot_id, "fields": fields})
+        task = asyncio.get_running_loop().create_task(redis.publish(REPLICA_CHANNEL, payload))
+        _pending_publishes.add(task)
+        task.add_done_callback(_pending_publishes.discard)
+
+    fleet_state.on_update(publish)
+
+
+async def follow_replica(redis: Redis, node_id: str, is_local: Callable[[int], bool], shutdown_event: asyncio.Event):
+    """Keep this worker's FleetState in sync with updates made elsewhere"""
+    pubsub = redis.pubsub()
+    await pubsub.subscribe(REPLICA_CHANNEL, *TELEMETRY_CHANNELS)
+
+    try:
+        while not shutdown_event.is_set():
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if message is None:
+                continue
+
+            try:
+                if message["channel"] == REPLICA_CHANNEL:
+                    update = codec.loads(message["data"])
+                    if update["node"] != node_id:
+                        fleet_state.update(update["robot_id"], replicate=False, **update["fields"])
+                else:
+                    # Robots monitored in this process were applied at ingest
+                    telemetry = decode(message["data"])
+                    if not is_local(telemetry.robot_id):
+                        fleet_state.apply(telemetry)
+            except (KeyError, TypeError, ValueError) as e:
+                log.warning("Bad replica message on %s: %s", message["channel"], e, every=30.0)
+    finally:
+        await pubsub.close()
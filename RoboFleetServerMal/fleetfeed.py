@@ -0,0 +1,240 @@
+# fleetfeed.py
+"""
+Fleet snapshot and patch stream for /ws/fleet.
+
+Each worker keeps one document for the whole fleet:
+
+    {"robots": {sn: {...}}, "pois": {name: {...}}}
+
+A robot entry combines the registry (name, nickname, model, ip) with the
+live FleetState: status, state, battery, task, last POI and location
+(rounded to cm). Every TICK seconds the feed rebuilds the document and diffs
+it against the previous one. The result is encoded once and the same message
+goes to every client, so N dashboards cost one diff:
+
+    {"type": "snapshot", "version": n, "data": {...}}     on connect
+    {"type": "patch", "version": n, "ops": [...]}         when something changed
+
+`ops` are JSON Patch (RFC 6902) add / remove / replace operations with JSON
+Pointer paths, e.g. /robots/2682406203417T7/battery. Clients apply patches
+in version order and reconnect for a new snapshot if they see a gap. A
+client more than CLIENT_QUEUE messages behind gets the current snapshot
+instead of the backlog.
+
+The registry and POIs are reloaded every REGISTRY_INTERVAL seconds, once per
+worker, instead of on every page poll.
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from fleet_state import RobotState, fleet_state
+from logger import get_logger
+from telemetry import codec
+
+log = get_logger(__name__)
+
+TICK = 1.0
+REGISTRY_INTERVAL = 30.0
+CLIENT_QUEUE = 50
+
+Loader = Callable[[], Awaitable[list]]
+
+
+def escape(key) -> str:
+    """JSON Pointer reference token"""
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def diff(old: dict, new: dict, path: str = "") -> List[dict]:
+    """JSON Patch operations turning `old` into `new`"""
+    ops = []
+    for key in sorted(old.keys() - new.keys(), key=str):
+        ops.append({"op": "remove", "path": f"{path}/{escape(key)}"})
+    for key, value in new.items():
+        pointer = f"{path}/{escape(key)}"
+        if key not in old:
+            ops.append({"op": "add", "path": pointer, "value": value})
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            ops.extend(diff(old[key], value, pointer))
+        elif old[key] != value:
+            ops.append({"op": "replace", "path": pointer, "value": value})
+    return ops
+
+
+def robot_view(registered: Optional[dict], robot: Optional[RobotState]) -> dict:
+    registered = registered or {}
+    view = {
+        "robot_id": registered.get("id") or (robot.robot_id if robot else None),
+        "sn": registered.get("sn") or (robot.sn if robot else None),
+        "name": registered.get("name"),
+        "nickname": registered.get("nickname"),
+        "model": registered.get("model"),
+        "ip": registered.get("ip"),
+        "status": "offline",
+        "state": "unknown",
+        "battery": 0,
+        "task_id": None,
+        "last_poi": None,
+        "move_state": None,
+        "location": None,
+        "updated_at": None
+    }
+    if robot is not None:
+        view.update(
+            status=robot.status,
+            state=robot.state,
+            battery=round(robot.battery_percent),
+            task_id=robot.task_id,
+            last_poi=robot.last_poi,
+            move_state=robot.planning.move_state if robot.planning else None,
+            location={"x": round(robot.pose.x, 2), "y": round(robot.pose.y, 2), "ori": round(robot.pose.ori, 2)}
+            if robot.pose else None,
+            updated_at=round(robot.updated_at)
+        )
+    return view
+
+
+def poi_view(poi: dict) -> dict:
+    data = poi.get("data") or {}
+    return {
+        "x": data.get("target_x"),
+        "y": data.get("target_y"),
+        "ori": data.get("target_ori")
+    }
+
+
+class FleetFeed:
+    def __init__(self, tick: float = TICK):
+        self.tick = tick
+        self.version = 0
+        self.document = {"robots": {}, "pois": {}}
+        self._snapshot: Optional[str] = None
+        self._clients: Set[asyncio.Queue] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+        self._load_robots: Optional[Loader] = None
+        self._load_pois: Optional[Loader] = None
+        self._registry: List[dict] = []
+        self._pois: List[dict] = []
+        self._loaded_at = 0.0
+
+        self.ticks = 0
+        self.patches = 0
+        self.ops = 0
+        self.resyncs = 0
+        self.diff_ms = 0.0
+
+    def configure(self, load_robots: Loader, load_pois: Loader = None):
+        """Where the registry and POIs come from"""
+        self._load_robots = load_robots
+        self._load_pois = load_pois
+
+    @asynccontextmanager
+    async def subscribe(self):
+        """Queue of encoded messages for one client, starting with a snapshot"""
+        if self.version == 0:
+            await self.refresh()
+
+        queue = asyncio.Queue(maxsize=CLIENT_QUEUE)
+        queue.put_nowait(self.snapshot())
+        self._clients.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="fleet-feed")
+        try:
+            yield queue
+        finally:
+            self._clients.discard(queue)
+
+    def snapshot(self) -> str:
+        if self._snapshot is None:
+            self._snapshot = codec.dumps({"type": "snapshot", "version": self.version, "data": self.document}).decode()
+        return self._snapshot
+
+    async def _run(self):
+        """Rebuild and broadcast while anyone is listening"""
+        while self._clients:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.refresh()
+            except Exception as e:
+                log.warning("Fleet feed refresh failed: %s", e, every=60.0)
+
+    async def _reload(self):
+        if time.monotonic() - self._loaded_at < REGISTRY_INTERVAL:
+            return
+        self._loaded_at = time.monotonic()
+        try:
+            if self._load_robots is not None:
+                self._registry = await self._load_robots()
+            if self._load_pois is not None:
+                self._pois = await self._load_pois()
+        except Exception as e:
+            # Keep the last registry; live state still flows
+            log.warning("Fleet feed registry reload failed: %s", e, every=60.0)
+
+    def build(self) -> dict:
+        robots: Dict[str, dict] = {}
+        seen = set()
+        for registered in self._registry:
+            robot = fleet_state.get(registered["id"])
+            seen.add(registered["id"])
+            robots[str(registered["sn"])] = robot_view(registered, robot)
+
+        # Robots reported by ingest but not (yet) in the registry
+        for robot in fleet_state.robots():
+            if robot.robot_id not in seen:
+                robots[str(robot.sn or robot.robot_id)] = robot_view(None, robot)
+
+        pois = {str(poi["name"]): poi_view(poi) for poi in self._pois if poi.get("name")}
+        return {"robots": robots, "pois": pois}
+
+    async def refresh(self):
+        """Rebuild the document once and send the difference to every client"""
+        async with self._lock:
+            await self._reload()
+
+            started = time.perf_counter()
+            document = self.build()
+            ops = diff(self.document, document)
+            self.diff_ms = round((time.perf_counter() - started) * 1000, 2)
+            self.ticks += 1
+
+            if not ops and self.version:
+                return
+
+            self.document = document
+            self.version += 1
+            self._snapshot = None
+            self.patches += 1
+            self.ops += len(ops)
+            self._broadcast(codec.dumps({"type": "patch", "version": self.version, "ops": ops}).decode())
+
+    def _broadcast(self, message: str):
+        for queue in self._clients:
+            if queue.full():
+                # Too far behind: replace its backlog with the current snapshot
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.snapshot())
+                self.resyncs += 1
+            else:
+                queue.put_nowait(message)
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self._clients),
+            "version": self.version,
+            "robots": len(self.document["robots"]),
+            "pois": len(self.document["pois"]),
+            "ticks": self.ticks,
+            "patches": self.patches,
+            "ops": self.ops,
+            "resyncs": self.resyncs,
+            "last_diff_ms": self.diff_ms
+        }
+
+
+fleet_feed = FleetFeed()
@@ -0,0 +1,227 @@
+# geofence.py
+"""
+Geofence and zone occupancy over the live pose stream.
+
+Zones are polygons stored in MongoDB (`robotDB.zones`). They are compiled into
+a ZoneIndex: every polygon edge lives in flat NumPy arrays and a uniform grid
+maps each cell to the edges of the zones whose bounding box overlaps it. A
+pose is tested against the edges of its cell in one vectorised ray-casting
+pass, so the cost depends on the zones near the robot, not on the total.
+
+The engine keeps the zones each robot is in and turns changes into enter /
+exit events. Occupancy is kept in Redis sets (`zone:{name}:robots`) so every
+ingest member and API worker sees the same counts.
+"""
+import asyncio
+import math
+import time
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+from pymongo import MongoClient
+from redis.asyncio import Redis
+
+from logger import get_logger
+from telemetry import codec
+
+log = get_logger(__name__)
+
+mongo_client = MongoClient("mongodb://localhost:27017/")
+zone_col = mongo_client["robotDB"]["zones"]
+
+ZONE_KINDS = ("restricted", "speed_limit", "area")
+
+# Published when zones are created or deleted so ingest members reload
+ZONES_CHANNEL = "zones:changed"
+EVENTS_CHANNEL = "robot:zone_events"
+
+GRID_CELL = 2.0
+
+
+def occupancy_key(zone: str) -> str:
+    return f"zone:{zone}:robots"
+
+
+class Zone:
+    __slots__ = ("name", "kind", "points", "speed_limit")
+
+    def __init__(self, name: str, kind: str, points: List[List[float]], speed_limit: float = None):
+        self.name = name
+        self.kind = kind
+        self.points = np.asarray(points, dtype=np.float64)
+        self.speed_limit = speed_limit
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> "Zone":
+        return cls(doc["name"], doc.get("kind", "area"), doc["points"], doc.get("speed_limit"))
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "points": self.points.tolist(),
+            "speed_limit": self.speed_limit
+        }
+
+
+def validate_zone(doc: dict) -> Optional[str]:
+    """Error message for an invalid zone document, or None"""
+    if not doc.get("name"):
+        return "Zone name is required"
+    if doc.get("kind", "area") not in ZONE_KINDS:
+        return f"Zone kind must be one of {', '.join(ZONE_KINDS)}"
+    points = doc.get("points")
+    try:
+        polygon = np.asarray(points, dtype=np.float64)
+    except (TypeError, ValueError):
+        return "Zone points must be [[x, y], ...]"
+    if polygon.ndim != 2 or polygon.shape[1] != 2 or len(polygon) < 3:
+        return "Zone needs at least 3 [x, y] points"
+    return None
+
+
+class ZoneIndex:
+    def __init__(self, zones: List[Zone], cell: float = GRID_CELL):
+        self.zones = zones
+        self.cell = cell
+
+        starts, ends, owners = [], [], []
+        bounds = np.empty((len(zones), 4))
+        for i, zone in enumerate(zones):
+            starts.append(zone.points)
+            ends.append(np.roll(zone.points, -1, axis=0))
+            owners.append(np.full(len(zone.points), i, dtype=np.int32))
+            bounds[i] = (*zone.points.min(axis=0), *zone.points.max(axis=0))
+
+        if zones:
+            start = np.concatenate(starts)
+            end = np.concatenate(ends)
+            self._owner = np.concatenate(owners)
+        else:
+            start = end = np.empty((0, 2))
+            self._owner = np.empty(0, dtype=np.int32)
+
+        self._x1, self._y1 = start[:, 0], start[:, 1]
+        self._x2, self._y2 = end[:, 0], end[:, 1]
+        # Horizontal edges never cross the ray; avoid dividing by zero for them
+        dy = self._y2 - self._y1
+        self._slope = np.divide(self._x2 - self._x1, dy, out=np.zeros_like(dy), where=dy != 0)
+        self.bounds = bounds
+
+        # cell -> (edge indexes, zone index per edge)
+        self._grid: Dict[tuple, tuple] = {}
+        cells: Dict[tuple, List[int]] = {}
+        for i, (min_x, min_y, max_x, max_y) in enumerate(bounds):
+            for cx in range(math.floor(min_x / cell), math.floor(max_x / cell) + 1):
+                for cy in range(math.floor(min_y / cell), math.floor(max_y / cell) + 1):
+                    cells.setdefault((cx, cy), []).append(i)
+
+        for key, zone_ids in cells.items():
+            edges = np.flatnonzero(np.isin(self._owner, zone_ids))
+            self._grid[key] = (edges, self._owner[edges])
+
+    def contains(self, x: float, y: float) -> np.ndarray:
+        """Indexes of the zones containing the point"""
+        entry = self._grid.get((math.floor(x / self.cell), math.floor(y / self.cell)))
+        if entry is None:
+            return np.empty(0, dtype=np.int32)
+
+        edges, owners = entry
+        y1 = self._y1[edges]
+        y2 = self._y2[edges]
+        # Even-odd rule: count edge crossings of a ray towards +x
+        crosses = ((y1 > y) != (y2 > y)) & (x < self._x1[edges] + (y - y1) * self._slope[edges])
+        counts = np.bincount(owners[crosses], minlength=len(self.zones))
+        return np.flatnonzero(counts & 1)
+
+
+class GeofenceEngine:
+    def __init__(self):
+        self.index = ZoneIndex([])
+        self._inside: Dict[int, Set[str]] = {}
+        self.checks = 0
+        self.last_check_us = 0.0
+
+    def load(self, zones: List[Zone]):
+        self.index = ZoneIndex(zones)
+        log.info("Loaded %d geofence zones", len(zones))
+
+    def check(self, robot_id: int, x: float, y: float, ts: float = None) -> List[dict]:
+        """Zone enter / exit events caused by a new robot position"""
+        started = time.perf_counter()
+        zones = self.index.zones
+        current = {zones[i].name: zones[i] for i in self.index.contains(x, y)}
+        previous = self._inside.get(robot_id, set())
+        self._inside[robot_id] = set(current)
+
+        self.checks += 1
+        self.last_check_us = (time.perf_counter() - started) * 1e6
+
+        if not current and not previous:
+            return []
+
+        ts = ts or time.time()
+        events = []
+        for name in previous - current.keys():
+            events.append({"type": "exit", "zone": name, "robot_id": robot_id, "ts": ts})
+        for name in current.keys() - previous:
+            zone = current[name]
+            events.append({"type": "enter", "zone": name, "kind": zone.kind, "speed_limit": zone.speed_limit,
+                           "robot_id": robot_id, "ts": ts})
+        return events
+
+    def forget(self, robot_id: int) -> List[dict]:
+        """Exit events for a robot that is no longer monitored here"""
+        return [{"type": "exit", "zone": name, "robot_id": robot_id, "ts": time.time()}
+                for name in self._inside.pop(robot_id, set())]
+
+    def stats(self) -> dict:
+        return {
+            "zones": len(self.index.zones),
+            "robots": len(self._inside),
+            "checks": self.checks,
+            "last_check_us": round(self.last_check_us, 1)
+        }
+
+
+geofence = GeofenceEngine()
+
+
+def load_zones() -> List[Zone]:
+    return [Zone.from_doc(doc) for doc in zone_col.find()]
+
+
+async def publish_events(redis: Redis, events: List[dict]):
+    """Apply enter / exit events to the shared occupancy sets and publish them"""
+    async with redis.pipeline(transaction=False) as pipe:
+        for event in events:
+            if event["type"] == "enter":
+                pipe.sadd(occupancy_key(event["zone"]), event["robot_id"])
+            else:
+                pipe.srem(occupancy_key(event["zone"]), event["robot_id"])
+            pipe.publish(EVENTS_CHANNEL, codec.dumps(event))
+        await pipe.execute()
+
+
+async def occupancy(redis: Redis) -> Dict[str, List[int]]:
+    """Robots currently inside each zone"""
+    names = [doc["name"] for doc in await asyncio.to_thread(lambda: list(zone_col.find({}, {"name": 1})))]
+    async with redis.pipeline(transaction=False) as pipe:
+        for name in names:
+            pipe.smembers(occupancy_key(name))
+        members = await pipe.execute()
+    return {name: sorted(int(robot_id) for robot_id in robots) for name, robots in zip(names, members)}
+
+
+async def watch_zones(redis: Redis, stop_event: asyncio.Event):
+    """Load zones now and again whenever they change"""
+    pubsub = redis.pubsub()
+    await pubsub.subscribe(ZONES_CHANNEL)
+    try:
+        geofence.load(await asyncio.to_thread(load_zones))
+        while not stop_event.is_set():
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if message is not None:
+                geofence.load(await asyncio.to_thread(load_zones))
+    finally:
+        await pubsub.close()
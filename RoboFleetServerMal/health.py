@@ -0,0 +1,178 @@
+# health.py
+"""
+Per-robot health and command circuit breaker.
+
+A command to a robot that is off wifi used to wait for the full HTTP timeout.
+Two signals now let endpoints fail fast instead:
+
+    telemetry  - the ingest loop marks a robot offline when its topic socket
+                 drops (FleetState status, replicated to every worker)
+    commands   - consecutive transport failures open the breaker; after
+                 OPEN_SECONDS a single half-open probe is let through and its
+                 outcome closes or re-opens it
+
+Only transport errors count as failures. An HTTP error status means the robot
+answered, so it is healthy as far as connectivity goes.
+"""
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+import httpx
+
+from fleet_state import fleet_state
+from logger import get_logger
+
+log = get_logger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+FAILURE_THRESHOLD = 3
+OPEN_SECONDS = 10.0
+
+# Connect fails quickly when the robot is unreachable; replies may still be slow
+COMMAND_TIMEOUT = httpx.Timeout(10.0, connect=3.0)
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int = FAILURE_THRESHOLD, open_seconds: float = OPEN_SECONDS):
+        self.threshold = threshold
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error: Optional[str] = None
+        self._probing = False
+
+    def blocked(self) -> bool:
+        """True while commands are refused; changes nothing"""
+        if self.state == CLOSED:
+            return False
+        if self.state == OPEN and time.monotonic() - self.opened_at < self.open_seconds:
+            return True
+        return self._probing
+
+    def acquire(self) -> bool:
+        """Admit a command: always while closed, then one probe at a time once OPEN_SECONDS passed"""
+        if self.blocked():
+            return False
+        if self.state != CLOSED:
+            self.state = HALF_OPEN
+            self._probing = True
+        return True
+
+    def release(self):
+        self._probing = False
+
+    def retry_after(self) -> float:
+        return max(0.0, round(self.open_seconds - (time.monotonic() - self.opened_at), 1))
+
+    def success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def failure(self, error: str):
+        self.failures += 1
+        self.last_error = error
+        self._probing = False
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def to_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "retry_after": self.retry_after() if self.state == OPEN else 0,
+            "last_error": self.last_error
+        }
+
+
+class RobotUnavailable(Exception):
+    """A command was refused by the robot's breaker; `response` is the 503 body"""
+
+    def __init__(self, response: dict):
+        super().__init__(response["msg"])
+        self.response = response
+
+
+class RobotHealth:
+    def __init__(self):
+        self._breakers: Dict[int, CircuitBreaker] = {}
+
+    def breaker(self, robot_id: int) -> CircuitBreaker:
+        breaker = self._breakers.get(robot_id)
+        if breaker is None:
+            breaker = self._breakers[robot_id] = CircuitBreaker()
+        return breaker
+
+    def connected(self, robot_id: int):
+        """Telemetry socket (re)connected: the robot is reachable again"""
+        breaker = self._breakers.get(robot_id)
+        if breaker and breaker.state != CLOSED:
+            log.info("Robot reconnected, closing circuit", robot_id=robot_id)
+            breaker.success()
+
+    def unavailable(self, robot_id: int, probe: bool = True) -> Optional[dict]:
+        """Error response if a command to this robot is known to fail, else None
+
+        A check only: the half-open probe is taken by guard(), so work done
+        between the two calls cannot leave it taken. With probe=False only the
+        telemetry status is checked, for commands such as cancel that should
+        always be attempted while the robot is online.
+        """
+        robot = fleet_state.get(robot_id)
+        if robot and robot.updated_at and robot.status == "offline":
+            return {"status": 503, "msg": "Robot is offline", "robot_id": robot_id}
+
+        if probe and self.breaker(robot_id).blocked():
+            return self._refused(robot_id)
+        return None
+
+    def _refused(self, robot_id: int) -> dict:
+        return {
+            "status": 503,
+            "msg": "Robot unreachable, not retrying yet",
+            "robot_id": robot_id,
+            "retry_after": self.breaker(robot_id).retry_after()
+        }
+
+    @asynccontextmanager
+    async def guard(self, robot_id: int, probe: bool = True):
+        """Admit a robot command through its breaker and record the outcome
+
+        Raises RobotUnavailable when the breaker refuses it. With probe=False
+        the command is sent even while the breaker is open.
+        """
+        breaker = self.breaker(robot_id)
+        if probe and not breaker.acquire():
+            raise RobotUnavailable(self._refused(robot_id))
+        try:
+            yield
+        except (httpx.TransportError, OSError) as e:
+            breaker.failure(type(e).__name__)
+            log.warning("Robot command failed: %s (%s)", type(e).__name__, breaker.state, robot_id=robot_id)
+            raise
+        except Exception:
+            # The robot answered (e.g. an HTTP error status)
+            breaker.success()
+            raise
+        else:
+            breaker.success()
+        finally:
+            if probe:
+                breaker.release()
+
+    def snapshot(self) -> dict:
+        robots = {}
+        for robot in fleet_state.robots():
+            robots[robot.robot_id] = {"status": robot.status}
+        for robot_id, breaker in self._breakers.items():
+            robots.setdefault(robot_id, {})["circuit"] = breaker.to_dict()
+        return robots
+
+
+robot_health = RobotHealth()
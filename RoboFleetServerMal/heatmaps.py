@@ -0,0 +1,156 @@
+# heatmaps.py
+"""
+Per-robot, per-day traffic heatmaps.
+
+The persistence worker already decodes every pose once (consumer group), so it
+also bins them into 2D histograms over a fixed map grid. Counts are
+accumulated in memory and periodically added into
+`{HEATMAP_DIR}/{YYYY-MM-DD}/{robot_id}.npy` (uint32). Several workers can add
+into the same file; the read-modify-write is serialised with a file lock.
+
+A request for any date range and robot set only sums the matching files, so
+it never scans robot_movement.
+"""
+import datetime
+import fcntl
+import os
+import struct
+import time
+import zlib
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from logger import get_logger
+
+log = get_logger(__name__)
+
+HEATMAP_DIR = os.getenv("HEATMAP_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "heatmaps"))
+
+# Map extent in metres (min_x, max_x, min_y, max_y) and cell size
+BOUNDS = tuple(float(v) for v in os.getenv("HEATMAP_BOUNDS", "-50,50,-50,50").split(","))
+RESOLUTION = float(os.getenv("HEATMAP_RESOLUTION", "0.5"))
+
+FLUSH_INTERVAL = 60.0
+
+X_EDGES = np.arange(BOUNDS[0], BOUNDS[1] + RESOLUTION / 2, RESOLUTION)
+Y_EDGES = np.arange(BOUNDS[2], BOUNDS[3] + RESOLUTION / 2, RESOLUTION)
+SHAPE = (len(X_EDGES) - 1, len(Y_EDGES) - 1)
+
+
+def day_of(ts: float) -> str:
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+def heatmap_path(day: str, robot_id: int) -> str:
+    return os.path.join(HEATMAP_DIR, day, f"{robot_id}.npy")
+
+
+class HeatmapAccumulator:
+    def __init__(self):
+        self._pending: Dict[Tuple[int, str], np.ndarray] = {}
+        self._last_flush = time.monotonic()
+        self.binned = 0
+        self.out_of_bounds = 0
+
+    def add(self, robot_ids: np.ndarray, xs: np.ndarray, ys: np.ndarray, ts: np.ndarray):
+        """Bin a batch of poses (parallel arrays) into the pending histograms"""
+        days = (ts // 86400).astype(np.int64)
+        pairs, inverse = np.unique(np.stack([robot_ids.astype(np.int64), days], axis=1), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+
+        for i, (robot_id, day) in enumerate(pairs):
+            mask = inverse == i
+            counts, _, _ = np.histogram2d(xs[mask], ys[mask], bins=(X_EDGES, Y_EDGES))
+            key = (int(robot_id), day_of(day * 86400))
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = np.zeros(SHAPE, dtype=np.uint32)
+            pending += counts.astype(np.uint32)
+
+            inside = int(counts.sum())
+            self.binned += inside
+            self.out_of_bounds += int(mask.sum()) - inside
+
+    def due(self) -> bool:
+        return bool(self._pending) and time.monotonic() - self._last_flush >= FLUSH_INTERVAL
+
+    def flush(self):
+        """Add pending counts into the day files (blocking, run in a thread)"""
+        pending, self._pending = self._pending, {}
+        self._last_flush = time.monotonic()
+
+        for (robot_id, day), counts in pending.items():
+            path = heatmap_path(day, robot_id)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            with open(path + ".lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if os.path.exists(path):
+                    counts = counts + np.load(path)
+                tmp = path + ".tmp"
+                with open(tmp, "wb") as f:
+                    np.save(f, counts)
+                os.replace(tmp, path)
+
+        if pending:
+            log.debug("Flushed %d heatmaps", len(pending))
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "binned": self.binned, "out_of_bounds": self.out_of_bounds}
+
+
+heatmaps = HeatmapAccumulator()
+
+
+def days_between(start: datetime.date, end: datetime.date) -> List[str]:
+    return [(start + datetime.timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+
+def load_heatmap(start: datetime.date, end: datetime.date, robot_ids: List[int] = None) -> np.ndarray:
+    """Sum of the stored histograms for a date range and robot set (blocking)"""
+    total = np.zeros(SHAPE, dtype=np.uint64)
+
+    for day in days_between(start, end):
+        folder = os.path.join(HEATMAP_DIR, day)
+        if not os.path.isdir(folder):
+            continue
+        if robot_ids:
+            names = [f"{robot_id}.npy" for robot_id in robot_ids]
+        else:
+            names = [name for name in os.listdir(folder) if name.endswith(".npy")]
+        for name in names:
+            path = os.path.join(folder, name)
+            if os.path.exists(path):
+                total += np.load(path)
+
+    return total
+
+
+# ============ PNG ============
+
+# Dark blue -> cyan -> yellow -> red, for log-scaled counts
+_STOPS = np.array([[0, 0, 0], [20, 40, 140], [0, 190, 220], [250, 230, 40], [220, 30, 30]], dtype=np.float64)
+_LUT = np.stack([np.interp(np.linspace(0, len(_STOPS) - 1, 256), np.arange(len(_STOPS)), _STOPS[:, c])
+                 for c in range(3)], axis=1).astype(np.uint8)
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+
+def to_png(counts: np.ndarray) -> bytes:
+    """Render counts as an RGB PNG, +y up, log colour scale, empty cells black"""
+    scaled = np.log1p(counts.astype(np.float64))
+    peak = scaled.max()
+    levels = (scaled / peak * 255).astype(np.uint8) if peak > 0 else np.zeros(counts.shape, dtype=np.uint8)
+
+    # Histogram rows are x; image rows run top to bottom in -y
+    rgb = _LUT[np.flipud(levels.T)]
+    height, width = rgb.shape[:2]
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8), rgb.reshape(height, -1)], axis=1)
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + _chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + _chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+            + _chunk(b"IEND", b""))
@@ -0,0 +1,57 @@
+# ingest_worker.py
+"""
+Standalone ingest process.
+
+Joins the consistent-hash shard ring (see sharding.py) and monitors its share
+of the registered robots, writing telemetry through the same pipeline as the
+API. Run as many as the fleet needs; robots move between them automatically
+when workers start or stop.
+
+    python ingest_worker.py
+
+Set INGEST_IN_API=false on the API when all ingest runs in these workers.
+"""
+import asyncio
+
+from redis.asyncio import Redis
+
+import streams
+from database import init_postgres, close_postgres
+from versions import versions
+from fleet_state import start_replication
+from leader import node_name
+from logger import get_logger, setup_logging, shutdown_logging
+from redis_server import cleanup_active_sessions, run_ingest_member, shutdown_event
+
+log = get_logger(__name__)
+
+
+async def main():
+    setup_logging()
+    await init_postgres()
+    redis = Redis(host="localhost", port=6379, decode_responses=True)
+    # Pose batches bump the movement version read by the analytics ETags
+    versions.attach(redis)
+
+    member_id = node_name()
+    # API workers follow fleet:state for status changes made here
+    start_replication(redis, member_id)
+
+    tasks = [
+        asyncio.create_task(run_ingest_member(redis, shutdown_event, member_id)),
+        asyncio.create_task(streams.persistence_worker(redis, shutdown_event))
+    ]
+
+    try:
+        # redis_server sets shutdown_event on SIGINT / SIGTERM
+        await asyncio.gather(*tasks)
+    finally:
+        await cleanup_active_sessions()
+        await redis.aclose()
+        await close_postgres()
+        log.info("Ingest worker %s stopped", member_id)
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
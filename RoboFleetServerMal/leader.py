@@ -0,0 +1,149 @@
+# leader.py
+"""
+Redis lease based leader election.
+
+Only one API worker runs the singleton background jobs (and, unless
+INGEST_IN_API is off, joins the ingest shard ring). The leader holds
+`fleet:leader` (SET NX PX) and renews it well inside the lease; on every
+election a fencing token is taken from `fleet:leader:fence` (INCR) and stored
+in `fleet:leader:token`, so singleton writes can be checked against it inside
+Redis. Telemetry writes are fenced per robot instead (see sharding.py).
+"""
+import asyncio
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, Optional
+
+from redis.asyncio import Redis
+
+from logger import get_logger
+
+log = get_logger(__name__)
+
+LEADER_KEY = "fleet:leader"
+FENCE_KEY = "fleet:leader:fence"
+TOKEN_KEY = "fleet:leader:token"
+
+# A dead leader is replaced within LEASE_MS + POLL_INTERVAL
+LEASE_MS = 5000
+RENEW_INTERVAL = LEASE_MS / 3 / 1000
+POLL_INTERVAL = 1.0
+
+# Extend the lease only if we still own it
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Delete the lease only if we still own it
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return 1
+end
+return 0
+"""
+
+# Take the lease and a new fencing token in one step
+ACQUIRE_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    local token = redis.call('INCR', KEYS[2])
+    redis.call('SET', KEYS[3], token)
+    return token
+end
+return 0
+"""
+
+
+def node_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class LeaderElector:
+    def __init__(self, redis: Redis, node_id: str = None, lease_ms: int = LEASE_MS):
+        self.redis = redis
+        self.node_id = node_id or node_name()
+        self.lease_ms = lease_ms
+        self.is_leader = False
+        self.fencing_token: Optional[int] = None
+        self._renew = redis.register_script(RENEW_SCRIPT)
+        self._release = redis.register_script(RELEASE_SCRIPT)
+        self._acquire = redis.register_script(ACQUIRE_SCRIPT)
+
+    async def try_acquire(self) -> bool:
+        token = await self._acquire(keys=[LEADER_KEY, FENCE_KEY, TOKEN_KEY], args=[self.node_id, self.lease_ms])
+        if token:
+            self.is_leader = True
+            self.fencing_token = int(token)
+        return self.is_leader
+
+    async def renew(self) -> bool:
+        renewed = await self._renew(keys=[LEADER_KEY], args=[self.node_id, self.lease_ms])
+        return bool(renewed)
+
+    async def release(self):
+        if self.is_leader:
+            await self._release(keys=[LEADER_KEY], args=[self.node_id])
+        self.is_leader = False
+        self.fencing_token = None
+
+    async def current_leader(self) -> Optional[str]:
+        return await self.redis.get(LEADER_KEY)
+
+    async def run(self,
+                  on_elected: Callable[[int], Awaitable],
+                  on_demoted: Callable[[], Awaitable],
+                  shutdown_event: asyncio.Event):
+        """Campaign for leadership until shutdown, calling the hooks on changes"""
+        log.info("Leader election started as %s", self.node_id)
+
+        try:
+            while not shutdown_event.is_set():
+                try:
+                    if not self.is_leader:
+                        if await self.try_acquire():
+                            log.info("Elected leader (fencing token %s)", self.fencing_token)
+                            await on_elected(self.fencing_token)
+                        interval = POLL_INTERVAL
+                    else:
+                        if not await self.renew():
+                            log.warning("Leader lease lost, stepping down")
+                            self.is_leader = False
+                            self.fencing_token = None
+                            await on_demoted()
+                        interval = RENEW_INTERVAL
+
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # Without Redis we cannot prove we still hold the lease
+                    log.error("Leader election error: %s", e, every=10.0)
+                    if self.is_leader:
+                        self.is_leader = False
+                        self.fencing_token = None
+                        await on_demoted()
+                    interval = POLL_INTERVAL
+
+                try:
+                    await asyncio.wait_for(shutdown_event.wait(), timeout=interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if self.is_leader:
+                await on_demoted()
+                try:
+                    await self.release()
+                except Exception as e:
+                    log.error("Could not release leader lease: %s", e)
+
+        log.info("Leader election stopped")
+
+    def status(self) -> dict:
+        return {
+            "node_id": self.node_id,
+            "is_leader": self.is_leader,
+            "fencing_token": self.fencing_token
+        }
@@ -0,0 +1,166 @@
+# logger.py
+"""
+Non-blocking structured logging for the fleet server.
+
+Records are handed to a bounded queue on the calling thread and formatted /
+written by a QueueListener on a background thread, so a slow stdout never
+stalls the event loop. Per-message call sites can be rate limited (`every=`)
+or sampled (`sample=`), and structured fields (robot_id, task_id, topic) are
+passed as keyword arguments.
+
+    log = get_logger(__name__)
+    log.info("Task %s completed", task_id, robot_id=robot_id, task_id=task_id)
+    log.debug("Pose frame", topic="/tracked_pose", every=5.0)
+"""
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from typing import Dict, Optional, Tuple
+
+FIELDS = ("robot_id", "task_id", "topic")
+
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s%(fields)s"
+
+# Records waiting for the writer thread. When full, new records are dropped
+# instead of blocking the event loop.
+QUEUE_SIZE = 10000
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional["DroppingQueueHandler"] = None
+
+# (logger name, message template) -> [last emit time, suppressed count]
+_call_sites: Dict[Tuple[str, str], list] = {}
+
+
+class FieldsFormatter(logging.Formatter):
+    """Render structured fields as trailing key=value pairs"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        pairs = [f"{name}={getattr(record, name)}" for name in FIELDS if getattr(record, name, None) is not None]
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            pairs.append(f"suppressed={suppressed}")
+        record.fields = (" [" + " ".join(pairs) + "]") if pairs else ""
+        return super().format(record)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks and defers formatting to the listener"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The listener lives in the same process, so the record can be passed
+        # through untouched and formatted on the writer thread.
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class FleetLogger(logging.LoggerAdapter):
+    """Logger adapter adding structured fields, rate limiting and sampling"""
+
+    def __init__(self, logger: logging.Logger):
+        super().__init__(logger, {})
+
+    def log(self, level, msg, *args, every: float = None, sample: float = None, **kwargs):
+        if not self.logger.isEnabledFor(level):
+            return
+
+        if sample is not None and random.random() >= sample:
+            return
+
+        extra = {}
+        for name in FIELDS:
+            if name in kwargs:
+                extra[name] = kwargs.pop(name)
+
+        if every is not None:
+            key = (self.logger.name, msg)
+            now = time.monotonic()
+            site = _call_sites.get(key)
+            if site is None:
+                site = _call_sites[key] = [0.0, 0]
+            if now - site[0] < every:
+                site[1] += 1
+                return
+            extra["suppressed"] = site[1]
+            site[0] = now
+            site[1] = 0
+
+        if extra:
+            kwargs["extra"] = extra
+        self.logger.log(level, msg, *args, **kwargs)
+
+
+def get_logger(name: str) -> FleetLogger:
+    """Get a structured logger for a module"""
+    return FleetLogger(logging.getLogger(name))
+
+
+def setup_logging(level: str = None):
+    """Route all logging through a background writer thread"""
+    global _listener, _handler
+
+    if _listener is not None:
+        return
+
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(FieldsFormatter(LOG_FORMAT))
+
+    log_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    _handler = DroppingQueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    root.setLevel(level)
+
+    _listener.start()
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+
+    if _listener is None:
+        return
+
+    _listener.stop()
+    _listener = None
+
+
+def set_level(level: str, name: str = None) -> str:
+    """Change the level of a logger (root if no name) at runtime"""
+    level = level.upper()
+    if not isinstance(logging.getLevelName(level), int):
+        raise ValueError(f"Unknown log level: {level}")
+
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    return logging.getLevelName(logger.level)
+
+
+def get_levels() -> dict:
+    """Current levels of the root logger and every configured module logger"""
+    levels = {"root": logging.getLevelName(logging.getLogger().level)}
+    for name, logger in logging.root.manager.loggerDict.items():
+        if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET:
+            levels[name] = logging.getLevelName(logger.level)
+
+    return {
+        "levels": levels,
+        "dropped": _handler.dropped if _handler else 0
+    }
@@ -0,0 +1,244 @@
+# maptiles.py
+"""
+Map image tile pyramid with an on-disk, content-addressed cache.
+
+The map PNG is downloaded from the robot once and hashed. Its tiles are
+stored under `{MAP_TILE_DIR}/{sha256}/`:
+
+    meta.json           width, height, tile size and max zoom
+    image.png           the original image
+    {z}/{x}/{y}.png     256 px tiles; z = max_zoom is full resolution and
+                        each lower level halves it, down to one tile at z = 0
+
+A given hash always has the same tiles, so the hash plus the tile
+coordinates form a strong ETag. A poll is answered with 304 from the
+in-memory map entry without touching the disk or the robot. The robot's map
+detail is re-checked every REFRESH_SECONDS, and a new image is only
+downloaded when its version changes. While the robot is unreachable the last
+built pyramid keeps being served, also across restarts.
+
+The robot address comes from the query string and ends up in a file name and
+a download URL, so only plain IPv4 addresses are accepted (valid_ip).
+"""
+import asyncio
+import hashlib
+import io
+import ipaddress
+import json
+import math
+import os
+import shutil
+import time
+from typing import Dict, Optional, Tuple
+
+import httpx
+from PIL import Image
+
+from logger import get_logger
+
+log = get_logger(__name__)
+
+MAP_TILE_DIR = os.getenv("MAP_TILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "map_tiles"))
+TILE_SIZE = 256
+REFRESH_SECONDS = 300.0
+DOWNLOAD_TIMEOUT = httpx.Timeout(30.0, connect=3.0)
+
+
+class MapTiles:
+    __slots__ = ("digest", "width", "height", "max_zoom", "version", "checked_at")
+
+    def __init__(self, digest: str, meta: dict, version: str):
+        self.digest = digest
+        self.width = meta["width"]
+        self.height = meta["height"]
+        self.max_zoom = meta["max_zoom"]
+        self.version = version
+        self.checked_at = time.monotonic()
+
+    @property
+    def folder(self) -> str:
+        return os.path.join(MAP_TILE_DIR, self.digest)
+
+    def tile_path(self, z: int, x: int, y: int) -> Optional[str]:
+        """Path of a tile, or None if the coordinates are outside the pyramid"""
+        if not 0 <= z <= self.max_zoom:
+            return None
+        scale = 2 ** (self.max_zoom - z)
+        columns = math.ceil(math.ceil(self.width / scale) / TILE_SIZE)
+        rows = math.ceil(math.ceil(self.height / scale) / TILE_SIZE)
+        if not (0 <= x < columns and 0 <= y < rows):
+            return None
+        return os.path.join(self.folder, str(z), str(x), f"{y}.png")
+
+    def etag(self, name: str) -> str:
+        return f'"{self.digest[:32]}-{name}"'
+
+    def to_dict(self) -> dict:
+        return {
+            "version": self.digest,
+            "width": self.width,
+            "height": self.height,
+            "tile_size": TILE_SIZE,
+            "min_zoom": 0,
+            "max_zoom": self.max_zoom
+        }
+
+
+def build_pyramid(digest: str, data: bytes) -> dict:
+    """Write the tiles for an image into its hash folder (blocking)"""
+    folder = os.path.join(MAP_TILE_DIR, digest)
+    meta_path = os.path.join(folder, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            return json.load(f)
+
+    started = time.perf_counter()
+    image = Image.open(io.BytesIO(data))
+    image = image.convert("LA" if image.mode in ("1", "L", "LA", "I", "I;16") else "RGBA")
+    width, height = image.size
+    max_zoom = max(0, math.ceil(math.log2(max(width, height) / TILE_SIZE)))
+
+    # Built next to the final folder and renamed into place, so readers never see half a pyramid
+    tmp = f"{folder}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    tiles = 0
+    level = image
+    for z in range(max_zoom, -1, -1):
+        columns = math.ceil(level.width / TILE_SIZE)
+        rows = math.ceil(level.height / TILE_SIZE)
+        for x in range(columns):
+            os.makedirs(os.path.join(tmp, str(z), str(x)))
+            for y in range(rows):
+                box = (x * TILE_SIZE, y * TILE_SIZE, (x + 1) * TILE_SIZE, (y + 1) * TILE_SIZE)
+                # Edge tiles are padded with transparency to a full tile
+                level.crop(box).save(os.path.join(tmp, str(z), str(x), f"{y}.png"), optimize=True)
+                tiles += 1
+        if z:
+            level = level.resize((math.ceil(level.width / 2), math.ceil(level.height / 2)), Image.LANCZOS)
+
+    with open(os.path.join(tmp, "image.png"), "wb") as f:
+        f.write(data)
+
+    meta = {"width": width, "height": height, "tile_size": TILE_SIZE, "max_zoom": max_zoom}
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    try:
+        os.replace(tmp, folder)
+    except OSError:
+        # Another worker finished the same image first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    log.info("Built %d map tiles (%dx%d, zoom 0-%d) in %.0f ms", tiles, width, height, max_zoom,
+             (time.perf_counter() - started) * 1000)
+    return meta
+
+
+def valid_ip(robot_ip: str) -> bool:
+    try:
+        return str(ipaddress.IPv4Address(robot_ip)) == robot_ip
+    except ValueError:
+        return False
+
+
+def _pointer_path(robot_ip: str, map_id: int) -> str:
+    if not valid_ip(robot_ip):
+        raise ValueError(f"Invalid robot IP: {robot_ip!r}")
+    return os.path.join(MAP_TILE_DIR, "maps", f"{robot_ip}_{map_id}.json")
+
+
+def save_pointer(robot_ip: str, map_id: int, digest: str, version: str):
+    """Remember which image a robot map resolved to, for restarts while it is offline"""
+    path = _pointer_path(robot_ip, map_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"digest": digest, "version": version}, f)
+    os.replace(path + ".tmp", path)
+
+
+def load_pointer(robot_ip: str, map_id: int) -> Optional[MapTiles]:
+    try:
+        with open(_pointer_path(robot_ip, map_id)) as f:
+            pointer = json.load(f)
+        with open(os.path.join(MAP_TILE_DIR, pointer["digest"], "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError, KeyError):
+        return None
+    return MapTiles(pointer["digest"], meta, pointer["version"])
+
+
+class MapTileCache:
+    def __init__(self):
+        self._maps: Dict[Tuple[str, int], MapTiles] = {}
+        self._locks: Dict[Tuple[str, int], asyncio.Lock] = {}
+        self.builds = 0
+        self.downloads = 0
+        self.not_modified = 0
+
+    async def get(self, robot_ip: str, map_id: int) -> MapTiles:
+        """Tiles for a robot map, downloading and building them when the map changed"""
+        if not valid_ip(robot_ip):
+            raise ValueError(f"Invalid robot IP: {robot_ip!r}")
+
+        key = (robot_ip, map_id)
+        current = self._maps.get(key)
+        if current is not None and time.monotonic() - current.checked_at < REFRESH_SECONDS:
+            return current
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            current = self._maps.get(key)
+            if current is not None and time.monotonic() - current.checked_at < REFRESH_SECONDS:
+                return current
+
+            try:
+                return await self._refresh(robot_ip, map_id, current)
+            except (httpx.HTTPError, ValueError) as e:
+                # Robot unreachable: keep serving the last tiles we built for this map
+                if current is None:
+                    current = await asyncio.to_thread(load_pointer, robot_ip, map_id)
+                    if current is None:
+                        raise
+                    self._maps[key] = current
+                log.warning("Could not refresh map %s from %s: %s", map_id, robot_ip, e)
+                current.checked_at = time.monotonic()
+                return current
+
+    async def _refresh(self, robot_ip: str, map_id: int, current: Optional[MapTiles]) -> MapTiles:
+        async with httpx.AsyncClient(base_url=f"http://{robot_ip}:8090", timeout=DOWNLOAD_TIMEOUT) as client:
+            r = await client.get(f"/maps/{map_id}")
+            r.raise_for_status()
+            detail = r.json()
+            version = str(detail.get("map_version") or detail.get("create_time") or detail.get("image_url"))
+
+            if current is not None and current.version == version:
+                current.checked_at = time.monotonic()
+                return current
+
+            image_url = detail.get("image_url") or f"/maps/{map_id}.png"
+            r = await client.get(image_url)
+            r.raise_for_status()
+            data = r.content
+            self.downloads += 1
+
+        digest = hashlib.sha256(data).hexdigest()
+        if current is None or current.digest != digest:
+            self.builds += 1
+        meta = await asyncio.to_thread(build_pyramid, digest, data)
+        await asyncio.to_thread(save_pointer, robot_ip, map_id, digest, version)
+
+        current = self._maps[(robot_ip, map_id)] = MapTiles(digest, meta, version)
+        return current
+
+    def stats(self) -> dict:
+        return {
+            "maps": {f"{ip}/{map_id}": tiles.to_dict() for (ip, map_id), tiles in self._maps.items()},
+            "downloads": self.downloads,
+            "builds": self.builds,
+            "not_modified": self.not_modified
+        }
+
+
+map_tiles = MapTileCache()
@@ -0,0 +1,71 @@
+"""
+Migration script to create the hourly utilisation rollups
+Creates robot_hourly_rollup and rebuilds it from closed sessions
+(robot_session_intervals, see migrate_sessions.py) and finished tasks
+Must run before deploying the server version that writes rollups: every
+session open/close and task status update adds into robot_hourly_rollup in
+the same statement and fails while the table is missing. The server also
+creates the (empty) table at startup, so a deploy in the wrong order keeps
+working and only misses the history until this script has run.
+Can be run again at any time to rebuild from raw history
+"""
+import asyncio
+import asyncpg
+
+from database import ROLLUP_SCHEMA, ROLLUP_SESSIONS, ROLLUP_TASKS
+
+BACKFILL_SESSIONS = '''
+    WITH closed AS (
+        SELECT robot_id, started_at, ended_at
+        FROM robot_session_intervals
+        WHERE ended_at IS NOT NULL
+    )
+''' + ROLLUP_SESSIONS
+
+BACKFILL_TASKS = '''
+    WITH tasks AS (
+        SELECT robot_id, status, start_time, end_time, distance
+        FROM tasks_history
+        WHERE status IN ('completed', 'failed', 'cancelled')
+        AND end_time IS NOT NULL
+    )
+''' + ROLLUP_TASKS
+
+async def migrate_rollups():
+    # Connect to PostgreSQL
+    pg_conn = await asyncpg.connect(
+        host='localhost',
+        port='5433',
+        user='postgres',
+        password='admin',
+        database='robotdb'
+    )
+
+    try:
+        await pg_conn.execute(ROLLUP_SCHEMA)
+        print("✓ robot_hourly_rollup table ready")
+
+        # Rebuild in one transaction; the lock keeps sessions and tasks that close
+        # meanwhile from being rolled up twice (or not at all)
+        async with pg_conn.transaction():
+            await pg_conn.execute('LOCK TABLE robot_hourly_rollup IN EXCLUSIVE MODE')
+            await pg_conn.execute('TRUNCATE robot_hourly_rollup')
+
+            await pg_conn.execute(BACKFILL_SESSIONS)
+            print("  ✓ Rolled up closed sessions")
+
+            await pg_conn.execute(BACKFILL_TASKS)
+            print("  ✓ Rolled up finished tasks")
+
+        print("\n✅ Migration completed successfully!")
+
+        rows = await pg_conn.fetchval('SELECT COUNT(*) FROM robot_hourly_rollup')
+        print(f"robot_hourly_rollup now has {rows} rows")
+
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+    finally:
+        await pg_conn.close()
+
+if __name__ == "__main__":
+    asyncio.run(migrate_rollups())
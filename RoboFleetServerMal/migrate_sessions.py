@@ -0,0 +1,102 @@
+"""
+Migration script to move robot sessions to one row per online interval
+Creates robot_session_intervals and backfills it from the paired
+online/offline rows in robot_sessions (which is left untouched)
+Safe to run more than once
+"""
+import asyncio
+import asyncpg
+
+SCHEMA = '''
+    CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+    CREATE TABLE IF NOT EXISTS robot_session_intervals (
+        id          SERIAL PRIMARY KEY,
+        robot_id    INTEGER NOT NULL REFERENCES robots(id),
+        started_at  TIMESTAMPTZ NOT NULL,
+        ended_at    TIMESTAMPTZ,
+        end_reason  TEXT,
+        period      TSTZRANGE GENERATED ALWAYS AS (tstzrange(started_at, ended_at, '[)')) STORED,
+        CHECK (ended_at IS NULL OR ended_at >= started_at)
+    );
+
+    -- One robot is never in two sessions at once. Deferred so a single statement
+    -- can close the open session and insert the next one in either order.
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'robot_session_intervals_no_overlap') THEN
+            ALTER TABLE robot_session_intervals
+                ADD CONSTRAINT robot_session_intervals_no_overlap
+                EXCLUDE USING gist (robot_id WITH =, period WITH &&)
+                DEFERRABLE INITIALLY DEFERRED;
+        END IF;
+    END $$;
+
+    -- Window overlap queries across the whole fleet
+    CREATE INDEX IF NOT EXISTS robot_session_intervals_period
+        ON robot_session_intervals USING gist (period);
+
+    CREATE INDEX IF NOT EXISTS robot_session_intervals_open
+        ON robot_session_intervals (robot_id) WHERE ended_at IS NULL;
+'''
+
+# Each online row becomes an interval ending at the robot's next event. An
+# online row followed by another online row was auto-closed when the second
+# one started; the latest online row with nothing after it is still open.
+BACKFILL = '''
+    INSERT INTO robot_session_intervals (robot_id, started_at, ended_at, end_reason)
+    SELECT robot_id, timestamp, next_timestamp,
+           CASE WHEN next_status = 'offline' THEN next_notes
+                WHEN next_status = 'online' THEN 'Auto-closed: New session started'
+           END
+    FROM (
+        SELECT robot_id, status, timestamp,
+               LEAD(status) OVER w AS next_status,
+               LEAD(timestamp) OVER w AS next_timestamp,
+               LEAD(notes) OVER w AS next_notes
+        FROM robot_sessions
+        WINDOW w AS (PARTITION BY robot_id ORDER BY timestamp, id)
+    ) events
+    WHERE status = 'online'
+'''
+
+async def migrate_sessions():
+    # Connect to PostgreSQL
+    pg_conn = await asyncpg.connect(
+        host='localhost',
+        port='5433',
+        user='postgres',
+        password='admin',
+        database='robotdb'
+    )
+
+    try:
+        async with pg_conn.transaction():
+            await pg_conn.execute(SCHEMA)
+            print("✓ robot_session_intervals table and indexes ready")
+
+            existing = await pg_conn.fetchval('SELECT COUNT(*) FROM robot_session_intervals')
+            if existing:
+                print(f"  ✓ Already has {existing} sessions, skipping backfill")
+                return
+
+            old_rows = await pg_conn.fetchval('SELECT COUNT(*) FROM robot_sessions')
+            print(f"Found {old_rows} rows in robot_sessions")
+
+            result = await pg_conn.execute(BACKFILL)
+            print(f"  ✓ Backfilled {result.split()[-1]} sessions")
+
+        print("\n✅ Migration completed successfully!")
+
+        open_sessions = await pg_conn.fetchval(
+            'SELECT COUNT(*) FROM robot_session_intervals WHERE ended_at IS NULL'
+        )
+        print(f"{open_sessions} sessions are still open")
+
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+    finally:
+        await pg_conn.close()
+
+if __name__ == "__main__":
+    asyncio.run(migrate_sessions())
@@ -0,0 +1,171 @@
+# pipeline.py
+"""
+Ingest pipeline between robot receive loops and their consumers.
+
+A receive loop only decodes a frame and offers it to each sink. Every sink owns
+a bounded queue, a drop policy and a worker task, so a slow consumer (e.g.
+PostgreSQL) can never delay pose delivery to the UI or the robot socket.
+
+    BatchSink     - bounded FIFO, drops the oldest item when full, handler gets batches
+    LatestSink    - keeps only the newest item per key, superseded items are dropped
+    ReliableSink  - never drops; a full queue makes the producer wait (backpressure)
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Hashable, List
+
+from logger import get_logger
+
+log = get_logger(__name__)
+
+
+class Sink:
+    def __init__(self, name: str, maxsize: int):
+        self.name = name
+        self.maxsize = maxsize
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.high_water = 0
+        self.last_latency = 0.0
+        self._ready = asyncio.Event()
+
+    def depth(self) -> int:
+        raise NotImplementedError
+
+    def _mark(self):
+        depth = self.depth()
+        if depth > self.high_water:
+            self.high_water = depth
+        self._ready.set()
+
+    async def _handle(self, handler, item):
+        started = time.perf_counter()
+        try:
+            await handler(item)
+        except Exception as e:
+            self.errors += 1
+            log.exception("Sink %s handler error: %s", self.name, e, every=10.0)
+        self.last_latency = time.perf_counter() - started
+
+    def stats(self) -> dict:
+        return {
+            "policy": type(self).__name__,
+            "depth": self.depth(),
+            "maxsize": self.maxsize,
+            "high_water": self.high_water,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "last_handler_ms": round(self.last_latency * 1000, 2)
+        }
+
+
+class BatchSink(Sink):
+    """Bounded FIFO drained in batches, dropping the oldest items on overflow"""
+
+    def __init__(self, name: str, handler: Callable[[List], Awaitable], maxsize: int = 10000, batch_size: int = 500):
+        super().__init__(name, maxsize)
+        self.handler = handler
+        self.batch_size = batch_size
+        self._items = deque()
+
+    def depth(self) -> int:
+        return len(self._items)
+
+    def offer(self, item):
+        if len(self._items) >= self.maxsize:
+            self._items.popleft()
+            self.dropped += 1
+        self._items.append(item)
+        self._mark()
+
+    async def run(self):
+        while True:
+            await self._ready.wait()
+            while self._items:
+                count = min(self.batch_size, len(self._items))
+                batch = [self._items.popleft() for _ in range(count)]
+                await self._handle(self.handler, batch)
+                self.processed += count
+            self._ready.clear()
+
+
+class LatestSink(Sink):
+    """Keeps only the newest item per key; older unsent items are superseded"""
+
+    def __init__(self, name: str, handler: Callable[[object], Awaitable], maxsize: int = 10000):
+        super().__init__(name, maxsize)
+        self.handler = handler
+        self._items: Dict[Hashable, object] = {}
+
+    def depth(self) -> int:
+        return len(self._items)
+
+    def offer(self, key: Hashable, item):
+        if key in self._items:
+            self.dropped += 1
+            del self._items[key]
+        elif len(self._items) >= self.maxsize:
+            self._items.pop(next(iter(self._items)))
+            self.dropped += 1
+        self._items[key] = item
+        self._mark()
+
+    async def run(self):
+        while True:
+            await self._ready.wait()
+            while self._items:
+                key = next(iter(self._items))
+                item = self._items.pop(key)
+                await self._handle(self.handler, item)
+                self.processed += 1
+            self._ready.clear()
+
+
+class ReliableSink(Sink):
+    """Never drops; producers wait when the queue is full"""
+
+    def __init__(self, name: str, handler: Callable[[object], Awaitable], maxsize: int = 1000):
+        super().__init__(name, maxsize)
+        self.handler = handler
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    async def put(self, item):
+        await self._queue.put(item)
+        self._mark()
+
+    async def run(self):
+        while True:
+            item = await self._queue.get()
+            await self._handle(self.handler, item)
+            self.processed += 1
+            self._queue.task_done()
+
+
+class IngestPipeline:
+    def __init__(self):
+        self.sinks: Dict[str, Sink] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def add(self, sink: Sink) -> Sink:
+        self.sinks[sink.name] = sink
+        return sink
+
+    def start(self) -> List[asyncio.Task]:
+        for sink in self.sinks.values():
+            self._tasks.append(asyncio.create_task(sink.run(), name=f"sink:{sink.name}"))
+        return list(self._tasks)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def stats(self) -> dict:
+        return {name: sink.stats() for name, sink in self.sinks.items()}
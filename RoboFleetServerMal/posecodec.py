@@ -0,0 +1,172 @@
+# posecodec.py
+"""
+Compact binary pose stream for browsers (`/ws/current_pose?format=delta`).
+
+Each websocket binary message is one frame covering every robot that moved
+since the previous frame. All integers are little-endian.
+
+    KEYFRAME   header  <BBdH   type=0x4B 'K', version, ts (s), count
+               entry   <Iiih   robot_id, x (mm), y (mm), ori (1e-4 rad)
+
+    DELTA      header  <BBIH   type=0x44 'D', version, ms since keyframe ts, count
+               entry   <Hhhh   robot index in the keyframe, dx, dy, dori
+
+A keyframe lists every known robot with absolute values and fixes the robot
+order that delta indices refer to. A delta entry adds to the last value the
+client holds for that robot. Robots that did not move are left out. After
+adding a dori, wrap ori back into [-31416, 31416] by ±62832. The encoder
+computes every delta against the quantised values it already sent, so
+rounding errors never accumulate on the client.
+
+A new keyframe is sent when a robot appears, when a step does not fit in an
+int16 (more than 32 m in one frame), and every KEYFRAME_INTERVAL seconds.
+Decoded values are in the same units as telemetry.Pose (m and rad), with
+1 mm / 0.1 mrad resolution.
+
+The frontend decoder is ROBOFleet_Frontend/src/services/poseCodec.ts, and
+bench_pose.py measures bytes per client against the JSON stream.
+"""
+import math
+import struct
+import time
+from typing import Dict, List, Optional
+
+from telemetry import Pose
+
+VERSION = 1
+
+KEYFRAME = 0x4B
+DELTA = 0x44
+
+KEYFRAME_HEADER = struct.Struct("<BBdH")
+KEYFRAME_ENTRY = struct.Struct("<Iiih")
+DELTA_HEADER = struct.Struct("<BBIH")
+DELTA_ENTRY = struct.Struct("<Hhhh")
+
+POS_SCALE = 1000        # 1 mm
+ORI_SCALE = 10000       # 0.1 mrad
+ORI_HALF_TURN = round(math.pi * ORI_SCALE)
+ORI_TURN = 2 * ORI_HALF_TURN
+
+INT16_MAX = 32767
+
+FRAME_INTERVAL = 0.1
+KEYFRAME_INTERVAL = 30.0
+
+
+def quantise(pose: Pose) -> tuple:
+    ori = math.remainder(pose.ori, 2 * math.pi)
+    return round(pose.x * POS_SCALE), round(pose.y * POS_SCALE), round(ori * ORI_SCALE)
+
+
+def wrap_ori(value: int) -> int:
+    if value > ORI_HALF_TURN:
+        return value - ORI_TURN
+    if value < -ORI_HALF_TURN:
+        return value + ORI_TURN
+    return value
+
+
+class PoseDeltaEncoder:
+    """Per-client encoder: feed poses with update(), send what flush() returns"""
+
+    def __init__(self, keyframe_interval: float = KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self._latest: Dict[int, tuple] = {}     # robot_id -> quantised pose not yet sent
+        self._sent: Dict[int, tuple] = {}       # robot_id -> quantised pose the client holds
+        self._order: Dict[int, int] = {}        # robot_id -> index in the last keyframe
+        self._latest_ts = 0.0
+        self._keyframe_ts: Optional[float] = None
+        self._keyframe_at = 0.0
+        self.keyframes = 0
+        self.deltas = 0
+
+    def update(self, pose: Pose):
+        self._latest[pose.robot_id] = quantise(pose)
+        self._latest_ts = max(self._latest_ts, pose.ts)
+
+    def flush(self, now: float = None) -> Optional[bytes]:
+        """The next frame, or None when no robot moved"""
+        if not self._latest:
+            return None
+
+        now = time.monotonic() if now is None else now
+        if (self._keyframe_ts is None
+                or now - self._keyframe_at >= self.keyframe_interval
+                or any(robot_id not in self._order for robot_id in self._latest)):
+            return self._keyframe(now)
+
+        entries = []
+        for robot_id, (x, y, ori) in self._latest.items():
+            sx, sy, sori = self._sent[robot_id]
+            dx, dy, dori = x - sx, y - sy, wrap_ori(ori - sori)
+            if abs(dx) > INT16_MAX or abs(dy) > INT16_MAX:
+                return self._keyframe(now)
+            if dx or dy or dori:
+                entries.append((self._order[robot_id], dx, dy, dori))
+
+        self._sent.update(self._latest)
+        self._latest.clear()
+        if not entries:
+            return None
+
+        offset = max(0, round((self._latest_ts - self._keyframe_ts) * 1000))
+        frame = bytearray(DELTA_HEADER.pack(DELTA, VERSION, offset, len(entries)))
+        for entry in entries:
+            frame += DELTA_ENTRY.pack(*entry)
+        self.deltas += 1
+        return bytes(frame)
+
+    def _keyframe(self, now: float) -> bytes:
+        self._sent.update(self._latest)
+        self._latest.clear()
+        self._order = {robot_id: index for index, robot_id in enumerate(self._sent)}
+        self._keyframe_ts = self._latest_ts
+        self._keyframe_at = now
+
+        frame = bytearray(KEYFRAME_HEADER.pack(KEYFRAME, VERSION, self._keyframe_ts, len(self._sent)))
+        for robot_id, (x, y, ori) in self._sent.items():
+            frame += KEYFRAME_ENTRY.pack(robot_id, x, y, ori)
+        self.keyframes += 1
+        return bytes(frame)
+
+
+class PoseDeltaDecoder:
+    """Reference decoder, mirroring poseCodec.ts"""
+
+    def __init__(self):
+        self._robots: List[int] = []
+        self._values: Dict[int, list] = {}
+        self._ts = 0.0
+
+    def decode(self, frame: bytes) -> List[Pose]:
+        kind = frame[0]
+        if kind == KEYFRAME:
+            _, _, self._ts, count = KEYFRAME_HEADER.unpack_from(frame)
+            self._robots = []
+            self._values = {}
+            for i in range(count):
+                robot_id, x, y, ori = KEYFRAME_ENTRY.unpack_from(frame, KEYFRAME_HEADER.size + i * KEYFRAME_ENTRY.size)
+                self._robots.append(robot_id)
+                self._values[robot_id] = [x, y, ori]
+            return [self._pose(robot_id, self._ts) for robot_id in self._robots]
+
+        if kind == DELTA:
+            _, _, offset, count = DELTA_HEADER.unpack_from(frame)
+            ts = self._ts + offset / 1000
+            poses = []
+            for i in range(count):
+                index, dx, dy, dori = DELTA_ENTRY.unpack_from(frame, DELTA_HEADER.size + i * DELTA_ENTRY.size)
+                robot_id = self._robots[index]
+                value = self._values[robot_id]
+                value[0] += dx
+                value[1] += dy
+                value[2] = wrap_ori(value[2] + dori)
+                poses.append(self._pose(robot_id, ts))
+            return poses
+
+        raise ValueError(f"Unknown pose frame type {kind:#x}")
+
+    def _pose(self, robot_id: int, ts: float) -> Pose:
+        x, y, ori = self._values[robot_id]
+        return Pose(robot_id, ts, x / POS_SCALE, y / POS_SCALE, ori / ORI_SCALE)
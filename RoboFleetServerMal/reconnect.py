@@ -0,0 +1,179 @@
+# reconnect.py
+"""
+Shared reconnection scheduling for robot links.
+
+After a site-wide wifi blip every robot link fails at once. Fixed or linear
+retry delays would make them all reconnect in lockstep, hitting the robots,
+Redis and PostgreSQL in the same instant. Instead:
+
+    Backoff             - per-robot exponential backoff with full jitter
+    ReconnectScheduler  - caps how many connection attempts run at once
+    SessionWriter       - batches session open/close writes; a link
+                          that drops and comes back within one flush window
+                          keeps its session instead of writing a close and an open
+"""
+import asyncio
+import random
+from typing import Dict, Optional, Tuple
+
+from database import end_robot_sessions, start_robot_sessions
+from logger import get_logger
+
+log = get_logger(__name__)
+
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+MAX_CONCURRENT_ATTEMPTS = 8
+SESSION_FLUSH_INTERVAL = 1.0
+
+
+class Backoff:
+    """Exponential backoff with full jitter: uniform(0, min(cap, base * 2^attempt))"""
+
+    def __init__(self, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP):
+        self.base = base
+        self.cap = cap
+        self.attempt = 0
+
+    def next_delay(self) -> float:
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** self.attempt))
+        self.attempt = min(self.attempt + 1, 32)
+        return delay
+
+    def reset(self):
+        self.attempt = 0
+
+
+class ReconnectScheduler:
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_ATTEMPTS):
+        self.max_concurrent = max_concurrent
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._backoff: Dict[int, Backoff] = {}
+        self.in_flight = 0
+        self.waiting = 0
+
+    def backoff(self, robot_id: int) -> Backoff:
+        backoff = self._backoff.get(robot_id)
+        if backoff is None:
+            backoff = self._backoff[robot_id] = Backoff()
+        return backoff
+
+    def slot(self):
+        """Context manager held for the duration of one connection attempt"""
+        return _Slot(self)
+
+    def connected(self, robot_id: int):
+        self.backoff(robot_id).reset()
+
+    async def wait_retry(self, robot_id: int, shutdown_event: asyncio.Event) -> bool:
+        """Sleep the robot's next backoff delay; False if shutdown was requested"""
+        delay = self.backoff(robot_id).next_delay()
+        log.debug("Reconnecting in %.1fs...", delay, robot_id=robot_id, every=60.0)
+        try:
+            await asyncio.wait_for(shutdown_event.wait(), timeout=delay)
+            return False
+        except asyncio.TimeoutError:
+            return True
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "backoff_attempts": {robot_id: b.attempt for robot_id, b in self._backoff.items() if b.attempt}
+        }
+
+
+class _Slot:
+    def __init__(self, scheduler: ReconnectScheduler):
+        self.scheduler = scheduler
+
+    async def __aenter__(self):
+        self.scheduler.waiting += 1
+        try:
+            await self.scheduler._slots.acquire()
+        finally:
+            self.scheduler.waiting -= 1
+        self.scheduler.in_flight += 1
+
+    async def __aexit__(self, *exc):
+        self.scheduler.in_flight -= 1
+        self.scheduler._slots.release()
+
+
+class SessionWriter:
+    def __init__(self, flush_interval: float = SESSION_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._opens: Dict[int, asyncio.Future] = {}
+        self._closes: Dict[int, Tuple[int, str]] = {}
+        self._worker: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.opened = 0
+        self.closed = 0
+        self.coalesced = 0
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run(), name="session-writer")
+
+    async def open(self, robot_id: int) -> int:
+        """Start a session, returning its id once the batch is written"""
+        pending_close = self._closes.pop(robot_id, None)
+        if pending_close is not None:
+            # Dropped and back within one window: the session never ended
+            self.coalesced += 1
+            return pending_close[0]
+
+        future = self._opens.get(robot_id)
+        if future is None:
+            future = self._opens[robot_id] = asyncio.get_running_loop().create_future()
+            self._ensure_worker()
+        return await future
+
+    def close(self, robot_id: int, session_id: int, reason: str):
+        """Queue the end of a session; written with the next batch"""
+        self._closes[robot_id] = (session_id, reason)
+        self._ensure_worker()
+
+    async def flush(self):
+        async with self._lock:
+            closes, self._closes = self._closes, {}
+            opens, self._opens = self._opens, {}
+
+            if closes:
+                try:
+                    await end_robot_sessions([(robot_id, reason) for robot_id, (_, reason) in closes.items()])
+                    self.closed += len(closes)
+                except Exception as e:
+                    log.error("Could not close %d robot sessions: %s", len(closes), e)
+
+            if opens:
+                try:
+                    session_ids = await start_robot_sessions(list(opens))
+                    self.opened += len(opens)
+                except Exception as e:
+                    for future in opens.values():
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for robot_id, future in opens.items():
+                        if not future.done():
+                            future.set_result(session_ids.get(robot_id))
+
+    async def _run(self):
+        while self._opens or self._closes:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending_opens": len(self._opens),
+            "pending_closes": len(self._closes),
+            "opened": self.opened,
+            "closed": self.closed,
+            "coalesced": self.coalesced
+        }
+
+
+reconnects = ReconnectScheduler()
+session_writer = SessionWriter()
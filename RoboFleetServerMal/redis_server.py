@@ -3,6 +3,7 @@ from pymongo import MongoClient
 from contextlib import asynccontextmanager
 from typing import List, Dict
 import asyncio
+import os
 import time
 import uvicorn
 import websockets
@@ -11,30 +12,44 @@ import httpx
 import signal
 import sys
 from redis.asyncio import Redis
-from database import record_position, get_robot_id_by_sn, update_task_status, start_robot_session, end_robot_session
+from versions import versions
+from database import get_all_robots, get_robot_id_by_sn, update_task_status, end_robot_session
+from logger import get_logger
+from telemetry import Battery, Lidar, PlanningState, Pose, Status, encode
+from drivers import RobotDriver, driver_for
+from fleet_state import fleet_state, robot_key
+import streams
+from pipeline import BatchSink, IngestPipeline, LatestSink, ReliableSink
+from leader import LeaderElector
+from fleet_state import follow_replica, start_replication
+from sharding import ShardMember, owner_key
+from health import robot_health
+from reconnect import Backoff, reconnects, session_writer
+from geofence import geofence, publish_events, watch_zones
+
+log = get_logger(__name__)
 
 #Robot IP
 IP = "192.168.0.250"
 
-#REST URL
-BASE_URL = "https://apiglobal.autoxing.com"
-
-#WEBSOCKET URL
-WS_URL = "wss://serviceglobal.autoxing.com"
-
-#DIRECT ROBOT URL
-DIRECT_URL = f"http://{IP}:8090"
-
-#DIRECT ROBOT WEBSOCKET URL
-DIRECT_WS = f"ws://{IP}:8090"
+#Robot serial number
+ROBOT_SN = "2682406203417T7"
 
 shutdown_event = asyncio.Event()
 active_sessions: Dict[int, int] = {}
-robot_monitor: Dict[int, asyncio.Task] = {}
+robot_monitor: Dict[int, List[asyncio.Task]] = {}
+ingest = IngestPipeline()
+ingest_tasks: List[asyncio.Task] = []
+elector: LeaderElector = None
+member: ShardMember = None
+
+# Whether the leader API worker also monitors a share of the robots; set to
+# false when dedicated ingest_worker.py processes do all the ingest
+INGEST_IN_API = os.getenv("INGEST_IN_API", "true").lower() in ("1", "true", "yes")
 
 def signal_handler(signum, frame):
     """Handle SIGINT (Ctrl+C) and SIGTERM"""
-    print("\n Shutdown signal received...")
+    log.info("Shutdown signal received...")
     shutdown_event.set()
 
 signal.signal(signal.SIGINT, signal_handler)
@@ -47,11 +62,11 @@ class ConnectionManager:
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
         self.active_connections.append(websocket)
-        print(f"Client connected: {len(self.active_connections)} total")
+        log.info("Client connected: %d total", len(self.active_connections))
 
     def disconnect(self, websocket: WebSocket):
         self.active_connections.remove(websocket)
-        print(f"Client disconnected: {len(self.active_connections)} remaining")
+        log.info("Client disconnected: %d remaining", len(self.active_connections))
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
         await websocket.send_text(message)
@@ -63,163 +78,237 @@ class ConnectionManager:
 ws_manager = ConnectionManager()
 
 async def init_redis(app: FastAPI):
+    global elector
+
     r = Redis(host="localhost", port=6379, decode_responses=True)
     app.state.redis = r
+    versions.attach(r)
     #ts = app.state.redis.ts()
 
-    print("REDIS SERVER INITIALIZED")
+    log.info("REDIS SERVER INITIALIZED")
+
+    # Every worker serves API traffic from its replicated FleetState and helps
+    # drain the persistence consumer group. Robots are monitored by the ingest
+    # members on the shard ring; the elected leader joins it when INGEST_IN_API.
+    elector = LeaderElector(r)
+    app.state.leader = elector
+    start_replication(r, elector.node_id)
+    asyncio.create_task(follow_replica(r, elector.node_id, lambda robot_id: robot_id in robot_monitor, shutdown_event))
+    asyncio.create_task(streams.persistence_worker(r, shutdown_event))
+
+    async def on_elected(fencing_token: int):
+        await start_ingest(r)
+
+    await elector.run(on_elected, stop_ingest, shutdown_event)
+
+async def start_ingest(redis: Redis):
+    """Join the ingest shard ring from the API leader"""
+    if INGEST_IN_API:
+        ingest_tasks.append(asyncio.create_task(run_ingest_member(redis, shutdown_event, elector.node_id)))
+
+async def stop_ingest():
+    """Leave the shard ring after losing leadership or on shutdown"""
+    for task in ingest_tasks:
+        task.cancel()
+    await asyncio.gather(*ingest_tasks, return_exceptions=True)
+    ingest_tasks.clear()
+
+# ============ SHARDED INGEST ============
+
+async def start_robot_monitor(redis: Redis, robot: dict):
+    """Start the monitor of a robot assigned to this member; one connection per robot
+    carries all of its telemetry, whatever its model"""
+    robot_id = robot["id"]
+    fleet_state.register(robot_id, robot["sn"])
+    robot_monitor[robot_id] = [
+        asyncio.create_task(pub_robot_status_manager(redis, driver_for(robot)), name=f"status:{robot_id}")
+    ]
+
+async def stop_robot_monitor(robot_id: int):
+    tasks = robot_monitor.pop(robot_id, [])
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    # The next owner re-enters the robot's zones from its first pose
+    events = geofence.forget(robot_id)
+    if events:
+        await ingest.sinks["zones"].put(events)
+
+async def run_ingest_member(redis: Redis, stop_event: asyncio.Event, member_id: str):
+    """Monitor this member's share of the fleet until stop_event or cancellation"""
+    global member
+
+    start_ingest_pipeline(redis, member_id)
+    last = {"processed": 0, "ts": time.monotonic()}
+
+    def load_stats() -> dict:
+        processed = ingest.sinks["stream"].processed
+        now = time.monotonic()
+        rate = (processed - last["processed"]) / max(now - last["ts"], 1e-6)
+        last.update(processed=processed, ts=now)
+        return {"robots": len(robot_monitor), "msgs_per_s": round(rate, 1)}
+
+    member = ShardMember(
+        redis, member_id,
+        load_robots=get_all_robots,
+        start_robot=lambda robot: start_robot_monitor(redis, robot),
+        stop_robot=stop_robot_monitor,
+        load_stats=load_stats
+    )
+
+    zones_task = asyncio.create_task(watch_zones(redis, stop_event))
+
+    try:
+        await member.run(stop_event)
+    finally:
+        member = None
+        zones_task.cancel()
+        await asyncio.gather(zones_task, return_exceptions=True)
+        await ingest.stop()
+
+# ============ INGEST PIPELINE ============
+
+def start_ingest_pipeline(redis: Redis, owner: str = None) -> List[asyncio.Task]:
+    """Create the per-sink queues that sit between robot sockets and storage"""
+
+    async def append_streams(batch):
+        rejected = await streams.append_many(redis, batch, owner=owner)
+        if rejected:
+            log.warning("Dropped %d stream entries for robots no longer owned by %s", rejected, owner, every=10.0)
+
+    async def publish_latest(item):
+        message, payload = item
+        if isinstance(message, Battery):
+            await redis.publish("robot:status", payload)
+        elif isinstance(message, Pose):
+            await redis.publish("robot:pose", payload)
+        elif isinstance(message, Status):
+            await redis.publish("robot:status", payload)
+        elif isinstance(message, Lidar):
+            await redis.publish("robot:lidar", payload)
+        elif isinstance(message, PlanningState):
+            await redis.publish("robot:planning", payload)
+
+    async def process_task_event(state):
+        await handle_planning_state(redis, state, owner=owner)
+
+    async def process_zone_events(events):
+        await publish_events(redis, events)
+
+    # Persistence path: streams are read by the PostgreSQL consumer group
+    ingest.add(BatchSink("stream", append_streams, maxsize=20000, batch_size=500))
+    # UI path: only the newest frame per robot and kind matters
+    ingest.add(LatestSink("ui", publish_latest))
+    # Task events drive tasks_history and must never be dropped
+    ingest.add(ReliableSink("task", process_task_event))
+    # Zone enter / exit events keep shared occupancy counts and must not be lost
+    ingest.add(ReliableSink("zones", process_zone_events))
+    return ingest.start()
+
+async def dispatch(message):
+    """Hand a decoded message to every sink without waiting on storage"""
+    if message is None or message.robot_id is None:
+        return
+
+    fleet_state.apply(message)
+    payload = encode(message)
+
+    ingest.sinks["stream"].offer((message, payload))
+    ingest.sinks["ui"].offer((message.robot_id, message.kind), (message, payload))
 
-    #await start_redis_status(app.state.redis)
-    asyncio.create_task(pub_robot_status_manager(app.state.redis))
-    asyncio.create_task(pub_lidar_points(app.state.redis))
-    asyncio.create_task(monitor_planning_state(app.state.redis))
+    if isinstance(message, PlanningState):
+        await ingest.sinks["task"].put(message)
+    elif isinstance(message, Pose):
+        events = geofence.check(message.robot_id, message.x, message.y, message.ts)
+        if events:
+            await ingest.sinks["zones"].put(events)
 
-async def pub_robot_status(redis: Redis, robot_id: int):
-    compile_list = {}
-    prev_pose = None
+async def pub_robot_status(redis: Redis, driver: RobotDriver):
+    robot_id = driver.robot_id
     session_id = None
     connection_lost_logged = False
 
-    url = DIRECT_WS + "/ws/v2/topics"
-
     while not shutdown_event.is_set():
         try:
-            async with websockets.connect(url, ping_interval=20, ping_timeout=10, close_timeout=10, open_timeout=10) as ws:
-                print(f"Websocket connected to {url}")
+            # Only a few robots handshake at once after a network-wide outage
+            async with reconnects.slot():
+                ws = await driver.connect()
+
+            async with ws:
+                log.info("%s telemetry connected at %s", driver.model, driver.ip, robot_id=robot_id)
+                reconnects.connected(robot_id)
                 
                 if session_id is None:
-                    session_id = await start_robot_session(robot_id)
+                    session_id = await session_writer.open(robot_id)
                     active_sessions[robot_id] = session_id
-                    await start_redis_status(redis, True)
-                    print(f"ROBOT ONLINE - Session {session_id} started (Robot ID: {robot_id})")
+                    await start_redis_status(redis, True, robot_id)
+                    log.info("ROBOT ONLINE - Session %s started", session_id, robot_id=robot_id)
+                    robot_health.connected(robot_id)
                     connection_lost_logged = False
 
-                await ws.send(json.dumps({"disable_topic":["/slam/state"]}))
-                await ws.send(json.dumps({"enable_topic":["/battery_state", "/tracked_pose", "/planning_state"]}))
+                await driver.subscribe(ws)
 
                 while not shutdown_event.is_set():
                     try:
                         msg = await asyncio.wait_for(ws.recv(), timeout=5.0)
-                        data = json.loads(msg)
-                        topic = data.get("topic")
-
-                        if topic == "/battery_state":
-                            percentage = data.get("percentage", 0)
-                            compile_list.update({"battery": msg})
-                            data_json = json.dumps(compile_list)
-                            await redis.set("robot:battery", data_json)
-                            await redis.publish("robot:status", data_json)
-
-                        elif topic == "/tracked_pose" and robot_id:
-                            pose_data = data.get("pos", [])
-                            ori_data = data.get("ori", 0)
-
-                            if len(pose_data) >= 2:
-                                x, y = float(pose_data[0]), float(pose_data[1])
-
-                                await record_position(
-                                    robot_id=robot_id,
-                                    x=x,
-                                    y=y,
-                                    ori=float(ori_data),
-                                    prev_x=prev_pose[0] if prev_pose else None,
-                                    prev_y=prev_pose[1] if prev_pose else None
-                                )
-
-                                prev_pose = (x, y)
-                                compile_list.update({"pose": msg})
-                                await redis.publish("robot:pose", json.dumps(compile_list))
-
-                        elif topic == "/planning_state":
-                            move_state = data.get("move_state")
-                            task_id_str = await redis.get(f"robot:{robot_id}:current_task")
-
-                            if move_state == "succeed" and task_id_str:
-                                task_id = int(task_id_str)
-                                await update_task_status(task_id, "completed")
-                                await redis.delete(f"robot:{robot_id}:current_task")
-                                print(f"Task {task_id} completed")
-
-                            elif move_state == "failed" and task_id_str:
-                                task_id = int(task_id_str)
-                                await update_task_status(task_id, "failed")
-                                await redis.delete(f"robot:{robot_id}:current_task")
-                                print(f"Task {task_id} failed")
+                        await dispatch(driver.decode(msg))
 
                     except asyncio.TimeoutError:
                         continue
 
-        except (websockets.exceptions.ConnectionClosed,
-                websockets.exceptions.WebSocketException,
-                OSError,
-                asyncio.TimeoutError) as e:
+        except (*driver.connection_errors, asyncio.TimeoutError) as e:
             
             if not connection_lost_logged:
-                print(f"Robot connection lost: {type(e).__name__}: {e}")
+                log.warning("Robot connection lost: %s: %s", type(e).__name__, e, robot_id=robot_id)
                 connection_lost_logged = True
 
             if session_id:
-                await end_robot_session(robot_id, f"Connection_lost: {type(e).__name__}")
-                await start_redis_status(redis, False)
-                compile_list.update({"status": 'offline'})
-                await redis.publish("robot:status", json.dumps(compile_list))
-                print(f"ROBOT OFFLINE - Session {session_id} ended")
+                # Written with the next batch, or dropped if the robot is back before then
+                session_writer.close(robot_id, session_id, f"Connection_lost: {type(e).__name__}")
+                await start_redis_status(redis, False, robot_id)
+                await dispatch(Status(robot_id, time.time(), "offline"))
+                log.info("ROBOT OFFLINE - Session %s ended", session_id, robot_id=robot_id)
                 active_sessions.pop(robot_id, None)
                 session_id = None
 
-            if not shutdown_event.is_set():
-                reconnect_delay = 5
-                print(f"Reconnecting in {reconnect_delay}s...")
-                try:
-                    await asyncio.wait_for(
-                        shutdown_event.wait(),
-                        timeout=reconnect_delay
-                    )
-                    break
-                except asyncio.TimeoutError:
-                    continue
+            if not await reconnects.wait_retry(robot_id, shutdown_event):
+                break
 
         except Exception as e:
-            print(f"Unexpected error in pub_robot_status: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception("Unexpected error in pub_robot_status: %s", e, robot_id=robot_id)
             
             if session_id:
-                await end_robot_session(robot_id, f"unexpected_error: {type(e).__name__}")
+                session_writer.close(robot_id, session_id, f"unexpected_error: {type(e).__name__}")
                 active_sessions.pop(robot_id, None)
                 session_id = None
 
-            await asyncio.sleep(5)
+            if not await reconnects.wait_retry(robot_id, shutdown_event):
+                break
 
     if session_id:
         await end_robot_session(robot_id, "server_shutdown")
-        await start_redis_status(redis, False)
+        await start_redis_status(redis, False, robot_id)
         active_sessions.pop(robot_id, None)
-        print(f"ROBOT SESSION CLOSED - Server shutdown - Session {session_id}")
-
-
-async def monitor_planning_state(redis: Redis):
-
-    url = DIRECT_WS + "/ws/v2/topics"
-
-    async with websockets.connect(url) as ws:
-        try:
-            await ws.send(json.dumps({"enable_topic":["/planning_state"]}))
-            print("Subcribed to /planning_state")
-
-            while True:
-                msg = await ws.recv()
-                data = json.loads(msg)
-
-                if data.get("topic") == "/planning_state":
-                    await handle_planning_state(redis, data)
-
-        except Exception as e:
-            print(f"Planning state monitor error: {e}")
-        finally:
-            await ws.close()
-
-async def handle_planning_state(redis: Redis, data: dict):
+        log.info("ROBOT SESSION CLOSED - Server shutdown - Session %s", session_id, robot_id=robot_id)
+
+
+# Current task of a robot, read only while the caller (ARGV[1]) holds the
+# robot's ownership lease (KEYS[1]). A final move state (ARGV[2] == '1') also
+# clears it (KEYS[2]), so exactly one member completes a task. -1 when the
+# lease belongs to another member.
+CLAIM_TASK_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return -1
+end
+local task_id = redis.call('GET', KEYS[2])
+if task_id and ARGV[2] == '1' then
+    redis.call('DEL', KEYS[2])
+end
+return task_id
+"""
+
+async def handle_planning_state(redis: Redis, state: PlanningState, owner: str = None):
     """
     Process planning state updates and update task status
     
@@ -228,61 +317,81 @@ async def handle_planning_state(redis: Redis, data: dict):
     - "succeeded": Task completed successfully
     - "failed": Task failed
     - "cancelled": Task was cancelled
+
+    With `owner`, nothing is written unless that ingest member still holds the
+    robot's ownership lease, as for the fenced stream appends.
     """
 
-    move_state = data.get("move_state")
-    action_id = data.get("action_id")
-    fail_reason = data.get("fail_reason_str", "none")
-    remaining_distance = data.get("remaining_distance", 0.0)
+    move_state = state.move_state
+    action_id = state.action_id
+    fail_reason = state.fail_reason
+    remaining_distance = state.remaining_distance
 
-    print(f" Planning_state {move_state} | Action: {action_id} | Distance:{remaining_distance}m")
+    log.debug("Planning_state %s | Action: %s | Distance: %sm", move_state, action_id, remaining_distance, topic="/planning_state", every=1.0)
 
-    #Store current planning state in Redis
-    await redis.set("robot:planning_state", json.dumps(data))
+    # The telemetry stream and robot:planning channel are written by the ingest pipeline
 
-    # Get current task ID from Redis
-    current_task_id = await redis.get("robot:current_task_id")
+    robot_id = state.robot_id
+    if robot_id is None:
+        return
+
+    # Current task of this robot, set by the command that started it and
+    # taken by the final state
+    task_key = robot_key(robot_id, "current_task_id")
+    final = move_state in ("succeeded", "failed", "cancelled")
+    if owner is not None:
+        current_task_id = await redis.eval(CLAIM_TASK_SCRIPT, 2, owner_key(robot_id), task_key, owner, int(final))
+        if current_task_id == -1:
+            log.warning("Task event ignored, robot no longer owned by %s", owner, robot_id=robot_id, every=10.0)
+            return
+    elif final:
+        current_task_id = await redis.getdel(task_key)
+    else:
+        current_task_id = await redis.get(task_key)
 
     if not current_task_id:
-        print("No active task ID found")
+        log.debug("No active task ID found", robot_id=robot_id, every=30.0)
         return
 
     current_task_id = int(current_task_id)
 
     #Update robot status based on move_state
     if move_state == "moving":
-        await redis.set("robot:status", "active")
-        await redis.set("robot:state", "moving")
-        print(f"Task {current_task_id} in progress ({remaining_distance:.2f})m remaining")
+        await redis.set(robot_key(robot_id, "status"), "active")
+        await redis.set(robot_key(robot_id, "state"), "moving")
+        fleet_state.update(robot_id, status="active", state="moving", task_id=current_task_id)
+        log.debug("Task in progress (%.2fm remaining)", remaining_distance, task_id=current_task_id, every=5.0)
         
     elif move_state == "succeeded":
-        await redis.set("robot:status", "idle")
-        await redis.set("robot:state", "idle")
+        await redis.set(robot_key(robot_id, "status"), "idle")
+        await redis.set(robot_key(robot_id, "state"), "idle")
+        fleet_state.update(robot_id, status="idle", state="idle", task_id=None)
 
         #Update task status in PostgreSQL
         await update_task_status(current_task_id, "completed")
 
-        print(f"Task {current_task_id} complete successfully")
+        log.info("Task complete successfully", robot_id=robot_id, task_id=current_task_id)
 
         # Publish completion event
         await redis.publish("robot:task_completed", json.dumps({
+            "robot_id": robot_id,
             "task_id": current_task_id,
             "status": "completed",
             "timestamp": time.time()
         }))
 
     elif move_state == "failed":
-        await redis.set("robot:status", "error")
-        await redis.set("robot:state", "failed")
+        await redis.set(robot_key(robot_id, "status"), "error")
+        await redis.set(robot_key(robot_id, "state"), "failed")
+        fleet_state.update(robot_id, status="error", state="failed", task_id=None)
 
         #Update fail task status progress in postgresql
         await update_task_status(current_task_id, "failed", fail_reason)
 
-        await redis.delete("robot:current_task_id")
-
-        print(f"Task {current_task_id} failed: {fail_reason}")
+        log.warning("Task failed: %s", fail_reason, robot_id=robot_id, task_id=current_task_id)
 
         await redis.publish("robot:task_failed", json.dumps({
+            "robot_id": robot_id,
             "task_id": current_task_id,
             "status": "failed",
             "reason": fail_reason,
@@ -290,61 +399,41 @@ async def handle_planning_state(redis: Redis, data: dict):
         }))
 
     elif move_state == "cancelled":
-        await redis.set("robot:status", "idle"),
-        await redis.set("robot:state", "cancelled")
+        await redis.set(robot_key(robot_id, "status"), "idle")
+        await redis.set(robot_key(robot_id, "state"), "cancelled")
+        fleet_state.update(robot_id, status="idle", state="cancelled", task_id=None)
 
         #Update task status in the postgresql
         await update_task_status(current_task_id, "cancelled")
 
-        #Clear current task
-        await redis.delete("robot:current_task_id")
-
-        print(f"Task {current_task_id} cancelled")
+        log.info("Task cancelled", robot_id=robot_id, task_id=current_task_id)
 
         await redis.publish("robot:task_cancelled", json.dumps({
+            "robot_id": robot_id,
             "task_id": current_task_id,
             "status": "cancelled",
             "timestamp": time.time()
         })) 
 
-async def pub_lidar_points(redis: Redis):
-    """Publishes lidar point cloud data"""
-    url = DIRECT_WS + "/ws/v2/topics"
-
-    async with websockets.connect(url) as ws:
-        try:
-            await ws.send(json.dumps({"disable_topic": ["/slam/state"]}))
-            await ws.send(json.dumps({"enable":["/scan_matched_points2"]}))
-
-            while True:
-                msg = await ws.recv()
-                await redis.publish("robot:lidar", msg)
-
-        except Exception as e:
-            print(e)
-
 async def sub_robot_status(request: Request):
     pubsub = request.app.state.redis.pubsub()
     await pubsub.subscribe("robot:pose")
-    print("Subscribed to robot:pose")
+    log.debug("Subscribed to robot:pose", topic="robot:pose")
 
     try:
         async for message in pubsub.listen():
-            print("REDIS SUB DATA: ",message)
             if message["type"] == "message":
-                data = message["data"]
-                print("Received robot pose:", data)
                 return message
     except Exception as e:
-        print("Subscriber error:", e)
+        log.error("Subscriber error: %s", e, topic="robot:pose")
     finally:
         await websockets.close()
         await pubsub.close()
-        print("Subscriber closed")
+        log.debug("Subscriber closed", topic="robot:pose")
  
 
-async def start_redis_status(redis: Redis, stat: bool):
-    print("ROBOT REDIS BOOL STATUS: ",stat)
+async def start_redis_status(redis: Redis, stat: bool, robot_id: int = None):
+    log.debug("ROBOT REDIS BOOL STATUS: %s", stat)
     if stat:
         status = {
             "status": "online",
@@ -356,51 +445,46 @@ async def start_redis_status(redis: Redis, stat: bool):
             "poi": "origin"
         }
 
-    await redis.set("robot:status", status["status"])
-    await redis.set("robot:last_poi", status["poi"])
+    if robot_id:
+        await redis.set(robot_key(robot_id, "status"), status["status"])
+        await redis.set(robot_key(robot_id, "last_poi"), status["poi"])
+        fleet_state.update(robot_id, status=status["status"], last_poi=status["poi"])
 
 
 
-async def pub_robot_status_manager (redis: Redis):
+async def pub_robot_status_manager (redis: Redis, driver: RobotDriver):
     """
     Manager that restart pub_robot_status if it crashes
     This ensures the robot always monitord
     """
-    robot_id = await get_robot_id_by_sn("2682406203417T7")
-
-    if not robot_id:
-        print("ERROR: Robot not found in database. cannot start monitor.")
-        return
-    
+    robot_id = driver.robot_id
     restart_count = 0
+    backoff = Backoff(base=5.0)
 
     while not shutdown_event.is_set():
         try:
-            print(f"Starting robot status publisher (restart #{restart_count})")
-            await pub_robot_status(redis, robot_id)
+            log.info("Starting robot status publisher (restart #%d)", restart_count, robot_id=robot_id)
+            await pub_robot_status(redis, driver)
 
             if shutdown_event.is_set():
-                print(f"Robot status publisher (restart #{restart_count})")
+                log.info("Robot status publisher stopped (restart #%d)", restart_count, robot_id=robot_id)
                 break
 
         except asyncio.CancelledError:
-            print("Robot status publisher cancelled")
+            log.info("Robot status publisher cancelled", robot_id=robot_id)
             if robot_id in active_sessions:
-                session_id = active_sessions[robot_id]
-                await end_robot_session(robot_id, "task_cancelled")
-                active_sessions.pop(robot_id, None)
-                print(f"Session {session_id} ended on cancellation")
+                session_id = active_sessions.pop(robot_id)
+                session_writer.close(robot_id, session_id, "task_cancelled")
+                log.info("Session %s ended on cancellation", session_id, robot_id=robot_id)
             break
 
         except Exception as e:
-            print(f"Robot status publisher crahsed: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception("Robot status publisher crashed: %s", e, robot_id=robot_id)
 
         if not shutdown_event.is_set():
             restart_count += 1
-            wait_time = min(5 * restart_count, 60)
-            print(f"Restarting robot monitor in {wait_time}s...")
+            wait_time = backoff.next_delay()
+            log.info("Restarting robot monitor in %.1fs...", wait_time, robot_id=robot_id)
 
             try:
                 await asyncio.wait_for(
@@ -411,24 +495,26 @@ async def pub_robot_status_manager (redis: Redis):
             except asyncio.TimeoutError:
                 continue
 
-    print("Robot status manager stopped")
+    log.info("Robot status manager stopped")
 
 async def cleanup_active_sessions():
     """End all active robot sessions during shutdown"""
+    await session_writer.flush()
+
     if not active_sessions:
-        print("No active sessions to clean up")
+        log.info("No active sessions to clean up")
         return
     
-    print(f"Cleaning up {len(active_sessions)} active sessions...")
+    log.info("Cleaning up %d active sessions...", len(active_sessions))
     for robot_id, session_id, in list(active_sessions.items()):
         try:
             await end_robot_session(robot_id, "server_shutdown")
-            print(f"Ended session {session_id} for robot {robot_id}")
+            log.info("Ended session %s", session_id, robot_id=robot_id)
         except Exception as e:
-            print(f"Error ending session {session_id}: {e}")
+            log.error("Error ending session %s: %s", session_id, e, robot_id=robot_id)
 
     active_sessions.clear()
-    print("All session cleaned up")
+    log.info("All sessions cleaned up")
 
 
 
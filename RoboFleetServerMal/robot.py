@@ -1,8 +1,11 @@
-from fastapi import FastAPI, WebSocket, APIRouter, Request, WebSocketDisconnect, Body
+from fastapi import FastAPI, WebSocket, APIRouter, Request, WebSocketDisconnect, Body, Query, Response
+from fastapi.responses import FileResponse
+from typing import Awaitable, List
 from pymongo import MongoClient
 from contextlib import asynccontextmanager
 import asyncio
 import time
+import os
 import uvicorn
 import websockets
 import json
@@ -12,11 +15,39 @@ from database import (
     create_task, 
     update_task_status, 
     get_robot_id_by_sn, 
-    get_task_history,
+    get_robot_ip,
+    get_all_robots,
+    stream_task_history,
+    stream_session_history,
+    stream_robots,
     get_total_distance,
     get_robot_stats,
     insert_robot as pg_insert_robot
 )
+from logger import get_logger, get_levels, set_level
+from telemetry import decode
+from fleet_state import fleet_state, robot_key
+import streams
+import teleop
+import geofence
+import heatmaps
+import trajectory
+from maptiles import map_tiles, valid_ip
+from cloud import cloud, CloudError, NOT_CONFIGURED as CLOUD_NOT_CONFIGURED, relay_oversee
+import datetime
+import io
+import numpy as np
+from health import robot_health, RobotUnavailable, COMMAND_TIMEOUT
+import commands
+import drivers
+import posecodec
+import subscriptions
+from subscriptions import parse_list, telemetry_hub
+from fleetfeed import fleet_feed
+from versions import versions, cached_json, cached_response, conditional_stream
+from commands import CommandPreempted
+
+log = get_logger(__name__)
 
 
 mongo_client = MongoClient("mongodb://localhost:27017/")
@@ -50,10 +81,40 @@ EDGE_URL = "http://192.168.0.142:8000"
 #Edge server websocket url
 EDGE_WS = "ws://192.168.0.142:8000"
 
+#Robot serial number
+ROBOT_SN = "2682406203417T7"
+
 # Track active tasks
 current_tasks = {}
 
 
+async def default_robot_id():
+    """Robot for the single-robot endpoints that take no robot id"""
+    robot = fleet_state.get_by_sn(ROBOT_SN)
+    return robot.robot_id if robot else await get_robot_id_by_sn(ROBOT_SN)
+
+
+def robot_driver(robot_id: int) -> drivers.RobotDriver:
+    """Driver of a robot; robots not loaded from the database yet default to IP"""
+    return drivers.driver(robot_id, IP)
+
+
+def robot_executor(robot_id: int) -> commands.CommandExecutor:
+    return commands.executor(robot_id, robot_driver(robot_id).base_url)
+
+
+async def run_command(robot_id: int, name: str, fn, key: str = None):
+    """Run fn(client) on the robot's ordered command queue"""
+    try:
+        return await robot_executor(robot_id).submit(name, fn, key)
+    except CommandPreempted as e:
+        return {"status": 409, "msg": str(e)}
+    except drivers.UnsupportedCommand as e:
+        return {"status": 501, "msg": str(e)}
+    except RobotUnavailable as e:
+        return e.response
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     mongo_client = MongoClient("mongodb://localhost:27017/")
@@ -80,7 +141,7 @@ async def websocket_hello(websocket: WebSocket):
 async def get_poi_list(poi: str):
 
     poi_data = poi_col.find_one({"name" : poi})
-    print("POI DATA DETAILS: ", poi_data)
+    log.debug("POI DATA DETAILS: %s", poi_data)
 
     if poi_data:
         poi_data["_id"] = str(poi_data["_id"])
@@ -88,70 +149,164 @@ async def get_poi_list(poi: str):
     return poi_data
 
 @router.get("/get/poi_list")
-async def get_poi_list():
-    poi_list = []
-    print("LIST POI")
+async def get_poi_list(request: Request):
+    async def build():
+        poi_list = []
+
+        poi_data = poi_col.find()
 
-    poi_data = poi_col.find()
-    print("LIST POI ", poi_data)
+        for poi in poi_data:
+                poi["_id"] = str(poi["_id"])
+                poi_list.append(poi)
 
-    for poi in poi_data:
-            poi["_id"] = str(poi["_id"])
-            poi_list.append(poi)
-            print(poi)
+        log.debug("LIST POI: %d entries", len(poi_list))
 
-            print("POI DATA: ",poi)
-            print("POI LIST: ", poi_list)
+        return poi_list
 
-    return poi_list
+    return await cached_json(request, ["pois"], build)
 
 @router.get("/set/poi")
-async def set_poi_location(name: str, request: Request):
+async def set_poi_location(name: str, robot_id: int = None):
     #url = EDGE_URL+"/edge/v1/robot/position"
-    recv_data = await get_pose(request)
-    topic_data = json.loads(recv_data)
-    print("TOPIC DATA: ", topic_data["pos"])
+    robot = fleet_state.get(robot_id) if robot_id else fleet_state.first()
+    if not robot or not robot.pose:
+        return {"status": 404, "msg": "No pose received from robot yet"}
 
-    coord = topic_data['pos']
-    ori = topic_data['ori']
+    pose = robot.pose
 
-    poi = {"name" : name, "data" : {"target_x" : coord[0], "target_y" : coord[1], "target_ori" : ori}, "time_created" : round(time.time(),1)}
+    poi = {"name" : name, "data" : {"target_x" : pose.x, "target_y" : pose.y, "target_ori" : pose.ori}, "time_created" : round(time.time(),1)}
     poi_col.insert_one(poi)
+    await versions.bump("pois")
 
     msg = f"POI named {name} successfully saved! : {poi['data']}"
 
     return msg
 
 @router.websocket("/ws/current_pose")
-async def websocket_robot_pose(websocket: WebSocket):
+async def websocket_robot_pose(websocket: WebSocket, replay: int = 20, format: str = "json",
+                               robot_ids: List[int] = Query(None), fields: str = None, rate: float = None):
     await websocket.accept()
 
     redis = websocket.app.state.redis
-    pubsub = redis.pubsub()
-    await pubsub.subscribe("robot:pose")
-    print("Subscribed to robot:pose")
 
     try:
-        async for message in pubsub.listen():
-            print("REDIS SUB DATA: ",message)
-            if message["type"] == "message":
-                data = message["data"]
-                print("Received robot pose:", data)
+        if format == "delta":
+            # Binary keyframe + quantised deltas, see posecodec.py
+            await while_connected(websocket, stream_pose_deltas(websocket, redis, robot_ids,
+                                                                rate or 1 / posecodec.FRAME_INTERVAL))
+            return
+
+        async with telemetry_hub.subscribe(redis, ["pose"], robot_ids, parse_list(fields), rate) as subscription:
+            # Replay the tail of each robot's pose stream, then follow it live
+            for data in await subscriptions.history(redis, subscription, replay):
                 await websocket.send_text(data)
+
+            async for batch in subscription.batches():
+                for data in batch:
+                    log.debug("REDIS STREAM DATA: %s", data, topic="robot:pose", every=5.0)
+                    await websocket.send_text(data)
     except WebSocketDisconnect:
-        await websocket.close()
-        await pubsub.close()
-        print("Websocket Disconnected")
+        log.debug("Websocket Disconnected", topic="robot:pose")
     except Exception as e:
-        print("Subscriber error:", e)
+        log.error("Subscriber error: %s", e, topic="robot:pose")
     finally:
-        await websocket.close()
-        await pubsub.close()
-        print("Subscriber closed")
+        try:
+            await websocket.close()
+        except RuntimeError:
+            pass
+        log.debug("Subscriber closed", topic="robot:pose")
+
+async def while_connected(websocket: WebSocket, work: Awaitable):
+    """
+    Run `work` until it returns or the client disconnects. Feeds that only send
+    would otherwise notice a client that left a quiet feed at the next failed
+    send (see cloud.relay_oversee).
+    """
+    async def until_disconnect():
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    receiver = asyncio.create_task(until_disconnect())
+    worker = asyncio.ensure_future(work)
+    try:
+        done, _ = await asyncio.wait({receiver, worker}, return_when=asyncio.FIRST_COMPLETED)
+        if worker in done:
+            return worker.result()
+    finally:
+        for task in (receiver, worker):
+            task.cancel()
+        await asyncio.gather(receiver, worker, return_exceptions=True)
+
+async def stream_pose_deltas(websocket: WebSocket, redis: Redis, robot_ids: List[int], rate: float):
+    """Send at most one posecodec frame per 1 / rate with the robots that moved"""
+    encoder = posecodec.PoseDeltaEncoder()
+
+    async with telemetry_hub.subscribe(redis, ["pose"], robot_ids, rate=rate) as subscription:
+        # Only the newest pose of each robot goes into the first keyframe
+        for data in await subscriptions.history(redis, subscription, 1):
+            encoder.update(decode(data))
+
+        async for batch in subscription.batches():
+            for data in batch:
+                encoder.update(decode(data))
+            frame = encoder.flush()
+            if frame:
+                await websocket.send_bytes(frame)
+
+@router.websocket("/ws/telemetry")
+async def websocket_telemetry(websocket: WebSocket, topics: str = "pose,battery,planning,status",
+                              robot_ids: List[int] = Query(None), fields: str = None,
+                              rate: float = None, replay: int = 1):
+    """Telemetry messages for the selected robots and topics, projected to `fields`
+    and sent at most `rate` times per second per robot and topic"""
+    await websocket.accept()
 
-@router.websocket("/ws/get/robot_status")
-async def get_robot_status(websocket: WebSocket):
     redis = websocket.app.state.redis
+
+    try:
+        async with telemetry_hub.subscribe(redis, parse_list(topics) or [], robot_ids, parse_list(fields), rate) as subscription:
+            for data in await subscriptions.history(redis, subscription, replay):
+                await websocket.send_text(data)
+
+            async for batch in subscription.batches():
+                for data in batch:
+                    await websocket.send_text(data)
+    except ValueError as e:
+        await websocket.send_json({"status": 400, "msg": str(e)})
+    except WebSocketDisconnect:
+        log.debug("Websocket Disconnected", topic="telemetry")
+    except Exception as e:
+        log.error("Subscriber error: %s", e, topic="telemetry")
+    finally:
+        try:
+            await websocket.close()
+        except RuntimeError:
+            pass
+
+@router.websocket("/ws/fleet")
+async def websocket_fleet(websocket: WebSocket):
+    """Fleet snapshot on connect, then JSON Patch deltas (see fleetfeed.py)"""
+    await websocket.accept()
+
+    try:
+        async with fleet_feed.subscribe() as queue:
+            async def send():
+                while True:
+                    await websocket.send_text(await queue.get())
+
+            await while_connected(websocket, send())
+    except WebSocketDisconnect:
+        log.debug("Websocket Disconnected", topic="fleet")
+    except Exception as e:
+        log.error("Fleet feed subscriber error: %s", e, topic="fleet")
+    finally:
+        try:
+            await websocket.close()
+        except RuntimeError:
+            pass
+
+@router.websocket("/ws/get/robot_status")
+async def get_robot_status(websocket: WebSocket, robot_id: int = None, rate: float = 1.0):
     compile_status = {}
 
     await websocket.accept()
@@ -159,42 +314,29 @@ async def get_robot_status(websocket: WebSocket):
 
     try:
         while True:
-            try:
-                # Get data from Redis
-                battery_raw_str = await redis.get("robot:battery")
-                status = await redis.get("robot:status")
-                poi = await redis.get("robot:last_poi")
-                state = await redis.get("robot:state")
-                
-                # Handle missing data gracefully
-                if not battery_raw_str:
-                    compile_status = {
-                        "status": status or "offline",
-                        "battery": 0,
-                        "last_poi": poi or "unknown",
-                        "state": state or "unknown"
-                    }
-                else:
-                    battery_raw = json.loads(battery_raw_str)
-                    battery_data = battery_raw.get("battery", "{}")
-                    battery_percent = json.loads(battery_data) if isinstance(battery_data, str) else battery_data
-                    
-                    compile_status = {
-                        "status": status or "offline",
-                        "battery": battery_percent.get("percentage", 0) * 100,
-                        "last_poi": poi or "unknown",
-                        "state": state or "unknown"
-                    }
-                
-                # Send data to client
-                await websocket.send_json(compile_status)
-                await asyncio.sleep(1)
-                
-            except json.JSONDecodeError as e:
-                print(f"JSON decode error: {e}")
-                await asyncio.sleep(1)
-                continue
-                
+            # Latest state from memory, updated by the ingest loops
+            robot = fleet_state.get(robot_id) if robot_id else fleet_state.first()
+
+            # Handle missing data gracefully
+            if not robot:
+                compile_status = {
+                    "status": "offline",
+                    "battery": 0,
+                    "last_poi": "unknown",
+                    "state": "unknown"
+                }
+            else:
+                compile_status = {
+                    "status": robot.status,
+                    "battery": robot.battery_percent,
+                    "last_poi": robot.last_poi or "unknown",
+                    "state": robot.state
+                }
+
+            # Send data to client
+            await websocket.send_json(compile_status)
+            await asyncio.sleep(1 / min(max(rate, 0.1), subscriptions.MAX_RATE))
+
     except WebSocketDisconnect:
         print("WebSocket client disconnected from robot_status")
     except Exception as e:
@@ -221,47 +363,53 @@ async def go_to_poi(name: str, request: Request):
     target_x = float(target_payload["target_x"])
     target_y = float(target_payload["target_y"])
 
-    robot_id = await get_robot_id_by_sn("2682406203417T7")
+    robot_id = await get_robot_id_by_sn(ROBOT_SN)
 
     if not robot_id:
         return{"status": 404, "msg": "Robot not in database. Register first."}
 
-    last_poi_name = await redis.get("robot:last_poi") or "origin"
+    async def command(client: httpx.AsyncClient):
+        # An unsupported command raises here, before anything is recorded
+        move = robot_driver(robot_id).move(target_payload)
 
-    last_poi_data = poi_col.find_one({"name": last_poi_name})
-    if last_poi_data:
-        start_x = float(last_poi_data["data"]["target_x"])
-        start_y = float(last_poi_data["data"]["target_y"])
+        # Do not record a task for a command that is known to fail
+        unavailable = robot_health.unavailable(robot_id)
+        if unavailable:
+            return unavailable
 
-    else:
-        start_x, start_y= 0.0, 0.0
+        last_poi_name = await redis.get(robot_key(robot_id, "last_poi")) or "origin"
 
-    task_id = await create_task(
-        robot_id=robot_id,
-        last_poi=last_poi_name,
-        target_poi=name,
-        start_x=start_x,
-        start_y=start_y,
-        target_x=target_x,
-        target_y=target_y
-    )
+        last_poi_data = poi_col.find_one({"name": last_poi_name})
+        if last_poi_data:
+            start_x = float(last_poi_data["data"]["target_x"])
+            start_y = float(last_poi_data["data"]["target_y"])
 
-    await redis.set("robot:current_task_id", task_id)
+        else:
+            start_x, start_y= 0.0, 0.0
 
-    current_tasks[robot_id] = task_id
+        task_id = await create_task(
+            robot_id=robot_id,
+            last_poi=last_poi_name,
+            target_poi=name,
+            start_x=start_x,
+            start_y=start_y,
+            target_x=target_x,
+            target_y=target_y
+        )
 
-    header = {"Content-type": "application/json"}
+        await redis.set(robot_key(robot_id, "current_task_id"), task_id)
+
+        current_tasks[robot_id] = task_id
+        fleet_state.update(robot_id, task_id=task_id)
 
-    async with httpx.AsyncClient(timeout=10.0) as client:
         try:
-            url = DIRECT_URL + "/chassis/moves"
-            r = await client.post(url, headers=header, json=target_payload)
-            r.raise_for_status()
-            data = r.json()
+            async with robot_health.guard(robot_id):
+                data = await drivers.send(client, move)
 
-            await redis.set("robot:status", "active")
-            await redis.set("robor:state", "moving")
-            await redis.set("robot:last_poi", name)
+            await redis.set(robot_key(robot_id, "status"), "active")
+            await redis.set(robot_key(robot_id, "state"), "moving")
+            await redis.set(robot_key(robot_id, "last_poi"), name)
+            fleet_state.update(robot_id, status="active", state="moving", last_poi=name)
 
             return{
                 "status": 200,
@@ -269,83 +417,83 @@ async def go_to_poi(name: str, request: Request):
                 "task_id": task_id,
                 "data": data
             }
-    
-        except httpx.ReadTimeout as e:
+
+        except RobotUnavailable as e:
+            await update_task_status(task_id, "failed", e.response["msg"])
+            await redis.delete(robot_key(robot_id, "current_task_id"))
+            fleet_state.update(robot_id, task_id=None)
+            return e.response
+        except httpx.TimeoutException as e:
             await update_task_status(task_id, "failed")
-            await redis.delete("robot:current_task_id")
+            await redis.delete(robot_key(robot_id, "current_task_id"))
+            fleet_state.update(robot_id, task_id=None)
             return {"status": 504, "msg":"Request timeout"}
         except Exception as e:
             await update_task_status(task_id, "failed")
-            await redis.delete("robot:current_task_id")
+            await redis.delete(robot_key(robot_id, "current_task_id"))
+            fleet_state.update(robot_id, task_id=None)
             return {"status": 500, "msg": str(e)}
 
-@router.get("/move/charge")
-async def move_charge(request: Request):
-    redis = request.app.state.redis
-    print("Charging Received")
-    
-    # Get robot ID from database
-    robot_id = await get_robot_id_by_sn("2682406203417T7")
-    
-    if not robot_id:
-        return {"status": 404, "msg": "Robot not in database. Register first."}
-    
-    # Get last POI name from Redis
-    last_poi_name = await redis.get("robot:last_poi") or "unknown"
+    return await run_command(robot_id, "move_poi", command)
 
-    # Look up coordinates of last POI from MongoDB
+def charge_command(redis: Redis, robot_id: int):
+    """Command that sends a robot to its charging station and records the task"""
 
-    last_poi_data = poi_col.find_one({"name": last_poi_name})
-    if last_poi_data:
-        start_x = float(last_poi_data["data"]["target_x"])
-        start_y = float(last_poi_data["data"]["target_y"])
-    else:
-        start_x, start_y = 0.0, 0.0
-  
-    origin_poi = poi_col.find_one({"name": "origin"})
+    async def command(client: httpx.AsyncClient):
+        # An unsupported command raises here, before anything is recorded
+        charge = robot_driver(robot_id).charge()
 
-    if origin_poi:
-        target_x = float(origin_poi["data"]["target_x"])
-        target_y = float(origin_poi["data"]["target_y"])
-    else:
-        target_x, target_y = 0.0, 0.0
-    
-    # Create task record for charging movement
-    task_id = await create_task(
-        robot_id=robot_id,
-        last_poi=last_poi_name,
-        target_poi="origin",  # Charging station
-        start_x=start_x,
-        start_y=start_y,
-        target_x=target_x,
-        target_y=target_y
-    )
-
-    await redis.set("robot:current_task_id", task_id)
-    
-    current_tasks[robot_id] = task_id
-    
-    header = {
-        "Content-Type": "application/json" 
-    }
-    payload = {
-        "type" : "charge",
-        "charge_retry_count" : 3
-    }
+        # Do not record a task for a command that is known to fail
+        unavailable = robot_health.unavailable(robot_id)
+        if unavailable:
+            return unavailable
+
+        # Get this robot's last POI name from Redis
+        last_poi_name = await redis.get(robot_key(robot_id, "last_poi")) or "unknown"
+
+        # Look up coordinates of last POI from MongoDB
+
+        last_poi_data = poi_col.find_one({"name": last_poi_name})
+        if last_poi_data:
+            start_x = float(last_poi_data["data"]["target_x"])
+            start_y = float(last_poi_data["data"]["target_y"])
+        else:
+            start_x, start_y = 0.0, 0.0
+
+        origin_poi = poi_col.find_one({"name": "origin"})
+
+        if origin_poi:
+            target_x = float(origin_poi["data"]["target_x"])
+            target_y = float(origin_poi["data"]["target_y"])
+        else:
+            target_x, target_y = 0.0, 0.0
+
+        # Create task record for charging movement
+        task_id = await create_task(
+            robot_id=robot_id,
+            last_poi=last_poi_name,
+            target_poi="origin",  # Charging station
+            start_x=start_x,
+            start_y=start_y,
+            target_x=target_x,
+            target_y=target_y
+        )
+
+        await redis.set(robot_key(robot_id, "current_task_id"), task_id)
+
+        current_tasks[robot_id] = task_id
+        fleet_state.update(robot_id, task_id=task_id)
 
-    async with httpx.AsyncClient(timeout=10.0) as client:
         try:
-            url = DIRECT_URL+"/chassis/moves"
-            print("URL: ",url)
-            r = await client.post(url, headers=header, json=payload)
-            r.raise_for_status()
-            data = r.json()
+            async with robot_health.guard(robot_id):
+                data = await drivers.send(client, charge)
             print("MOVE ", data)
-            
+
             # Update Redis status
-            await redis.set("robot:status", "charging")
-            await redis.set("robot:state", "moving")
-            await redis.set("robot:last_poi", "origin")
+            await redis.set(robot_key(robot_id, "status"), "charging")
+            await redis.set(robot_key(robot_id, "state"), "moving")
+            await redis.set(robot_key(robot_id, "last_poi"), "origin")
+            fleet_state.update(robot_id, status="charging", state="moving", last_poi="origin")
 
             return {
                 "status": 200,
@@ -353,15 +501,37 @@ async def move_charge(request: Request):
                 "task_id": task_id,
                 "data": data
             }
-        except httpx.ReadTimeout as e:
+        except RobotUnavailable as e:
+            await update_task_status(task_id, "failed", e.response["msg"])
+            await redis.delete(robot_key(robot_id, "current_task_id"))
+            fleet_state.update(robot_id, task_id=None)
+            return e.response
+        except httpx.TimeoutException as e:
             await update_task_status(task_id, "failed")
-            await redis.delete("robot:current_task_id")
+            await redis.delete(robot_key(robot_id, "current_task_id"))
+            fleet_state.update(robot_id, task_id=None)
             return {"status": 504, "msg": "Request timeout"}
         except Exception as e:
             await update_task_status(task_id, "failed")
-            await redis.delete("robot:current_task_id")
+            await redis.delete(robot_key(robot_id, "current_task_id"))
+            fleet_state.update(robot_id, task_id=None)
             return {"status": 500, "msg": str(e)}
 
+    return command
+
+@router.get("/move/charge")
+async def move_charge(request: Request):
+    redis = request.app.state.redis
+    print("Charging Received")
+    
+    # Get robot ID from database
+    robot_id = await get_robot_id_by_sn(ROBOT_SN)
+    
+    if not robot_id:
+        return {"status": 404, "msg": "Robot not in database. Register first."}
+
+    return await run_command(robot_id, "move_charge", charge_command(redis, robot_id))
+
 @router.get("/move")
 async def move_robot():
     print("ROBOT TEST MOVE")
@@ -387,151 +557,281 @@ async def move_robot():
 @router.get("/test/pose")
 async def get_pose(request: Request):
     pubsub = request.app.state.redis.pubsub()
-    await pubsub.subscribe("robot:status")
-    print("Subscribed to robot:pose")
+    await pubsub.subscribe("robot:pose")
+    log.debug("Subscribed to robot:pose", topic="robot:pose")
 
     try:
         async for message in pubsub.listen():
-            print("REDIS SUB DATA: ",message)
             if message["type"] == "message":
-                data = message["data"]
-                print("Received robot pose:", data)
-                return data
+                return message["data"]
     except Exception as e:
-        print("Subscriber error:", e)
+        log.error("Subscriber error: %s", e, topic="robot:pose")
     finally:
         await pubsub.close()
-        print("Subscriber closed")
+        log.debug("Subscriber closed", topic="robot:pose")
 
 @router.websocket("/ws/test/pose")
 async def sub_robot_pose(websocket: WebSocket):
     await websocket.accept()
     pubsub = websocket.app.state.redis.pubsub()
     await pubsub.subscribe("robot:state")
-    print("Subscribed to robot:state")
+    log.debug("Subscribed to robot:state", topic="robot:state")
 
     try:
         async for message in pubsub.listen():
-            print("REDIS SUB DATA: ",message)
             if message["type"] == "message":
                 data = message["data"]
                 data_json = json.loads(data)
-                print("Received robot pose:", data_json)
+                log.debug("REDIS SUB DATA: %s", data, topic="robot:state", every=5.0)
                 await websocket.send_json(data_json)
 
     except Exception as e:
-        print("Subscriber error:", e)
+        log.error("Subscriber error: %s", e, topic="robot:state")
     finally:
         await websocket.close()
         await pubsub.close()
-        print("Subscriber closed")
+        log.debug("Subscriber closed", topic="robot:state")
+
+def control_mode_command(robot_id: int, mode: str):
+    """Command that switches the wheel control mode"""
+
+    async def command(client: httpx.AsyncClient):
+        unavailable = robot_health.unavailable(robot_id)
+        if unavailable:
+            return unavailable
+
+        async with robot_health.guard(robot_id):
+            data = await drivers.send(client, robot_driver(robot_id).set_control_mode(mode))
+        print("SET CONTROL MODE: ", data)
+
+        return data
+
+    return command
 
 @router.get("/set/control_mode")
 async def set_control_mode(mode: str):
-    header = {
-        "Content-Type": "application/json" 
-    }
-    payload = {
-        "control_mode" : mode
-    }
     print("CONTROL MODE STRING: ", mode)
 
-    async with httpx.AsyncClient() as client:
-            url = DIRECT_URL+"/services/wheel_control/set_control_mode"
-            print(url)
-            r = await client.post(url, headers=header, json=payload)
-            r.raise_for_status()
-            data = r.json()
-            print("SET CONTROL MODE: ", data)
+    robot_id = await default_robot_id()
 
-            return data
+    # Only the latest pending mode change matters
+    return await run_command(robot_id, "set_control_mode", control_mode_command(robot_id, mode), key="control_mode")
 
 @router.get("/set/velocity")
 async def set_velocity(vel: str):
-    header = {
-        "Content-Type": "application/json" 
-    }
-    payload = {
-        "/wheel_control/max_forward_velocity": float(vel)
-    }
+    velocity = float(vel)
     print("MAX VELOCITY ", vel)
 
-    async with httpx.AsyncClient() as client:
-            url = DIRECT_URL+"/robot-params"
-            print(url)
-            r = await client.post(url, headers=header, json=payload)
-            r.raise_for_status()
-            data = r.json()
-            print("SET CONTROL MODE: ", data)
+    robot_id = await default_robot_id()
 
-            return data
+    async def command(client: httpx.AsyncClient):
+        unavailable = robot_health.unavailable(robot_id)
+        if unavailable:
+            return unavailable
 
-@router.get("/move/cancel")
-async def cancel_move(request: Request):
-    """Cancel Current Movement"""
-    redis = request.app.state.redis
-    header = {"Content-Type":"application/json"}
-    payload = {"state":"cancelled"}
+        async with robot_health.guard(robot_id):
+            data = await drivers.send(client, robot_driver(robot_id).set_max_velocity(velocity))
+        print("SET CONTROL MODE: ", data)
 
-    current_task_id = await redis.get("robot:current_task_id")
+        return data
 
-    async with httpx.AsyncClient() as client:
+    # Repeated slider updates collapse into the newest value
+    return await run_command(robot_id, "set_velocity", command, key="velocity")
+
+def cancel_command(redis: Redis, robot_id: int):
+    """Command that cancels the current move and closes its task"""
+
+    async def command(client: httpx.AsyncClient):
         try:
-            url = DIRECT_URL + "/chassis/moves/current"
-            r = await client.patch(url, headers=header, json=payload)
-            r.raise_for_status()
-            data = r.json()
+            async with robot_health.guard(robot_id, probe=False):
+                data = await drivers.send(client, robot_driver(robot_id).cancel())
 
+            current_task_id = await redis.get(robot_key(robot_id, "current_task_id"))
             if current_task_id:
                 await update_task_status(int(current_task_id), "cancelled")
-                await redis.delete("robot:current_task_id")
+                await redis.delete(robot_key(robot_id, "current_task_id"))
 
-            await redis.set("robot:status", "idle")
-            await redis.set("robot:state", "cancelled")
+            await redis.set(robot_key(robot_id, "status"), "idle")
+            await redis.set(robot_key(robot_id, "state"), "cancelled")
+
+            fleet_state.update(robot_id, status="idle", state="cancelled", task_id=None)
 
             return data
-        except httpx.ReadTimeout as e:
+        except httpx.TimeoutException as e:
             print("Error: ", e)
             return {"status": 504, "msg": "Request timeout"}
+        except drivers.UnsupportedCommand as e:
+            return {"status": 501, "msg": str(e)}
 
-#For Autoxing with jack
-@router.get("/jack/up")
-async def jack_up():
-    header = {
-        "Content-Type" : "application/json"
-    }
+    return command
 
-    async with httpx.AsyncClient() as client:
+@router.get("/move/cancel")
+async def cancel_move(request: Request):
+    """Cancel Current Movement"""
+    redis = request.app.state.redis
+
+    # Cancel is always attempted while the robot is online, even if the breaker is open
+    robot_id = await default_robot_id()
+    unavailable = robot_health.unavailable(robot_id, probe=False)
+    if unavailable:
+        return unavailable
+
+    # Pre-empts queued moves and never waits behind a running one
+    return await robot_executor(robot_id).priority("cancel", cancel_command(redis, robot_id))
+
+def emergency_stop_command(robot_id: int, payload: dict):
+    """Command that engages or releases the wheel emergency stop"""
+
+    async def command(client: httpx.AsyncClient):
         try:
-            url = DIRECT_URL+"/services/jack_up"
-            r = await client.post(url, headers=header)
-            r.raise_for_status()
-            data = r.json()
+            async with robot_health.guard(robot_id, probe=False):
+                return await drivers.send(client, robot_driver(robot_id).emergency_stop(payload))
+        except drivers.UnsupportedCommand as e:
+            return {"status": 501, "msg": str(e)}
+        except httpx.HTTPError as e:
+            log.error("Emergency stop failed: %s", e, robot_id=robot_id)
+            return {"status": 502, "msg": f"Emergency stop failed: {e}"}
 
-            return data
-        except httpx.ReadTimeout as e:
-            print("Error: ",e)
-            return e
+    return command
+
+@router.post("/set/emergency_stop")
+async def set_emergency_stop(payload: dict = Body(...)):
+    """Engage or release the wheel emergency stop ({"enable": true|false})"""
+    robot_id = await default_robot_id()
+
+    # Engaging the stop drops every queued command; releasing it does not
+    return await robot_executor(robot_id).priority("emergency_stop", emergency_stop_command(robot_id, payload), preempt=bool(payload.get("enable", True)))
+
+#For Autoxing with jack
+@router.get("/jack/up")
+async def jack_up():
+    return await jack("jack_up")
 
  #For Autoxing with jack       
 
 @router.get("/jack/down")
 async def jack_down():
-    header = {
-        "Content-Type" : "application/json"
-    }
+    return await jack("jack_down")
+
+async def jack(service: str):
+    robot_id = await default_robot_id()
+
+    async def command(client: httpx.AsyncClient):
+        unavailable = robot_health.unavailable(robot_id)
+        if unavailable:
+            return unavailable
 
-    async with httpx.AsyncClient() as client:
         try:
-            url = DIRECT_URL+"/services/jack_down"
-            r = await client.post(url, headers=header)
-            r.raise_for_status()
-            data = r.json()
+            async with robot_health.guard(robot_id):
+                data = await drivers.send(client, robot_driver(robot_id).jack(service))
 
             return data
-        except httpx.ReadTimeout as e:
+        except httpx.TimeoutException as e:
             print("Error: ",e)
-            return e
+            return {"status": 504, "msg": "Request timeout"}
+
+    return await run_command(robot_id, service, command)
+
+@router.get("/get/command_queues")
+async def get_command_queues():
+    """Pending commands and priority lane latency per robot"""
+    return commands.executor_stats()
+
+#------- ZONES (MongoDB) ----------
+
+@router.post("/zones")
+async def create_zone(request: Request, payload: dict = Body(...)):
+    """Create or replace a zone: {"name", "kind", "points": [[x, y], ...], "speed_limit"}"""
+    error = geofence.validate_zone(payload)
+    if error:
+        return {"status": 400, "msg": error}
+
+    zone = geofence.Zone.from_doc(payload)
+    geofence.zone_col.replace_one({"name": zone.name}, zone.to_dict(), upsert=True)
+    await request.app.state.redis.publish(geofence.ZONES_CHANNEL, zone.name)
+
+    return {"status": 200, "msg": f"Zone {zone.name} saved", "zone": zone.to_dict()}
+
+@router.get("/get/zones")
+async def get_zones():
+    zones = []
+    for zone in geofence.zone_col.find():
+        zone["_id"] = str(zone["_id"])
+        zones.append(zone)
+    return zones
+
+@router.get("/delete/zone")
+async def delete_zone(name: str, request: Request):
+    if not geofence.zone_col.find_one({"name": name}):
+        return {"status": 404, "msg": "Zone Don't Exist"}
+
+    geofence.zone_col.delete_one({"name": name})
+    await request.app.state.redis.delete(geofence.occupancy_key(name))
+    await request.app.state.redis.publish(geofence.ZONES_CHANNEL, name)
+    return {"status": 200, "msg": "Successfully Delete"}
+
+@router.get("/get/zone_occupancy")
+async def get_zone_occupancy(request: Request):
+    """Robots currently inside each zone"""
+    occupancy = await geofence.occupancy(request.app.state.redis)
+    return {name: {"count": len(robots), "robots": robots} for name, robots in occupancy.items()}
+
+@router.websocket("/ws/zone_events")
+async def zone_events(websocket: WebSocket):
+    await websocket.accept()
+    pubsub = websocket.app.state.redis.pubsub()
+    await pubsub.subscribe(geofence.EVENTS_CHANNEL)
+
+    try:
+        async for message in pubsub.listen():
+            if message["type"] == "message":
+                await websocket.send_text(message["data"])
+    except WebSocketDisconnect:
+        log.debug("Zone events client disconnected", topic=geofence.EVENTS_CHANNEL)
+    except Exception as e:
+        log.error("Zone events error: %s", e, topic=geofence.EVENTS_CHANNEL)
+    finally:
+        await pubsub.close()
+
+#------- FLEET COMMANDS ----------
+
+async def select_robots(robot_ids: List[int] = None, status: str = None) -> List[dict]:
+    """Registered robots, optionally limited to some ids or a FleetState status"""
+    robots = await get_all_robots()
+    if robot_ids:
+        robots = [robot for robot in robots if robot["id"] in robot_ids]
+    if status:
+        states = {robot.robot_id: robot.status for robot in fleet_state.robots()}
+        robots = [robot for robot in robots if states.get(robot["id"]) == status]
+    return robots
+
+@router.post("/fleet/emergency_stop")
+async def fleet_emergency_stop(payload: dict = Body(...), robot_ids: List[int] = Query(None), status: str = None):
+    """Engage (or release) the emergency stop on every selected robot at once"""
+    robots = await select_robots(robot_ids, status)
+    return await commands.broadcast(robots, "emergency_stop",
+                                    lambda robot_id: emergency_stop_command(robot_id, payload),
+                                    priority=True, preempt=bool(payload.get("enable", True)))
+
+@router.get("/fleet/cancel")
+async def fleet_cancel(request: Request, robot_ids: List[int] = Query(None), status: str = None):
+    robots = await select_robots(robot_ids, status)
+    return await commands.broadcast(robots, "cancel",
+                                    lambda robot_id: cancel_command(request.app.state.redis, robot_id), priority=True)
+
+@router.get("/fleet/charge")
+async def fleet_charge(request: Request, robot_ids: List[int] = Query(None), status: str = None, concurrency: int = None):
+    robots = await select_robots(robot_ids, status)
+    return await commands.broadcast(robots, "move_charge",
+                                    lambda robot_id: charge_command(request.app.state.redis, robot_id),
+                                    concurrency=concurrency)
+
+@router.get("/fleet/control_mode")
+async def fleet_control_mode(mode: str, robot_ids: List[int] = Query(None), status: str = None, concurrency: int = None):
+    robots = await select_robots(robot_ids, status)
+    return await commands.broadcast(robots, "set_control_mode",
+                                    lambda robot_id: control_mode_command(robot_id, mode),
+                                    key="control_mode", concurrency=concurrency)
 
 #------- ROBOT REGISTRATION ----------
 
@@ -567,6 +867,7 @@ async def robot_register(payload: dict = Body(...)):
             }
         }
         mongo_result = robot_col.insert_one(mongo_data)
+        await versions.bump("robots")
         print(f" Robot inserted into MongoDB with _id: {mongo_result.inserted_id}")
 
         return {
@@ -580,68 +881,38 @@ async def robot_register(payload: dict = Body(...)):
     except Exception as e:
         print(f" Registration error: {str(e)}")
         robot_col.delete_one({"nickname": nickname})
+        await versions.bump("robots")
         return {"status": 500, "msg": f"Registration failed: {str(e)}"}
 
 @router.get("/get/robot_list")
-async def robot_register():
-    robot_list = []
-    print("LIST ROBOT")
+async def robot_register(request: Request):
+    async def build():
+        robot_list = []
 
-    robot_data = robot_col.find()
-    print("LIST ROBOT ", robot_data)
+        robot_data = robot_col.find()
 
-    for robot in robot_data:
-        robot["_id"] = str(robot["_id"])
-        robot_list.append(robot)
-        print(robot)
+        for robot in robot_data:
+            robot["_id"] = str(robot["_id"])
+            robot_list.append(robot)
 
-        print("ROBOT DATA: ",robot)
-    print("ROBOT LIST: ", robot_list)
+        log.debug("LIST ROBOT: %d entries", len(robot_list))
 
-    return robot_list
+        return robot_list
+
+    return await cached_json(request, ["robots"], build)
 
 @router.get("/delete/robot_name")
 async def delete_robot(name: str):
     print("delete selected")
     if robot_col.find_one({"nickname" : name}):
         robot_col.delete_one({"nickname": name})
+        await versions.bump("robots")
         return({"status": 200, "msg" : "Successfully Delete"})
     else:
         return({"status": 404, "msg" : "Robot Don't Exist"})
 
 #------------- DIRECT CONTROL ------------------
 
-@router.get("/test/command_control")
-async def control_loop(lin: float, ang: float):
-    print("RECEIVED")
-    uri = DIRECT_WS+"/ws/v2/topics"
-    print("URL: ",uri)
-    try:
-        async with websockets.connect(uri) as ws:
-            # Subscribe to twist feedback
-            await ws.send(json.dumps({"disable_topic": ["/slam/state"]}))
-            await ws.send(json.dumps({"enable_topic": ["/tracked_pose","/battery_state"]}))
-            
-            # Switch to remote mode (if required)
-            # await ws.send(... set_control_mode ...)
-
-            while True:
-                # Receive feedback before next command
-                feedback = await ws.recv()
-                data = json.loads(feedback)
-                print(data)
-
-                # Prepare next command
-                twist_cmd = {
-                    "topic": "/twist",
-                    "linear_velocity": lin,
-                    "angular_velocity": ang
-                }
-                await ws.send(json.dumps(twist_cmd))
-                await asyncio.sleep(0.1)  # 10Hz update rate
-    except Exception as e:
-        await ws.close()
-        
 @router.get("/test/direct_control")
 async def control_loop():
     uri = DIRECT_WS+"/ws/v2/topics"
@@ -658,7 +929,7 @@ async def control_loop():
             # Receive feedback before next command
             feedback = await ws.recv()
             data = json.loads(feedback)
-            print(data)
+            log.debug("Control feedback: %s", data.get("topic"), topic="/twist", every=5.0)
 
             # Prepare next command
             twist_cmd = {
@@ -669,33 +940,97 @@ async def control_loop():
             await ws.send(json.dumps(twist_cmd))
             await asyncio.sleep(0.1)  # 10Hz update rate
 
+@router.websocket("/ws/teleop")
+async def teleop_session(websocket: WebSocket, robot_id: int = None, rate: float = teleop.DEFAULT_RATE_HZ, deadman_ms: int = teleop.DEFAULT_DEADMAN_MS):
+    """
+    Operator joystick channel
+
+    Client sends {"linear": .., "angular": .., "seq": ..} as often as it likes;
+    only the newest value is forwarded at `rate` Hz. {"type": "ping", "t": ..}
+    is answered with a pong carrying the robot control round trip and stats.
+    When the robot link is lost for good, {"type": "error", "msg": ..} is sent
+    and the socket closed.
+    """
+    await websocket.accept()
+
+    ip = (await get_robot_ip(robot_id) if robot_id else None) or IP
+
+    try:
+        link = await teleop.acquire_link(ip)
+    except Exception as e:
+        log.warning("Teleop link failed: %s", e, robot_id=robot_id)
+        await websocket.send_json({"type": "error", "msg": f"Robot unreachable: {e}"})
+        await websocket.close()
+        return
+
+    session = teleop.TeleopSession(link, rate, deadman_ms)
+    log.info("Teleop session started at %.0f Hz", 1 / session.interval, robot_id=robot_id)
+
+    async def receive():
+        while True:
+            data = await websocket.receive_json()
+
+            if data.get("type") == "ping":
+                await websocket.send_json({"type": "pong", "t": data.get("t"), **session.stats()})
+            else:
+                session.update(float(data.get("linear", 0)), float(data.get("angular", 0)), data.get("seq"))
+
+    sender = asyncio.create_task(session.run())
+    receiver = asyncio.create_task(receive())
+    try:
+        # Whichever ends first ends the session: a dead sender must not leave the operator steering nothing
+        done, _ = await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+        if receiver in done:
+            receiver.result()
+        else:
+            error = session.error or f"Teleop sender stopped: {sender.exception()}"
+            await websocket.send_json({"type": "error", "msg": error})
+            await websocket.close()
+
+    except WebSocketDisconnect:
+        log.debug("Teleop client disconnected", robot_id=robot_id)
+    except Exception as e:
+        log.error("Teleop session error: %s", e, robot_id=robot_id)
+    finally:
+        for task in (sender, receiver):
+            task.cancel()
+        await asyncio.gather(sender, receiver, return_exceptions=True)
+        await session.close()
+        await teleop.release_link(link)
+        log.info("Teleop session closed: %s", session.stats(), robot_id=robot_id)
+
+@router.get("/get/teleop_links")
+async def get_teleop_links():
+    return teleop.link_stats()
+
 @router.websocket("/ws/get/lidar")
-async def get_lidar_points(websocket: WebSocket):
+async def get_lidar_points(websocket: WebSocket, replay: int = 1, robot_ids: List[int] = Query(None), rate: float = None):
     await websocket.accept()
-    pubsub = websocket.app.state.redis.pubsub()
-    await pubsub.subscribe("robot:lidar")
+    redis = websocket.app.state.redis
     print("Subscribed to robot:lidar")
 
     try:
-        async for message in pubsub.listen():
-            #print("REDIS SUB DATA: ",message)
-            if message["type"] == "message":
-                data = json.loads(message["data"])
-                #print("Received robot pose:", data)
-                await map.realtime_lidar(data["points"])
-                #map.realtime_lidar(data["points"])
-                await websocket.send_json(data["points"])
+        async with telemetry_hub.subscribe(redis, ["lidar"], robot_ids, rate=rate) as subscription:
+            for data in await subscriptions.history(redis, subscription, replay):
+                await websocket.send_json(decode(data).points)
+
+            async for batch in subscription.batches():
+                for data in batch:
+                    await websocket.send_json(decode(data).points)
 
     except Exception as e:
         print("Subscriber error:", e)
-        await map.close_plot()
     finally:
-        await pubsub.close()
         await websocket.close()
         print("Subscriber closed")
 
 #---------------- FUNCTIONS --------------------
 
+async def load_pois() -> list:
+    return await asyncio.to_thread(lambda: list(poi_col.find({}, {"_id": 0})))
+
+fleet_feed.configure(load_robots=get_all_robots, load_pois=load_pois)
+
 async def stream_robot_pose(redis: Redis):
     url = DIRECT_WS+"/ws/v2/topics"
     async with websockets.connect(url) as ws:
@@ -718,17 +1053,227 @@ async def stream_robot_pose(redis: Redis):
         finally:
             ws.close()
 
+#---------------- CLOUD --------------------
+
+@router.get("/cloud/robots")
+async def api_get_cloud_robots():
+    """Cloud robots with their latest state from the batched poll"""
+    if not cloud.configured:
+        return CLOUD_NOT_CONFIGURED
+    try:
+        robots = list(cloud.states.values()) if cloud.polled_at else await cloud.robot_list()
+    except (httpx.HTTPError, CloudError) as e:
+        return {"status": 502, "msg": f"Cloud API error: {e}"}
+    return {"polled_at": cloud.polled_at, "robots": robots}
+
+@router.get("/cloud/robot_state")
+async def api_get_cloud_robot_state(robot_id: str):
+    if not cloud.configured:
+        return CLOUD_NOT_CONFIGURED
+    try:
+        return await cloud.robot_state(robot_id)
+    except (httpx.HTTPError, CloudError) as e:
+        return {"status": 502, "msg": f"Cloud API error: {e}"}
+
+@router.websocket("/ws/cloud/oversee")
+async def ws_cloud_oversee(websocket: WebSocket, robot_id: str):
+    """Oversee messages for a cloud robot over one shared upstream socket"""
+    await websocket.accept()
+    if not cloud.configured:
+        await websocket.send_json(CLOUD_NOT_CONFIGURED)
+        await websocket.close()
+        return
+    try:
+        async with cloud.oversee.subscribe(robot_id) as messages:
+            await relay_oversee(websocket, messages)
+    except WebSocketDisconnect:
+        pass
+
+#---------------- MAPS --------------------
+
+# Tile URLs carrying the current version never change, anything else is revalidated
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+@router.get("/fielder/maps")
+async def api_get_fielder_maps(robot_ip: str = IP):
+    """Maps stored on the robot"""
+    if not valid_ip(robot_ip):
+        return {"status": 400, "msg": f"Invalid robot_ip: {robot_ip}"}
+
+    async with httpx.AsyncClient(timeout=COMMAND_TIMEOUT) as client:
+        try:
+            r = await client.get(f"http://{robot_ip}:8090/maps/")
+            r.raise_for_status()
+            return r.json()
+        except httpx.HTTPError as e:
+            return {"status": 502, "msg": f"Could not list maps: {e}"}
+
+# Robot unreachable, a map response that is not JSON (ValueError) or an image
+# Pillow cannot read (UnidentifiedImageError is an OSError)
+MAP_ERRORS = (httpx.HTTPError, ValueError, OSError)
+
+async def map_file(request: Request, robot_ip: str, map_id: int, name: str, tile: tuple = None, v: str = None):
+    """Serve a file of the map's pyramid with a strong ETag, or 304 if the client has it"""
+    if not valid_ip(robot_ip):
+        return {"status": 400, "msg": f"Invalid robot_ip: {robot_ip}"}
+
+    try:
+        tiles = await map_tiles.get(robot_ip, map_id)
+    except MAP_ERRORS as e:
+        return {"status": 502, "msg": f"Could not load map {map_id}: {e}"}
+
+    path = tiles.tile_path(*tile) if tile else os.path.join(tiles.folder, name)
+    if path is None:
+        return Response(status_code=404)
+
+    etag = tiles.etag(name)
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE if v == tiles.digest else REVALIDATE}
+    if etag in request.headers.get("if-none-match", ""):
+        map_tiles.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="image/png", headers=headers)
+
+@router.get("/fielder/maps/{map_id}/image")
+async def api_get_fielder_map_image(map_id: int, request: Request, robot_ip: str = IP):
+    """Full map image, cached on disk and revalidated with its ETag"""
+    return await map_file(request, robot_ip, map_id, "image.png")
+
+@router.get("/fielder/maps/{map_id}/tiles")
+async def api_get_fielder_map_tiles(map_id: int, robot_ip: str = IP):
+    """Pyramid size and zoom levels, with a versioned tile URL template"""
+    if not valid_ip(robot_ip):
+        return {"status": 400, "msg": f"Invalid robot_ip: {robot_ip}"}
+
+    try:
+        tiles = await map_tiles.get(robot_ip, map_id)
+    except MAP_ERRORS as e:
+        return {"status": 502, "msg": f"Could not load map {map_id}: {e}"}
+    return {
+        **tiles.to_dict(),
+        "tile_url": f"{router.prefix}/fielder/maps/{map_id}/tiles/{{z}}/{{x}}/{{y}}.png"
+                    f"?robot_ip={robot_ip}&v={tiles.digest}"
+    }
+
+@router.get("/fielder/maps/{map_id}/tiles/{z}/{x}/{y}.png")
+async def api_get_fielder_map_tile(map_id: int, z: int, x: int, y: int, request: Request,
+                                   robot_ip: str = IP, v: str = None):
+    """One 256 px tile; z = max_zoom is full resolution"""
+    return await map_file(request, robot_ip, map_id, f"{z}-{x}-{y}", (z, x, y), v)
+
+#---------------- HEALTH --------------------
+
+@router.get("/get/robot_health")
+async def api_get_robot_health():
+    """Telemetry status and command circuit state per robot"""
+    return robot_health.snapshot()
+
+#---------------- LOGGING --------------------
+
+@router.get("/get/log_level")
+async def api_get_log_level():
+    return get_levels()
+
+@router.get("/set/log_level")
+async def api_set_log_level(level: str, name: str = None):
+    """Change a logger level at runtime (root logger if no name given)"""
+    try:
+        return {"status": 200, "name": name or "root", "level": set_level(level, name)}
+    except ValueError as e:
+        return {"status": 400, "msg": str(e)}
+
 #---------------- ANALYTICS ENDPOINTS (PostgreSQL) --------------------
+# Answered through versions.cached_json: a poll with a current ETag gets a
+# 304 without a query. Ranges of finished days depend on no collection.
+# History lists can be long, so PostgreSQL renders them and they are streamed
+# (database.stream_json_array) instead of being built and cached here.
+
+HISTORY_LIMIT = 100000
+
+def range_final(end: datetime.date, delay: float = 0.0) -> bool:
+    """True when no more data can arrive for the UTC days up to `end`"""
+    return end < (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=delay)).date()
 
 @router.get("/get/task_history")
-async def api_get_task_history(robot_id: int = None):
-    return await get_task_history(robot_id)
+async def api_get_task_history(request: Request, robot_id: int = None, limit: int = 100):
+    if not 1 <= limit <= HISTORY_LIMIT:
+        return {"status": 400, "msg": f"limit must be 1-{HISTORY_LIMIT}"}
+    return await conditional_stream(request, ["tasks"], lambda: stream_task_history(robot_id, limit))
+
+@router.get("/get/session_history")
+async def api_get_session_history(request: Request, robot_id: int = None, limit: int = 100):
+    """Online sessions, newest first. Open sessions' durations are at most a minute old"""
+    if not 1 <= limit <= HISTORY_LIMIT:
+        return {"status": 400, "msg": f"limit must be 1-{HISTORY_LIMIT}"}
+    return await conditional_stream(request, ["sessions"], lambda: stream_session_history(robot_id, limit), bucket=60)
+
+@router.get("/get/robots")
+async def api_get_robots(request: Request):
+    """Robot registry from PostgreSQL (ids, serials, addresses and models)"""
+    return await conditional_stream(request, ["robots"], stream_robots)
 
 @router.get("/get/total_distance")
-async def api_get_total_distance(robot_id: int):
-    distance = await get_total_distance(robot_id)
-    return {"robot_id": robot_id, "total_distance_meters": distance}
+async def api_get_total_distance(request: Request, robot_id: int):
+    async def build():
+        distance = await get_total_distance(robot_id)
+        return {"robot_id": robot_id, "total_distance_meters": distance}
+    return await cached_json(request, ["movement"], build)
+
+@router.get("/get/heatmap")
+async def api_get_heatmap(request: Request, start: datetime.date, end: datetime.date = None, robot_ids: List[int] = Query(None), format: str = "png"):
+    """Traffic heatmap summed over a date range (UTC days) and robot set, as png, npy or json"""
+    end = end or start
+    if end < start or (end - start).days > 366:
+        return {"status": 400, "msg": "Date range must be 0-366 days"}
+
+    # Day files take up to FLUSH_INTERVAL to receive the last poses; until
+    # then the heatmap follows movement and is re-read at least that often
+    if range_final(end, heatmaps.FLUSH_INTERVAL):
+        collections, bucket = [], None
+    else:
+        collections, bucket = ["movement"], heatmaps.FLUSH_INTERVAL
+
+    headers = {
+        "X-Heatmap-Bounds": ",".join(str(v) for v in heatmaps.BOUNDS),
+        "X-Heatmap-Resolution": str(heatmaps.RESOLUTION)
+    }
+
+    async def load():
+        return await asyncio.to_thread(heatmaps.load_heatmap, start, end, robot_ids)
+
+    if format == "png":
+        async def build_png():
+            return await asyncio.to_thread(heatmaps.to_png, await load())
+        return await cached_response(request, collections, build_png, media_type="image/png", headers=headers,
+                                     bucket=bucket, compressible=False)
+    if format == "npy":
+        async def build_npy():
+            buffer = io.BytesIO()
+            np.save(buffer, await load())
+            return buffer.getvalue()
+        return await cached_response(request, collections, build_npy, media_type="application/octet-stream",
+                                     headers=headers, bucket=bucket)
+
+    async def build():
+        counts = await load()
+        return {
+            "bounds": heatmaps.BOUNDS,
+            "resolution": heatmaps.RESOLUTION,
+            "total": int(counts.sum()),
+            "counts": counts.tolist()
+        }
+    return await cached_json(request, collections, build, bucket=bucket)
+
+@router.get("/get/trajectory_analytics")
+async def api_get_trajectory_analytics(request: Request, robot_id: int, start: datetime.date, end: datetime.date = None):
+    """Speed profile, moving / idle time, stops and POI dwell per UTC day"""
+    end = end or start
+    if end < start or (end - start).days >= 31:
+        return {"status": 400, "msg": "Date range must be 1-31 days"}
+    # POI dwell follows the saved POIs, also for finished days
+    collections = ["pois"] if range_final(end) else ["movement", "pois"]
+    return await cached_json(request, collections, lambda: trajectory.robot_days(robot_id, start, end))
 
 @router.get("/get/robot_stats")
-async def api_get_robot_stats(robot_id: int):
-    return await get_robot_stats(robot_id)
\ No newline at end of file
+async def api_get_robot_stats(request: Request, robot_id: int):
+    return await cached_json(request, ["tasks", "movement"], lambda: get_robot_stats(robot_id))
\ No newline at end of file
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, APIRouter, HTTPException, WebSocket, Body
+from fastapi import FastAPI, APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Body, Request
 from contextlib import asynccontextmanager
 import httpx
 import websockets
@@ -7,17 +7,13 @@ import hashlib
 import time
 import asyncio
 import json
+from fleet_state import fleet_state
+from cloud import cloud, NOT_CONFIGURED as CLOUD_NOT_CONFIGURED, relay_oversee
 
 router = APIRouter(
     prefix='/edge/v1/robot'
 )
 
-#REST URL
-BASE_URL = "https://apiglobal.autoxing.com"
-
-#WEBSOCKET URL
-WS_URL = "wss://serviceglobal.autoxing.com"
-
 #DIRECT ROBOT URL
 DIRECT_URL = "http://192.168.0.250:8090"
 
@@ -219,103 +215,46 @@ async def mock_websocket():
         #print("Test data",pose_data)
 
 #------------CLOUD ENDPOINTS----------------
+# All cloud calls go through the shared gateway (token cache, pooled client,
+# rate limit, response cache), see cloud.py
 
-async def get_robot_list(token):
-    headers = {
-        "Content-Type": "application/json",
-        "X-Token": f"{token}",
-    }
-
-    payload = {
-        "pageSize": 0,
-        "timestamp": 0,
-    }
-
-    async with httpx.AsyncClient() as client:
-            url = BASE_URL+"/robot/v1.1/list"
-            r = await client.post(url, headers=headers, json= payload)
-            r.raise_for_status()
-            data = r.json()
-            print("LIST OF DATA")
-            print(data)
-
-            return data
+async def get_robot_list():
+    robots = await cloud.robot_list()
+    print(f"Cloud robot list: {len(robots)} robots")
+    return robots
 
-async def get_robot_status(id, token):
-    headers = {
-        "Content-Type": "application/json",
-        "X-Token": f"{token}",
-    }
-
-    async with httpx.AsyncClient() as client:
-        url = BASE_URL+f"/robot/v1.1/{id}/state"
-        r = await client.get(url, headers=headers)
-        r.raise_for_status()
-        data = r.json()
-        print("LIST OF ROBOT DATA")
-        print(data)
+async def get_robot_status(id):
+    return await cloud.robot_state(id)
 
 @router.websocket("/ws/connect")
 async def websocket_endpoint(websocket: WebSocket, robot_id: str):
+    """Relay a cloud robot's oversee messages; the upstream socket is shared with other clients"""
     await websocket.accept()
+    if not cloud.configured:
+        await websocket.send_json(CLOUD_NOT_CONFIGURED)
+        await websocket.close()
+        return
     await websocket.send_text(f"Connecting to robot {robot_id}..")
-    asyncio.create_task(connect_fielder())
-    await websocket.send_text("Connected to Fielder")
-    await websocket.close()
-
-async def connect_fielder():
-    auth_data = main_fastapi.get_token()
-    robot_id = auth_data['robot_id']
-    token = auth_data['token']
-    ws_url = WS_URL+f"/robot-control/oversee/{robot_id}"
-
-    async with websockets.connect(ws_url, subprotocols=[token]) as ws:
-        print("Connect to Fielder Websocket")
-
-        async def heartbeat():
-            while True:
-                await ws.send(json.dumps({"reqType": "onHeartBeat"}))
-                await asyncio.sleep(5)
-
-        asyncio.create_task(heartbeat())
-
-        try:
-            while True:
-                msg = await ws.recv()
-                print("Websocket Message: ", msg)
-        except websockets.exceptions.ConnectionClosed:
-            print("Websocket Connection Closed")
+    try:
+        async with cloud.oversee.subscribe(robot_id) as messages:
+            await websocket.send_text("Connected to Fielder")
+            await relay_oversee(websocket, messages)
+    except WebSocketDisconnect:
+        print("Websocket Connection Closed")
 
 @router.get("/get/robot_status")
 async def get_robot_status_rest(sn: str, request: Request):
     """
     REST endpoint to get robot status by serial number
-    Returns the current status, battery, and location from Redis
+    Returns the current status, battery, and location from the in-memory fleet state
     """
-    redis = request.app.state.redis
-    
     try:
-        # Get data from Redis
-        battery_raw = await redis.get("robot:battery")
-        status = await redis.get("robot:status")
-        poi = await redis.get("robot:last_poi")
-        
-        # Parse battery data if it exists
-        battery_percent = 0
-        if battery_raw:
-            try:
-                battery_data = json.loads(battery_raw)
-                battery_json = json.loads(battery_data["battery"])
-                battery_percent = battery_json.get("percentage", 0) * 100
-            except Exception as e:
-                print(f"Error parsing battery data: {e}")
-                battery_percent = 0
-        
-        # Default values if Redis data is missing
-        if not status:
-            status = "offline"
-        if not poi:
-            poi = "unknown"
+        # Latest state from memory, updated by the ingest loops
+        robot = fleet_state.get_by_sn(sn)
+
+        battery_percent = robot.battery_percent if robot else 0
+        status = robot.status if robot else "offline"
+        poi = (robot.last_poi if robot else None) or "unknown"
         
         # Return in a format compatible with your frontend
         response = {
@@ -0,0 +1,225 @@
+# sharding.py
+"""
+Consistent-hash sharding of robots across ingest worker processes.
+
+Each ingest process is a ShardMember. Members heartbeat into Redis
+(`ingest:members` sorted set scored by last heartbeat, details in
+`ingest:member_info`) and all of them compute the same HashRing over the live
+members. A robot is monitored by the member that owns it on the ring; when a
+member joins or leaves only the robots whose ring owner changed move.
+
+Ownership is additionally guarded by a per-robot lease (`ingest:owner:{id}`),
+so during a rebalance the new owner starts a robot only after the old owner
+released it or its lease expired. Telemetry writes are fenced on that lease.
+"""
+import asyncio
+import bisect
+import hashlib
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from redis.asyncio import Redis
+
+from logger import get_logger
+from telemetry import codec
+
+log = get_logger(__name__)
+
+MEMBERS_KEY = "ingest:members"
+MEMBER_INFO_KEY = "ingest:member_info"
+
+HEARTBEAT_INTERVAL = 2.0
+# A member that missed this many seconds of heartbeats is considered gone
+MEMBER_TTL = 6.0
+# Robot ownership lease, renewed on every heartbeat
+OWNER_LEASE_MS = 6000
+# How often the registered robot list is reloaded from PostgreSQL
+ROBOT_REFRESH_INTERVAL = 30.0
+
+VIRTUAL_NODES = 64
+
+RENEW_OWNER_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_OWNER_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def owner_key(robot_id: int) -> str:
+    return f"ingest:owner:{robot_id}"
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, members: List[str], vnodes: int = VIRTUAL_NODES):
+        self.members = sorted(members)
+        points = []
+        for member in self.members:
+            for i in range(vnodes):
+                points.append((_hash(f"{member}#{i}"), member))
+        points.sort()
+        self._hashes = [h for h, _ in points]
+        self._owners = [m for _, m in points]
+
+    def owner(self, key) -> Optional[str]:
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._owners[index]
+
+    def assign(self, keys) -> Dict[str, List]:
+        """Group keys by owning member"""
+        assignment = {member: [] for member in self.members}
+        for key in keys:
+            owner = self.owner(key)
+            if owner is not None:
+                assignment[owner].append(key)
+        return assignment
+
+
+class ShardMember:
+    def __init__(self,
+                 redis: Redis,
+                 member_id: str,
+                 load_robots: Callable[[], Awaitable[List[dict]]],
+                 start_robot: Callable[[dict], Awaitable],
+                 stop_robot: Callable[[int], Awaitable],
+                 load_stats: Callable[[], dict] = None):
+        self.redis = redis
+        self.member_id = member_id
+        self.load_robots = load_robots
+        self.start_robot = start_robot
+        self.stop_robot = stop_robot
+        self.load_stats = load_stats
+        self.ring = HashRing([])
+        self.robots: Dict[int, dict] = {}
+        self.owned: Set[int] = set()
+        self._robots_loaded_at = 0.0
+        self._renew = redis.register_script(RENEW_OWNER_SCRIPT)
+        self._release = redis.register_script(RELEASE_OWNER_SCRIPT)
+
+    async def heartbeat(self):
+        info = {"robots": sorted(self.owned), "ts": time.time()}
+        if self.load_stats:
+            info["load"] = self.load_stats()
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(MEMBERS_KEY, {self.member_id: time.time()})
+            pipe.hset(MEMBER_INFO_KEY, self.member_id, codec.dumps(info))
+            await pipe.execute()
+
+    async def live_members(self) -> List[str]:
+        cutoff = time.time() - MEMBER_TTL
+        stale = await self.redis.zrangebyscore(MEMBERS_KEY, "-inf", cutoff)
+        if stale:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.zrem(MEMBERS_KEY, *stale)
+                pipe.hdel(MEMBER_INFO_KEY, *stale)
+                await pipe.execute()
+            log.info("Removed stale ingest members: %s", ", ".join(stale))
+        return await self.redis.zrangebyscore(MEMBERS_KEY, cutoff, "+inf")
+
+    async def refresh_robots(self):
+        if time.monotonic() - self._robots_loaded_at < ROBOT_REFRESH_INTERVAL:
+            return
+        self.robots = {robot["id"]: robot for robot in await self.load_robots()}
+        self._robots_loaded_at = time.monotonic()
+
+    async def _release_robot(self, robot_id: int):
+        await self.stop_robot(robot_id)
+        self.owned.discard(robot_id)
+        await self._release(keys=[owner_key(robot_id)], args=[self.member_id])
+
+    async def rebalance(self):
+        members = await self.live_members()
+        if members != self.ring.members:
+            log.info("Ingest ring membership: %s", ", ".join(members))
+            self.ring = HashRing(members)
+
+        desired = {robot_id for robot_id in self.robots if self.ring.owner(robot_id) == self.member_id}
+
+        # Robots that moved to another member (or were deleted)
+        for robot_id in self.owned - desired:
+            log.info("Handing off robot", robot_id=robot_id)
+            await self._release_robot(robot_id)
+
+        # Keep the leases of robots we still own
+        for robot_id in list(self.owned):
+            if not await self._renew(keys=[owner_key(robot_id)], args=[self.member_id, OWNER_LEASE_MS]):
+                log.warning("Lost ownership lease", robot_id=robot_id)
+                await self.stop_robot(robot_id)
+                self.owned.discard(robot_id)
+
+        # Robots assigned to us; the previous owner may still hold the lease
+        for robot_id in desired - self.owned:
+            acquired = await self.redis.set(owner_key(robot_id), self.member_id, nx=True, px=OWNER_LEASE_MS)
+            if acquired:
+                log.info("Taking over robot", robot_id=robot_id)
+                self.owned.add(robot_id)
+                await self.start_robot(self.robots[robot_id])
+
+    async def run(self, shutdown_event: asyncio.Event):
+        log.info("Ingest member %s joined", self.member_id)
+
+        try:
+            while not shutdown_event.is_set():
+                try:
+                    await self.heartbeat()
+                    await self.refresh_robots()
+                    await self.rebalance()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    log.exception("Ingest member error: %s", e, every=10.0)
+
+                try:
+                    await asyncio.wait_for(shutdown_event.wait(), timeout=HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await self.leave()
+
+    async def leave(self):
+        """Stop all monitors, release their leases and leave the ring"""
+        for robot_id in list(self.owned):
+            try:
+                await self._release_robot(robot_id)
+            except Exception as e:
+                log.error("Could not release robot: %s", e, robot_id=robot_id)
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.zrem(MEMBERS_KEY, self.member_id)
+                pipe.hdel(MEMBER_INFO_KEY, self.member_id)
+                await pipe.execute()
+        except Exception as e:
+            log.error("Could not leave ingest ring: %s", e)
+
+        log.info("Ingest member %s left", self.member_id)
+
+
+async def shard_status(redis: Redis, robot_ids: List[int] = None) -> dict:
+    """Live members, their reported load and the ring assignment of robots"""
+    cutoff = time.time() - MEMBER_TTL
+    members = await redis.zrangebyscore(MEMBERS_KEY, cutoff, "+inf")
+    info = await redis.hgetall(MEMBER_INFO_KEY)
+
+    shards = {}
+    for member in members:
+        shards[member] = codec.loads(info[member]) if member in info else {}
+
+    status = {"members": len(members), "shards": shards}
+    if robot_ids is not None:
+        status["assignment"] = HashRing(members).assign(robot_ids)
+    return status
@@ -0,0 +1,315 @@
+# streams.py
+"""
+Redis Streams telemetry log.
+
+Every telemetry message is appended to a capped stream per robot and kind
+(`telemetry:{robot_id}:{kind}`, trimmed with MAXLEN ~). Websocket endpoints
+replay the tail of a stream on connect and then follow it, so late joiners see
+the current state immediately. Database persistence reads pose streams through
+a consumer group and acknowledges entries only after they are written, so a
+restarted worker picks up where it left off. The same pass bins poses into the
+daily heatmaps.
+"""
+import asyncio
+import os
+import socket
+import time
+from typing import Dict, List, Set, Tuple
+
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+
+import numpy as np
+
+from database import record_positions
+from heatmaps import heatmaps
+from sharding import owner_key
+from logger import get_logger
+from telemetry import decode
+
+log = get_logger(__name__)
+
+# Approximate number of entries kept per stream
+STREAM_MAXLEN = {
+    "pose": 1000,
+    "battery": 100,
+    "planning": 100,
+    "status": 100,
+    "lidar": 10
+}
+
+PERSIST_GROUP = "persistence"
+PERSIST_BATCH = 500
+PERSIST_BLOCK_MS = 1000
+
+# Entries pending on another consumer for this long are assumed abandoned
+CLAIM_IDLE_MS = 30000
+CLAIM_INTERVAL = 15.0
+
+# Consumers are named per process, so every restart leaves one behind. Once
+# idle this long with nothing pending they are removed from the group.
+CONSUMER_IDLE_MS = 3600000
+
+# Streams this process already registered in the per-kind index set
+_registered: Set[str] = set()
+
+
+def stream_key(robot_id: int, kind: str) -> str:
+    return f"telemetry:{robot_id}:{kind}"
+
+
+def stream_robot(key: str) -> int:
+    """Robot id of a telemetry stream key"""
+    return int(key.split(":")[1])
+
+
+def index_key(kind: str) -> str:
+    return f"telemetry:streams:{kind}"
+
+
+async def append(redis: Redis, message, payload: bytes) -> str:
+    """Append an encoded telemetry message to its robot/kind stream"""
+    key = stream_key(message.robot_id, message.kind)
+    maxlen = STREAM_MAXLEN.get(message.kind, 100)
+
+    if key in _registered:
+        return await redis.xadd(key, {"d": payload}, maxlen=maxlen, approximate=True)
+
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.xadd(key, {"d": payload}, maxlen=maxlen, approximate=True)
+        pipe.sadd(index_key(message.kind), key)
+        entry_id, _ = await pipe.execute()
+
+    _registered.add(key)
+    return entry_id
+
+
+# Append the items whose robot is still owned by the caller (ARGV[1]); each
+# item is (stream key, maxlen, payload, index key or '', owner lease key)
+FENCED_APPEND_SCRIPT = """
+local rejected = 0
+for i = 2, #ARGV, 5 do
+    if redis.call('GET', ARGV[i + 4]) == ARGV[1] then
+        redis.call('XADD', ARGV[i], 'MAXLEN', '~', ARGV[i + 1], '*', 'd', ARGV[i + 2])
+        if ARGV[i + 3] ~= '' then
+            redis.call('SADD', ARGV[i + 3], ARGV[i])
+        end
+    else
+        rejected = rejected + 1
+    end
+end
+return rejected
+"""
+
+
+async def append_many(redis: Redis, items: List[Tuple[object, bytes]], owner: str = None) -> int:
+    """Append a batch of (message, payload) pairs in a single round trip
+
+    With `owner`, an item is only written while that ingest member still holds
+    the robot's ownership lease, so a member that lost a robot during a
+    rebalance cannot keep writing it. Returns the number of rejected items.
+    """
+    new_keys = set()
+    rejected = 0
+
+    if owner is not None:
+        args = [owner]
+        for message, payload in items:
+            key = stream_key(message.robot_id, message.kind)
+            index = ""
+            if key not in _registered and key not in new_keys:
+                index = index_key(message.kind)
+                new_keys.add(key)
+            args.extend((key, STREAM_MAXLEN.get(message.kind, 100), payload, index, owner_key(message.robot_id)))
+
+        rejected = await redis.eval(FENCED_APPEND_SCRIPT, 0, *args)
+    else:
+        async with redis.pipeline(transaction=False) as pipe:
+            for message, payload in items:
+                key = stream_key(message.robot_id, message.kind)
+                pipe.xadd(key, {"d": payload}, maxlen=STREAM_MAXLEN.get(message.kind, 100), approximate=True)
+                if key not in _registered and key not in new_keys:
+                    pipe.sadd(index_key(message.kind), key)
+                    new_keys.add(key)
+            await pipe.execute()
+
+    if not rejected:
+        _registered.update(new_keys)
+    return rejected
+
+
+async def stream_keys(redis: Redis, kind: str) -> List[str]:
+    """All known streams of a telemetry kind"""
+    return sorted(await redis.smembers(index_key(kind)))
+
+
+async def replay(redis: Redis, keys: List[str], count: int) -> Tuple[List[str], Dict[str, str]]:
+    """Last `count` payloads of each stream (oldest first) and the id to follow from"""
+    payloads = []
+    last_ids = {}
+
+    for key in keys:
+        entries = await redis.xrevrange(key, count=count) if count > 0 else []
+        if entries:
+            last_ids[key] = entries[0][0]
+            payloads.extend(fields["d"] for _, fields in reversed(entries))
+        else:
+            last_ids[key] = "$"
+
+    return payloads, last_ids
+
+
+async def latest_id(redis: Redis, key: str) -> str:
+    """Id of the newest entry of a stream, "0" when it is empty"""
+    entries = await redis.xrevrange(key, count=1)
+    return entries[0][0] if entries else "0"
+
+
+async def follow(redis: Redis, last_ids: Dict[str, str], kind: str = None, block_ms: int = 5000,
+                 with_keys: bool = False):
+    """Yield new payloads from the given streams, starting after last_ids
+
+    With `kind`, streams of robots that appear later are picked up as well,
+    from their newest entry on. With `with_keys`, (stream key, payload) pairs
+    are yielded instead.
+    """
+    # "$" would be re-evaluated on every XREAD and skip entries that arrive
+    # between two calls, so pin it to the current last id once
+    for key, last_id in list(last_ids.items()):
+        if last_id == "$":
+            last_ids[key] = await latest_id(redis, key)
+
+    while True:
+        if kind:
+            for key in await stream_keys(redis, kind):
+                if key not in last_ids:
+                    last_ids[key] = await latest_id(redis, key)
+
+        if not last_ids:
+            await asyncio.sleep(block_ms / 1000)
+            continue
+
+        response = await redis.xread(last_ids, block=block_ms)
+        for key, entries in response or []:
+            for entry_id, fields in entries:
+                last_ids[key] = entry_id
+                yield (key, fields["d"]) if with_keys else fields["d"]
+
+# ============ PERSISTENCE CONSUMER GROUP ============
+
+async def ensure_group(redis: Redis, key: str):
+    try:
+        await redis.xgroup_create(key, PERSIST_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def consumer_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+async def persist_entries(response, prev_pose: Dict[int, Tuple[float, float]]) -> Dict[str, List[str]]:
+    """Write pose entries to PostgreSQL, returning the ids to acknowledge per stream"""
+    rows = []
+    acks: Dict[str, List[str]] = {}
+
+    for key, entries in response:
+        for entry_id, fields in entries:
+            acks.setdefault(key, []).append(entry_id)
+            try:
+                pose = decode(fields["d"])
+            except (KeyError, TypeError, ValueError):
+                continue
+
+            prev = prev_pose.get(pose.robot_id)
+            rows.append((pose.robot_id, pose.x, pose.y, pose.ori,
+                         prev[0] if prev else None, prev[1] if prev else None, pose.ts))
+            prev_pose[pose.robot_id] = (pose.x, pose.y)
+
+    if rows:
+        await record_positions(rows)
+        robot_ids, xs, ys, _, _, _, ts = zip(*rows)
+        heatmaps.add(np.array(robot_ids), np.array(xs), np.array(ys), np.array(ts))
+
+    return acks
+
+
+async def acknowledge(redis: Redis, acks: Dict[str, List[str]]):
+    async with redis.pipeline(transaction=False) as pipe:
+        for key, ids in acks.items():
+            pipe.xack(key, PERSIST_GROUP, *ids)
+        await pipe.execute()
+
+
+async def reclaim_stale(redis: Redis, keys: Set[str], consumer: str, prev_pose: Dict[int, Tuple[float, float]]):
+    """Take over entries left pending by a consumer that died"""
+    for key in keys:
+        result = await redis.xautoclaim(key, PERSIST_GROUP, consumer, min_idle_time=CLAIM_IDLE_MS, count=PERSIST_BATCH)
+        entries = result[1]
+        if entries:
+            log.info("Reclaimed %d stale entries from %s", len(entries), key)
+            await acknowledge(redis, await persist_entries([(key, entries)], prev_pose))
+
+
+async def prune_consumers(redis: Redis, keys: Set[str], consumer: str):
+    """Drop consumers of past processes once their pending entries were reclaimed"""
+    for key in keys:
+        for info in await redis.xinfo_consumers(key, PERSIST_GROUP):
+            if info["name"] != consumer and info["pending"] == 0 and info["idle"] > CONSUMER_IDLE_MS:
+                await redis.xgroup_delconsumer(key, PERSIST_GROUP, info["name"])
+                log.info("Removed idle consumer %s from %s", info["name"], key)
+
+
+async def persistence_worker(redis: Redis, shutdown_event: asyncio.Event, consumer: str = None):
+    """Persist pose streams to PostgreSQL through the consumer group
+
+    The consumer name is new on every start, so entries a previous process
+    read but never acknowledged come back through reclaim_stale after
+    CLAIM_IDLE_MS, whichever worker claims them first.
+    """
+    consumer = consumer or consumer_name()
+    prev_pose: Dict[int, Tuple[float, float]] = {}
+    known: Set[str] = set()
+    last_claim = 0.0
+
+    log.info("Persistence worker %s started", consumer)
+
+    while not shutdown_event.is_set():
+        try:
+            for key in await stream_keys(redis, "pose"):
+                if key not in known:
+                    await ensure_group(redis, key)
+                    known.add(key)
+
+            if not known:
+                await asyncio.sleep(PERSIST_BLOCK_MS / 1000)
+                continue
+
+            if time.monotonic() - last_claim > CLAIM_INTERVAL:
+                last_claim = time.monotonic()
+                await reclaim_stale(redis, known, consumer, prev_pose)
+                await prune_consumers(redis, known, consumer)
+
+            response = await redis.xreadgroup(
+                PERSIST_GROUP, consumer,
+                {key: ">" for key in known},
+                count=PERSIST_BATCH,
+                block=PERSIST_BLOCK_MS
+            )
+
+            if response:
+                await acknowledge(redis, await persist_entries(response, prev_pose))
+
+            # Also while the fleet is idle, so binned counts never wait unbounded
+            if heatmaps.due():
+                await asyncio.to_thread(heatmaps.flush)
+
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            log.exception("Persistence worker error: %s", e)
+            await asyncio.sleep(1)
+
+    await asyncio.to_thread(heatmaps.flush)
+    log.info("Persistence worker %s stopped", consumer)
@@ -0,0 +1,179 @@
+# subscriptions.py
+"""
+Per-client telemetry subscriptions on top of one shared stream reader.
+
+Each worker reads the streams of a telemetry kind with a single XREAD loop.
+The loop starts with the first websocket subscribed to that kind and stops
+when the last one leaves, so the number of clients does not change the
+Redis load. Every client has a Subscription with:
+
+    robots   robot ids to receive (None = all)
+    kinds    telemetry kinds: pose, battery, planning, status, lidar
+    fields   message fields kept next to kind, robot_id and ts (None = all)
+    rate     maximum messages per second per robot and kind (None = as received)
+
+Messages are not queued. A subscription keeps only the newest message per
+robot and kind, and the client's send loop takes them at most once per
+1 / rate. A 1 Hz dashboard gets one pose per robot per second, and a slow
+client gets the latest state instead of a backlog. Messages without a
+projection are forwarded as the payload already stored in the stream, so
+they are not serialised again.
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+from redis.asyncio import Redis
+
+import streams
+from logger import get_logger
+from reconnect import Backoff
+from telemetry import MESSAGE_TYPES, codec
+
+log = get_logger(__name__)
+
+KINDS = tuple(cls.kind for cls in MESSAGE_TYPES)
+
+# Fields every projected message keeps
+BASE_FIELDS = ("kind", "robot_id", "ts")
+
+MAX_RATE = 50.0
+
+
+def parse_list(value: Optional[str]) -> Optional[List[str]]:
+    """Comma separated query parameter -> list (None when empty)"""
+    items = [item.strip() for item in (value or "").split(",") if item.strip()]
+    return items or None
+
+
+class Subscription:
+    def __init__(self, kinds: Iterable[str], robots: Iterable[int] = None,
+                 fields: Iterable[str] = None, rate: float = None):
+        self.kinds = set(kinds)
+        self.robots: Optional[Set[int]] = set(robots) if robots else None
+        self.fields: Optional[Tuple[str, ...]] = tuple(fields) if fields else None
+        self.interval = 1.0 / min(rate, MAX_RATE) if rate and rate > 0 else 0.0
+        self._pending: Dict[Tuple[int, str], str] = {}
+        self._ready = asyncio.Event()
+        self.received = 0
+        self.sent = 0
+        self.superseded = 0
+
+    def wants(self, robot_id: int) -> bool:
+        return self.robots is None or robot_id in self.robots
+
+    def offer(self, robot_id: int, kind: str, payload: str):
+        key = (robot_id, kind)
+        if key in self._pending:
+            self.superseded += 1
+        self._pending[key] = payload
+        self.received += 1
+        self._ready.set()
+
+    def project(self, payload: str) -> str:
+        if self.fields is None:
+            return payload
+        data = codec.loads(payload)
+        return codec.dumps({name: data[name] for name in BASE_FIELDS + self.fields if name in data}).decode()
+
+    async def batches(self) -> AsyncIterator[List[str]]:
+        """Newest pending message per robot and kind, at most once per interval"""
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            next_at = time.monotonic() + self.interval
+
+            batch, self._pending = list(self._pending.values()), {}
+            self.sent += len(batch)
+            yield [self.project(payload) for payload in batch]
+
+            if self.interval:
+                await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+
+    def stats(self) -> dict:
+        return {
+            "kinds": sorted(self.kinds),
+            "robots": sorted(self.robots) if self.robots is not None else "all",
+            "fields": list(self.fields) if self.fields else "all",
+            "rate": round(1 / self.interval, 2) if self.interval else "max",
+            "received": self.received,
+            "sent": self.sent,
+            "superseded": self.superseded
+        }
+
+
+async def history(redis: Redis, subscription: Subscription, count: int) -> List[str]:
+    """Tail of the subscribed streams for a client that just connected"""
+    if count <= 0:
+        return []
+    keys = []
+    for kind in sorted(subscription.kinds):
+        keys.extend(key for key in await streams.stream_keys(redis, kind)
+                    if subscription.wants(streams.stream_robot(key)))
+    payloads, _ = await streams.replay(redis, keys, count)
+    return [subscription.project(payload) for payload in payloads]
+
+
+class TelemetryHub:
+    def __init__(self):
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._readers: Dict[str, asyncio.Task] = {}
+        self.read = 0
+
+    @asynccontextmanager
+    async def subscribe(self, redis: Redis, kinds: Iterable[str], robots: Iterable[int] = None,
+                        fields: Iterable[str] = None, rate: float = None):
+        subscription = Subscription(kinds, robots, fields, rate)
+        unknown = subscription.kinds - set(KINDS)
+        if unknown:
+            raise ValueError(f"Unknown telemetry topics: {', '.join(sorted(unknown))}")
+
+        for kind in subscription.kinds:
+            self._subscribers.setdefault(kind, set()).add(subscription)
+            reader = self._readers.get(kind)
+            if reader is None or reader.done():
+                self._readers[kind] = asyncio.create_task(self._read(redis, kind), name=f"telemetry-hub:{kind}")
+        try:
+            yield subscription
+        finally:
+            for kind in subscription.kinds:
+                subscribers = self._subscribers.get(kind)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[kind]
+                    reader = self._readers.pop(kind, None)
+                    if reader is not None:
+                        reader.cancel()
+
+    async def _read(self, redis: Redis, kind: str):
+        """The one stream reader of a kind in this worker"""
+        backoff = Backoff()
+        while kind in self._subscribers:
+            try:
+                last_ids = {key: "$" for key in await streams.stream_keys(redis, kind)}
+                async for key, payload in streams.follow(redis, last_ids, kind=kind, with_keys=True):
+                    backoff.reset()
+                    self.read += 1
+                    robot_id = streams.stream_robot(key)
+                    for subscription in self._subscribers.get(kind, ()):
+                        if subscription.wants(robot_id):
+                            subscription.offer(robot_id, kind, payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("Telemetry reader for %s failed: %s", kind, e, every=30.0)
+                await asyncio.sleep(backoff.next_delay())
+
+    def stats(self) -> dict:
+        return {
+            "readers": sorted(kind for kind, reader in self._readers.items() if not reader.done()),
+            "read": self.read,
+            "subscriptions": [subscription.stats()
+                              for subscription in {s for subscribers in self._subscribers.values() for s in subscribers}]
+        }
+
+
+telemetry_hub = TelemetryHub()
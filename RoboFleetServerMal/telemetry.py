@@ -0,0 +1,204 @@
+# telemetry.py
+"""
+Typed telemetry messages for robot topics.
+
+Robot frames are decoded exactly once at ingest into compact __slots__
+messages. The message is then encoded once with the active codec and the same
+bytes are stored and published to Redis, so consumers only decode a single
+flat JSON object:
+
+    {"kind": "battery", "robot_id": 1, "ts": 1700000000.0, "percentage": 0.87, ...}
+"""
+import json
+import os
+import time
+from typing import Dict, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ============ CODECS ============
+
+class JsonCodec:
+    """Standard library JSON codec"""
+    name = "json"
+
+    def dumps(self, obj: dict) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+    def loads(self, data: Union[str, bytes]):
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    """orjson codec, several times faster than the standard library"""
+    name = "orjson"
+
+    def dumps(self, obj: dict) -> bytes:
+        return orjson.dumps(obj)
+
+    def loads(self, data: Union[str, bytes]):
+        return orjson.loads(data)
+
+
+CODECS = {"json": JsonCodec}
+if orjson is not None:
+    CODECS["orjson"] = OrjsonCodec
+
+
+def register_codec(codec_cls):
+    """Make an additional codec selectable via TELEMETRY_CODEC"""
+    CODECS[codec_cls.name] = codec_cls
+
+
+def get_codec(name: str = None):
+    """Return the requested codec, or the fastest one installed"""
+    name = name or os.getenv("TELEMETRY_CODEC")
+    if name:
+        if name not in CODECS:
+            raise ValueError(f"Unknown telemetry codec: {name}")
+        return CODECS[name]()
+
+    return OrjsonCodec() if orjson is not None else JsonCodec()
+
+
+codec = get_codec()
+
+# ============ MESSAGE TYPES ============
+
+class Pose:
+    __slots__ = ("robot_id", "ts", "x", "y", "ori")
+    kind = "pose"
+    topic = "/tracked_pose"
+
+    def __init__(self, robot_id: int, ts: float, x: float, y: float, ori: float):
+        self.robot_id = robot_id
+        self.ts = ts
+        self.x = x
+        self.y = y
+        self.ori = ori
+
+    @classmethod
+    def from_frame(cls, robot_id: int, frame: dict, ts: float) -> Optional["Pose"]:
+        pos = frame.get("pos") or []
+        if len(pos) < 2:
+            return None
+        return cls(robot_id, ts, float(pos[0]), float(pos[1]), float(frame.get("ori", 0)))
+
+    def to_dict(self) -> dict:
+        return {"kind": self.kind, "robot_id": self.robot_id, "ts": self.ts,
+                "x": self.x, "y": self.y, "ori": self.ori}
+
+
+class Battery:
+    __slots__ = ("robot_id", "ts", "percentage", "power_supply_status", "voltage", "current")
+    kind = "battery"
+    topic = "/battery_state"
+
+    def __init__(self, robot_id: int, ts: float, percentage: float,
+                 power_supply_status: str = None, voltage: float = None, current: float = None):
+        self.robot_id = robot_id
+        self.ts = ts
+        self.percentage = percentage
+        self.power_supply_status = power_supply_status
+        self.voltage = voltage
+        self.current = current
+
+    @classmethod
+    def from_frame(cls, robot_id: int, frame: dict, ts: float) -> "Battery":
+        return cls(robot_id, ts, float(frame.get("percentage", 0)),
+                   frame.get("power_supply_status"), frame.get("voltage"), frame.get("current"))
+
+    def to_dict(self) -> dict:
+        return {"kind": self.kind, "robot_id": self.robot_id, "ts": self.ts,
+                "percentage": self.percentage, "power_supply_status": self.power_supply_status,
+                "voltage": self.voltage, "current": self.current}
+
+
+class PlanningState:
+    __slots__ = ("robot_id", "ts", "move_state", "action_id", "fail_reason", "remaining_distance")
+    kind = "planning"
+    topic = "/planning_state"
+
+    def __init__(self, robot_id: int, ts: float, move_state: str, action_id=None,
+                 fail_reason: str = None, remaining_distance: float = 0.0):
+        self.robot_id = robot_id
+        self.ts = ts
+        self.move_state = move_state
+        self.action_id = action_id
+        self.fail_reason = fail_reason
+        self.remaining_distance = remaining_distance
+
+    @classmethod
+    def from_frame(cls, robot_id: int, frame: dict, ts: float) -> "PlanningState":
+        return cls(robot_id, ts, frame.get("move_state"), frame.get("action_id"),
+                   frame.get("fail_reason_str", "none"), float(frame.get("remaining_distance") or 0.0))
+
+    def to_dict(self) -> dict:
+        return {"kind": self.kind, "robot_id": self.robot_id, "ts": self.ts,
+                "move_state": self.move_state, "action_id": self.action_id,
+                "fail_reason": self.fail_reason, "remaining_distance": self.remaining_distance}
+
+
+class Lidar:
+    __slots__ = ("robot_id", "ts", "points")
+    kind = "lidar"
+    topic = "/scan_matched_points2"
+
+    def __init__(self, robot_id: int, ts: float, points: list):
+        self.robot_id = robot_id
+        self.ts = ts
+        self.points = points
+
+    @classmethod
+    def from_frame(cls, robot_id: int, frame: dict, ts: float) -> "Lidar":
+        return cls(robot_id, ts, frame.get("points") or [])
+
+    def to_dict(self) -> dict:
+        return {"kind": self.kind, "robot_id": self.robot_id, "ts": self.ts, "points": self.points}
+
+
+class Status:
+    __slots__ = ("robot_id", "ts", "status")
+    kind = "status"
+    topic = None
+
+    def __init__(self, robot_id: int, ts: float, status: str):
+        self.robot_id = robot_id
+        self.ts = ts
+        self.status = status
+
+    def to_dict(self) -> dict:
+        return {"kind": self.kind, "robot_id": self.robot_id, "ts": self.ts, "status": self.status}
+
+
+MESSAGE_TYPES = (Pose, Battery, PlanningState, Lidar, Status)
+
+BY_TOPIC: Dict[str, type] = {cls.topic: cls for cls in MESSAGE_TYPES if cls.topic}
+BY_KIND: Dict[str, type] = {cls.kind: cls for cls in MESSAGE_TYPES}
+
+# ============ ENCODE / DECODE ============
+
+def decode_frame(robot_id: int, raw: Union[str, bytes], ts: float = None):
+    """Decode a raw robot websocket frame into a message (None for other topics)"""
+    frame = codec.loads(raw)
+    cls = BY_TOPIC.get(frame.get("topic"))
+    if cls is None:
+        return None
+    return cls.from_frame(robot_id, frame, ts or time.time())
+
+
+def encode(message) -> bytes:
+    """Encode a message for Redis / websocket clients"""
+    return codec.dumps(message.to_dict())
+
+
+def decode(data: Union[str, bytes]):
+    """Decode a message previously produced by encode()"""
+    fields = codec.loads(data)
+    cls = BY_KIND.get(fields.pop("kind", None))
+    if cls is None:
+        raise ValueError("Not a telemetry message")
+    return cls(**fields)
@@ -0,0 +1,235 @@
+# teleop.py
+"""
+Low-latency teleoperation over one pooled robot connection.
+
+Every operator session used to open its own robot websocket. A RobotLink keeps
+a single `/ws/v2/topics` connection per robot that all sessions share. A
+TeleopSession stores only the newest joystick value (bursts are coalesced) and
+a fixed-rate sender forwards it to the robot. When no operator update arrives
+within the deadman timeout, zero velocity is sent and the robot stops.
+
+Control latency is measured as the time between sending a /twist and the next
+/twist_feedback frame from the robot.
+"""
+import asyncio
+import json
+import time
+from typing import Callable, Dict, List, Optional
+
+import websockets
+
+from logger import get_logger
+
+log = get_logger(__name__)
+
+DEFAULT_RATE_HZ = 10.0
+MAX_RATE_HZ = 30.0
+DEFAULT_DEADMAN_MS = 500
+# Zero velocity is repeated a few times so a single lost frame cannot keep the robot moving
+STOP_REPEAT = 3
+
+
+def twist(linear: float, angular: float) -> str:
+    return json.dumps({"topic": "/twist", "linear_velocity": linear, "angular_velocity": angular})
+
+
+class RobotLink:
+    """One shared robot topic connection, reference counted by its sessions"""
+
+    def __init__(self, ip: str):
+        self.ip = ip
+        self.url = f"ws://{ip}:8090/ws/v2/topics"
+        self.users = 0
+        self._ws = None
+        self._reader: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._listeners: List[Callable[[dict], None]] = []
+
+    @property
+    def connected(self) -> bool:
+        return self._ws is not None and self._reader is not None and not self._reader.done()
+
+    def on_frame(self, listener: Callable[[dict], None]):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[dict], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    async def connect(self):
+        async with self._lock:
+            if self.connected:
+                return
+
+            self._ws = await websockets.connect(self.url, ping_interval=20, ping_timeout=10, open_timeout=5)
+            await self._ws.send(json.dumps({"disable_topic": ["/slam/state"]}))
+            await self._ws.send(json.dumps({"enable_topic": ["/twist_feedback"]}))
+            self._reader = asyncio.create_task(self._read(self._ws), name=f"teleop:{self.ip}")
+            log.info("Teleop link connected to %s", self.url)
+
+    async def _read(self, ws):
+        try:
+            async for raw in ws:
+                try:
+                    frame = json.loads(raw)
+                except ValueError:
+                    continue
+                for listener in list(self._listeners):
+                    listener(frame)
+        except websockets.exceptions.ConnectionClosed as e:
+            log.warning("Teleop link to %s closed: %s", self.ip, e)
+
+    async def send(self, payload: str):
+        if not self.connected:
+            await self.connect()
+        await self._ws.send(payload)
+
+    async def reconnect(self):
+        """Drop a broken connection and open a new one"""
+        try:
+            await self.close()
+        except Exception as e:
+            log.debug("Closing teleop link to %s failed: %s", self.ip, e)
+        await self.connect()
+
+    async def close(self):
+        if self._reader:
+            self._reader.cancel()
+        if self._ws:
+            await self._ws.close()
+        self._ws = None
+        self._reader = None
+        log.info("Teleop link to %s closed", self.ip)
+
+
+_links: Dict[str, RobotLink] = {}
+
+
+async def acquire_link(ip: str) -> RobotLink:
+    link = _links.get(ip)
+    if link is None:
+        link = _links[ip] = RobotLink(ip)
+    link.users += 1
+    try:
+        await link.connect()
+    except Exception:
+        await release_link(link)
+        raise
+    return link
+
+
+async def release_link(link: RobotLink):
+    link.users -= 1
+    if link.users <= 0:
+        _links.pop(link.ip, None)
+        await link.close()
+
+
+def link_stats() -> dict:
+    return {ip: {"users": link.users, "connected": link.connected} for ip, link in _links.items()}
+
+
+class TeleopSession:
+    def __init__(self, link: RobotLink, rate_hz: float = DEFAULT_RATE_HZ, deadman_ms: int = DEFAULT_DEADMAN_MS):
+        self.link = link
+        self.interval = 1.0 / min(max(rate_hz, 1.0), MAX_RATE_HZ)
+        self.deadman = deadman_ms / 1000
+        self.linear = 0.0
+        self.angular = 0.0
+        self.seq = 0
+        self.last_update = 0.0
+        self.stopped = True
+        self.received = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.deadman_stops = 0
+        self.rtt_ms: Optional[float] = None
+        self.error: Optional[str] = None
+        self._dirty = False
+        self._sent_at: Optional[float] = None
+        self.link.on_frame(self._on_frame)
+
+    def update(self, linear: float, angular: float, seq: int = None):
+        """Store the newest operator command; older unsent values are superseded"""
+        if self._dirty:
+            self.coalesced += 1
+        self.linear = linear
+        self.angular = angular
+        self.seq = seq if seq is not None else self.seq + 1
+        self.last_update = time.monotonic()
+        self.received += 1
+        self._dirty = True
+
+    def _on_frame(self, frame: dict):
+        if frame.get("topic") == "/twist_feedback" and self._sent_at is not None:
+            self.rtt_ms = round((time.perf_counter() - self._sent_at) * 1000, 1)
+            self._sent_at = None
+
+    async def _send(self, linear: float, angular: float):
+        await self.link.send(twist(linear, angular))
+        self._sent_at = time.perf_counter()
+        self.sent += 1
+
+    async def stop(self):
+        self.linear = self.angular = 0.0
+        for _ in range(STOP_REPEAT):
+            await self._send(0.0, 0.0)
+        self.stopped = True
+        self._dirty = False
+
+    async def run(self):
+        """
+        Forward the latest command at the control rate until cancelled.
+
+        A failed send reconnects the link once and the command is sent again on
+        the next tick. When that fails too, `error` is set and run() returns.
+        """
+        reconnected = False
+        while True:
+            started = time.monotonic()
+
+            try:
+                if self.last_update and started - self.last_update > self.deadman:
+                    if not self.stopped:
+                        log.warning("Teleop deadman timeout, stopping robot", every=5.0)
+                        await self.stop()
+                        self.deadman_stops += 1
+                elif self._dirty or not self.stopped:
+                    # The robot expects a continuous command stream while driving
+                    await self._send(self.linear, self.angular)
+                    self.stopped = self.linear == 0 and self.angular == 0
+                    self._dirty = False
+                reconnected = False
+            except Exception as e:
+                if reconnected:
+                    self.error = f"Robot link lost: {e}"
+                    log.error("Teleop send to %s failed after reconnect: %s", self.link.ip, e)
+                    return
+                log.warning("Teleop send to %s failed, reconnecting: %s", self.link.ip, e)
+                reconnected = True
+                try:
+                    await self.link.reconnect()
+                except Exception as e:
+                    self.error = f"Robot link lost: {e}"
+                    log.error("Teleop reconnect to %s failed: %s", self.link.ip, e)
+                    return
+                continue
+
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    async def close(self):
+        self.link.remove_listener(self._on_frame)
+        try:
+            await self.stop()
+        except Exception as e:
+            log.error("Could not send teleop stop: %s", e)
+
+    def stats(self) -> dict:
+        return {
+            "seq": self.seq,
+            "received": self.received,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "deadman_stops": self.deadman_stops,
+            "rtt_ms": self.rtt_ms
+        }
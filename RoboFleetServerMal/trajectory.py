@@ -0,0 +1,258 @@
+# trajectory.py
+"""
+Trajectory analytics over robot_movement.
+
+A robot-day is fetched as three columns (one array_agg row, not one Python
+object per sample) and turned into NumPy arrays. Everything below works on
+the segments between consecutive samples:
+
+    speed profile  - percentiles and a histogram of segment speeds while moving
+    moving / idle  - time in segments above / below MOVING_SPEED
+    stops          - runs of idle segments lasting at least MIN_STOP_SECONDS
+    POI dwell      - time spent within POI_RADIUS of each saved POI
+
+Gaps longer than MAX_GAP_SECONDS (robot offline, ingest down) count as
+neither moving nor idle. The analysis is CPU-bound and runs in a thread.
+
+Results are cached per (robot, UTC day, POI version): past days until the
+saved POIs change (bounded LRU), the current day for TODAY_TTL seconds.
+Without Redis the POI version is unknown and every day expires like today.
+"""
+import asyncio
+import datetime
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+from pymongo import MongoClient
+
+from database import get_trajectory_columns
+from logger import get_logger
+from versions import versions
+
+log = get_logger(__name__)
+
+mongo_client = MongoClient("mongodb://localhost:27017/")
+poi_col = mongo_client["robotDB"]["poi"]
+
+MOVING_SPEED = 0.05        # m/s
+MAX_GAP_SECONDS = 30.0
+MIN_STOP_SECONDS = 10.0
+POI_RADIUS = 0.5           # m
+SPEED_BINS = np.arange(0.0, 2.05, 0.1)
+
+CACHE_SIZE = 512
+TODAY_TTL = 60.0
+
+
+def load_pois() -> Tuple[List[str], np.ndarray]:
+    """Saved POI names and their (x, y) targets"""
+    names, points = [], []
+    for poi in poi_col.find({}, {"name": 1, "data": 1}):
+        data = poi.get("data") or {}
+        if "target_x" in data and "target_y" in data:
+            names.append(poi["name"])
+            points.append((data["target_x"], data["target_y"]))
+    return names, np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+
+def _runs(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Start and end (exclusive) indexes of the True runs in a boolean array"""
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def analyze(ts: np.ndarray, xs: np.ndarray, ys: np.ndarray,
+            poi_names: List[str], poi_points: np.ndarray) -> dict:
+    """Metrics for one time-ordered trajectory (blocking)"""
+    result = {
+        "samples": int(len(ts)),
+        "distance": 0.0,
+        "moving_seconds": 0.0,
+        "idle_seconds": 0.0,
+        "untracked_seconds": 0.0,
+        "speed": None,
+        "stops": [],
+        "poi_dwell": {}
+    }
+    if len(ts) < 2:
+        return result
+
+    dt = np.diff(ts)
+    ds = np.hypot(np.diff(xs), np.diff(ys))
+    valid = (dt > 0) & (dt <= MAX_GAP_SECONDS)
+    speed = np.divide(ds, dt, out=np.zeros_like(ds), where=valid)
+    moving = valid & (speed >= MOVING_SPEED)
+    idle = valid & ~moving
+
+    result["distance"] = round(float(ds[valid].sum()), 2)
+    result["moving_seconds"] = round(float(dt[moving].sum()), 1)
+    result["idle_seconds"] = round(float(dt[idle].sum()), 1)
+    result["untracked_seconds"] = round(float(dt[~valid].sum()), 1)
+
+    if moving.any():
+        moving_speed = speed[moving]
+        p50, p90, p99 = np.percentile(moving_speed, [50, 90, 99])
+        histogram, _ = np.histogram(np.minimum(moving_speed, SPEED_BINS[-1]), bins=SPEED_BINS,
+                                    weights=dt[moving])
+        result["speed"] = {
+            "mean": round(float(ds[moving].sum() / dt[moving].sum()), 3),
+            "p50": round(float(p50), 3),
+            "p90": round(float(p90), 3),
+            "p99": round(float(p99), 3),
+            "max": round(float(moving_speed.max()), 3),
+            "bin_width": float(SPEED_BINS[1] - SPEED_BINS[0]),
+            "seconds_per_bin": np.round(histogram, 1).tolist()
+        }
+
+    # Segment i spans samples i..i+1; an idle run from segment a to b spans samples a..b
+    starts, ends = _runs(idle)
+    if len(starts):
+        elapsed = np.concatenate([[0.0], np.cumsum(np.where(idle, dt, 0.0))])
+        durations = elapsed[ends] - elapsed[starts]
+        keep = durations >= MIN_STOP_SECONDS
+        for a, b, duration in zip(starts[keep], ends[keep], durations[keep]):
+            result["stops"].append({
+                "start": float(ts[a]),
+                "end": float(ts[b]),
+                "seconds": round(float(duration), 1),
+                "x": round(float(xs[a:b + 1].mean()), 3),
+                "y": round(float(ys[a:b + 1].mean()), 3)
+            })
+
+    if len(poi_names):
+        # Nearest POI within radius for the start of every segment, -1 for none.
+        # One pass per POI keeps memory at O(samples) rather than samples x POIs.
+        at_poi = np.full(len(dt), -1, dtype=np.int64)
+        best = np.full(len(dt), POI_RADIUS ** 2)
+        for i, (px, py) in enumerate(poi_points):
+            d2 = (xs[:-1] - px) ** 2 + (ys[:-1] - py) ** 2
+            closer = d2 <= best
+            at_poi[closer] = i
+            best[closer] = d2[closer]
+        counted = valid & (at_poi >= 0)
+
+        seconds = np.bincount(at_poi[counted], weights=dt[counted], minlength=len(poi_names))
+        # A visit starts where the POI differs from the previous segment's
+        entered = counted & np.concatenate([[True], at_poi[1:] != at_poi[:-1]])
+        visits = np.bincount(at_poi[entered], minlength=len(poi_names))
+
+        for i in np.flatnonzero(seconds):
+            result["poi_dwell"][poi_names[i]] = {"seconds": round(float(seconds[i]), 1), "visits": int(visits[i])}
+
+    return result
+
+
+def day_range(day: datetime.date) -> Tuple[datetime.datetime, datetime.datetime]:
+    start = datetime.datetime.combine(day, datetime.time(), datetime.timezone.utc)
+    return start, start + datetime.timedelta(days=1)
+
+
+class TrajectoryCache:
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self._entries: "OrderedDict[tuple, Tuple[float, dict]]" = OrderedDict()
+        self.loading: Dict[tuple, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple, today: bool):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if today and time.monotonic() - stored_at > TODAY_TTL:
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: tuple, value: dict):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+trajectory_cache = TrajectoryCache()
+
+
+async def _compute_day(robot_id: int, day: datetime.date) -> dict:
+    start, end = day_range(day)
+    columns = await get_trajectory_columns(robot_id, start, end)
+
+    def run():
+        ts, xs, ys = (np.asarray(column, dtype=np.float64) for column in columns)
+        poi_names, poi_points = load_pois()
+        return analyze(ts, xs, ys, poi_names, poi_points)
+
+    started = time.perf_counter()
+    result = await asyncio.to_thread(run)
+    log.debug("Analyzed %d samples for %s in %.0f ms", result["samples"], day,
+              (time.perf_counter() - started) * 1000, robot_id=robot_id)
+    return {"robot_id": robot_id, "day": day.isoformat(), **result}
+
+
+async def pois_version():
+    """Version of the saved POIs the dwell times depend on, None when unknown"""
+    try:
+        counters = await versions.get(["pois"])
+    except Exception as e:
+        log.warning("POI version unavailable: %s", e, every=60.0)
+        return None
+    return counters["pois"] if counters else None
+
+
+async def robot_day(robot_id: int, day: datetime.date, poi_version: int = None) -> dict:
+    """Cached analytics for one robot and UTC day, as of `poi_version` of the POIs"""
+    key = (robot_id, day, poi_version)
+    today = poi_version is None or day >= datetime.datetime.now(datetime.timezone.utc).date()
+    cached = trajectory_cache.get(key, today)
+    if cached is not None:
+        trajectory_cache.hits += 1
+        return cached
+
+    # Concurrent requests for the same day share one computation
+    loading = trajectory_cache.loading.get(key)
+    if loading is not None:
+        return await asyncio.shield(loading)
+
+    trajectory_cache.misses += 1
+    loading = trajectory_cache.loading[key] = asyncio.ensure_future(_compute_day(robot_id, day))
+    try:
+        result = await asyncio.shield(loading)
+        trajectory_cache.put(key, result)
+        return result
+    finally:
+        trajectory_cache.loading.pop(key, None)
+
+
+async def robot_days(robot_id: int, start: datetime.date, end: datetime.date) -> dict:
+    """Per-day analytics for a date range plus totals of the additive metrics"""
+    poi_version = await pois_version()
+    days = [await robot_day(robot_id, start + datetime.timedelta(days=i), poi_version)
+            for i in range((end - start).days + 1)]
+
+    dwell: Dict[str, dict] = {}
+    for day in days:
+        for name, poi in day["poi_dwell"].items():
+            total = dwell.setdefault(name, {"seconds": 0.0, "visits": 0})
+            total["seconds"] = round(total["seconds"] + poi["seconds"], 1)
+            total["visits"] += poi["visits"]
+
+    return {
+        "robot_id": robot_id,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "totals": {
+            "distance": round(sum(day["distance"] for day in days), 2),
+            "moving_seconds": round(sum(day["moving_seconds"] for day in days), 1),
+            "idle_seconds": round(sum(day["idle_seconds"] for day in days), 1),
+            "stops": sum(len(day["stops"]) for day in days),
+            "poi_dwell": dwell
+        },
+        "days": days
+    }
@@ -0,0 +1,347 @@
+# versions.py
+"""
+Collection versions, ETags and compressed JSON for the list endpoints.
+
+Writers bump a counter per collection after the write has committed:
+
+    await versions.bump("tasks")
+
+The counters are fields of one Redis hash, so API workers and the ingest
+process share them. An endpoint names the collections its body depends on,
+and its strong ETag is built from their counters plus the path and query:
+
+    GET /get/task_history?robot_id=3     If-None-Match: "5c1e07a2-tasks41-8d0f6a1b93e2"
+    -> 304 after one HMGET, MongoDB / PostgreSQL are not queried
+
+Counters are read before the query, so a body is never labelled newer than
+its data. The hash also holds a random epoch: counters restarting after
+Redis lost its data never reproduce an ETag a client already has.
+
+A body is serialised once per ETag and kept in a small LRU together with its
+gzip and brotli encodings (brotli when the package is installed), so clients
+polling without If-None-Match cost neither a query nor a compression. Bodies
+under MIN_COMPRESS bytes are sent uncompressed.
+
+Results too large to hold (database.stream_json_array) go through
+conditional_stream instead: the same ETag and 304, then the chunks are
+compressed as they are sent and nothing is cached. A client that takes longer
+than STREAM_SEND_TIMEOUT to accept a chunk is dropped, so the database
+connection behind the stream is released.
+"""
+import asyncio
+import gzip
+import hashlib
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from redis.asyncio import Redis
+
+from logger import get_logger
+from telemetry import codec
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+log = get_logger(__name__)
+
+VERSIONS_KEY = "versions"
+EPOCH_FIELD = "_epoch"
+
+MIN_COMPRESS = 1024
+CACHE_SIZE = 128
+STREAM_SEND_TIMEOUT = 30.0
+
+# Preferred first
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Best encoding the client accepts (q > 0), None for identity"""
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip()] = q
+
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison as RFC 9110 asks for If-None-Match, ignoring the coding suffix"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    base = etag.strip('"')
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        for encoding in ENCODINGS:
+            tag = tag.removesuffix(f"-{encoding}")
+        if tag == base:
+            return True
+    return False
+
+
+class CollectionVersions:
+    def __init__(self):
+        self.redis: Optional[Redis] = None
+        self.bumps = 0
+        self.failed_bumps = 0
+
+    def attach(self, redis: Redis):
+        self.redis = redis
+
+    async def bump(self, *names: str):
+        """Mark collections as changed. A failed bump is logged, never raised into the write"""
+        if self.redis is None:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for name in names:
+                    pipe.hincrby(VERSIONS_KEY, name, 1)
+                await pipe.execute()
+            self.bumps += len(names)
+        except Exception as e:
+            self.failed_bumps += 1
+            log.warning("Version bump of %s failed: %s", ", ".join(names), e, every=30.0)
+
+    async def get(self, names: Iterable[str]) -> Optional[Dict[str, int]]:
+        """Current counters plus the epoch, None without Redis"""
+        if self.redis is None:
+            return None
+        names = list(names)
+        values = await self.redis.hmget(VERSIONS_KEY, EPOCH_FIELD, *names)
+        if values[0] is None:
+            await self.redis.hsetnx(VERSIONS_KEY, EPOCH_FIELD, uuid.uuid4().hex[:8])
+            values = await self.redis.hmget(VERSIONS_KEY, EPOCH_FIELD, *names)
+        counters = {EPOCH_FIELD: values[0]}
+        counters.update((name, int(value or 0)) for name, value in zip(names, values[1:]))
+        return counters
+
+    async def etag(self, names: Iterable[str], key: str) -> Optional[str]:
+        counters = await self.get(names)
+        if counters is None:
+            return None
+        epoch = counters.pop(EPOCH_FIELD)
+        digest = hashlib.blake2b(key.encode(), digest_size=6).hexdigest()
+        return f'"{epoch}-{".".join(f"{name}{value}" for name, value in counters.items())}-{digest}"'
+
+
+class ResponseCache:
+    """LRU of serialised bodies and their encodings by ETag"""
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self._entries: "OrderedDict[str, Dict[str, bytes]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.uncacheable = 0
+        self.streamed = 0
+        self.stalled = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def get(self, etag: str) -> Optional[Dict[str, bytes]]:
+        entry = self._entries.get(etag)
+        if entry is not None:
+            self._entries.move_to_end(etag)
+        return entry
+
+    def put(self, etag: str, entry: Dict[str, bytes]):
+        self._entries[etag] = entry
+        self._entries.move_to_end(etag)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses + self.not_modified
+        return {
+            "entries": len(self._entries),
+            "not_modified": self.not_modified,
+            "hits": self.hits,
+            "misses": self.misses,
+            "uncacheable": self.uncacheable,
+            "streamed": self.streamed,
+            "stalled": self.stalled,
+            "hit_rate": round((self.hits + self.not_modified) / requests, 3) if requests else None,
+            "compression_ratio": round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None,
+            "encodings": list(ENCODINGS),
+            "bumps": versions.bumps,
+            "failed_bumps": versions.failed_bumps
+        }
+
+
+versions = CollectionVersions()
+response_cache = ResponseCache()
+
+
+async def cached_json(request: Request, collections: Iterable[str], build: Callable[[], Awaitable],
+                      bucket: float = None) -> Response:
+    """JSON response for a body that only changes with `collections`"""
+    async def body() -> bytes:
+        return codec.dumps(jsonable_encoder(await build()))
+    return await cached_response(request, collections, body, bucket=bucket)
+
+
+async def request_etag(request: Request, collections: Iterable[str], bucket: float = None) -> Optional[str]:
+    """ETag of the request's path and query at the current collection versions, None without Redis"""
+    key = request.url.path + "?" + "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    if bucket:
+        key += f"#{int(time.time() // bucket)}"
+    try:
+        return await versions.etag(collections, key)
+    except Exception as e:
+        log.warning("Collection versions unavailable: %s", e, every=60.0)
+        return None
+
+
+def representation_etag(etag: str, encoding: Optional[str]) -> str:
+    # Each coding is its own representation, so it gets its own strong ETag
+    return f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+
+async def cached_response(request: Request, collections: Iterable[str], build: Callable[[], Awaitable[bytes]],
+                          media_type: str = "application/json", headers: Dict[str, str] = None,
+                          bucket: float = None, compressible: bool = True) -> Response:
+    """
+    Response with a strong ETag from the versions of `collections`, 304 when
+    the client already has it.
+
+    `bucket` (seconds) also rolls the ETag over with time, for bodies that
+    follow data without a version of its own.
+    """
+    etag = await request_etag(request, collections, bucket)
+
+    headers = {**(headers or {}), "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if etag is not None and etag_matches(request.headers.get("if-none-match", ""), etag):
+        response_cache.not_modified += 1
+        headers["ETag"] = etag
+        return Response(status_code=304, headers=headers)
+
+    entry = response_cache.get(etag) if etag is not None else None
+    if entry is None:
+        entry = {"identity": await build()}
+        if etag is None:
+            response_cache.uncacheable += 1
+        else:
+            response_cache.misses += 1
+            response_cache.put(etag, entry)
+    else:
+        response_cache.hits += 1
+
+    body = entry["identity"]
+    encoding = None
+    if compressible and len(body) >= MIN_COMPRESS:
+        encoding = negotiate(request.headers.get("accept-encoding", ""))
+    if encoding is not None:
+        if encoding not in entry:
+            entry[encoding] = compress(body, encoding)
+        body = entry[encoding]
+        headers["Content-Encoding"] = encoding
+
+    if etag is not None:
+        headers["ETag"] = representation_etag(etag, encoding)
+    response_cache.bytes_in += len(entry["identity"])
+    response_cache.bytes_out += len(body)
+    return Response(body, media_type=media_type, headers=headers)
+
+
+class StreamCompressor:
+    """Incremental gzip / brotli for bodies of unknown length"""
+
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=5)
+            self._process, self._finish = self._compressor.process, self._compressor.finish
+        else:
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            self._process, self._finish = self._compressor.compress, self._compressor.flush
+
+    def process(self, chunk: bytes) -> bytes:
+        return self._process(chunk)
+
+    def finish(self) -> bytes:
+        return self._finish()
+
+
+class TimedStreamingResponse(StreamingResponse):
+    """StreamingResponse that drops clients which stop reading, and closes its iterator either way"""
+
+    async def stream_response(self, send):
+        async def timed_send(message):
+            await asyncio.wait_for(send(message), STREAM_SEND_TIMEOUT)
+
+        try:
+            await super().stream_response(timed_send)
+        except asyncio.TimeoutError:
+            response_cache.stalled += 1
+            log.warning("Stream client stalled for %.0fs, dropped", STREAM_SEND_TIMEOUT, every=30.0)
+        finally:
+            await self.body_iterator.aclose()
+
+
+async def conditional_stream(request: Request, collections: Iterable[str], chunks: Callable[[], AsyncIterator[bytes]],
+                             media_type: str = "application/json", bucket: float = None) -> Response:
+    """
+    Like cached_response for bodies too large to hold: 304 when the ETag
+    matches, otherwise `chunks()` is streamed (and compressed on the fly)
+    without being cached.
+    """
+    etag = await request_etag(request, collections, bucket)
+
+    headers = {"Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if etag is not None and etag_matches(request.headers.get("if-none-match", ""), etag):
+        response_cache.not_modified += 1
+        headers["ETag"] = etag
+        return Response(status_code=304, headers=headers)
+
+    response_cache.streamed += 1
+    encoding = negotiate(request.headers.get("accept-encoding", ""))
+    if etag is not None:
+        headers["ETag"] = representation_etag(etag, encoding)
+    if encoding is None:
+        return TimedStreamingResponse(chunks(), media_type=media_type, headers=headers)
+
+    async def compressed():
+        compressor = StreamCompressor(encoding)
+        async with aclosing(chunks()) as body:
+            async for chunk in body:
+                data = compressor.process(chunk)
+                response_cache.bytes_in += len(chunk)
+                response_cache.bytes_out += len(data)
+                if data:
+                    yield data
+        data = compressor.finish()
+        response_cache.bytes_out += len(data)
+        yield data
+
+    headers["Content-Encoding"] = encoding
+    return TimedStreamingResponse(compressed(), media_type=media_type, headers=headers)